@@ -1,22 +1,56 @@
 import sys
+import time
 import socket
 import threading
-import subprocess
+from collections import deque
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QLineEdit, 
                              QPushButton, QVBoxLayout, QTextBrowser, 
                              QInputDialog, QHBoxLayout)
 from PyQt5.QtGui import QFont
+from PyQt5.QtCore import pyqtSignal
+
+import chat_protocol as proto
+from gui_log import MessageSink, LogView
+from reconnect import Backoff
+from camera_launcher import CameraLauncher
+
+SERVER_ADDRESS = ('10.200.236.220', 5555)  # Change to the appropriate server IP and port
+HISTORY_BACKLOG = 100  # messages replayed when first joining
+OUTBOX_LIMIT = 200  # frames kept while disconnected; the oldest are dropped beyond this
+CAMERA_MODE = "prewarm"  # how Join Video Call starts camera.py, see camera_launcher.py
 
 class ClientGUI(QMainWindow):
+    # Emitted from the receive thread when a resume is refused and the
+    # password has to be asked for again on the GUI thread
+    login_required = pyqtSignal()
+    # Emitted from the connecting thread once the server accepted the connection
+    server_reached = pyqtSignal()
+    # Emitted from the receive thread when the server kicks us
+    kicked = pyqtSignal()
+
     def __init__(self):
         super().__init__()
 
-        self.initUI()
-        self.setupSocket()
-        self.authenticate()
+        self.last_seq = 0  # newest server sequence number seen, kept across reconnects
+        self.resume_token = None
+        self.username = None
+        # The server puts every client in the default room after AUTH_SUCCESS
+        self.rooms = {proto.DEFAULT_ROOM}
+        self.current_room = proto.DEFAULT_ROOM
+        self.connected = False
+        self.closing = False
+        self.removed = False  # kicked: nothing is sent or queued any more
+        self.client_socket = None  # set by setupSocket on the connecting thread
+        self.send_lock = threading.Lock()  # guards client_socket writes, outbox and connected
+        self.outbox = deque(maxlen=OUTBOX_LIMIT)
+        self.backoff = Backoff()
+        self.camera = CameraLauncher(CAMERA_MODE)  # warms up while the user logs in
 
-        self.receive_thread = threading.Thread(target=self.receive_messages)
-        self.receive_thread.start()
+        self.initUI()
+        self.login_required.connect(self.login)
+        self.server_reached.connect(self.finish_login)
+        self.kicked.connect(self.on_kicked)
+        self.login()
 
     def initUI(self):
         self.setWindowTitle("Client Chat")
@@ -41,6 +75,9 @@ class ClientGUI(QMainWindow):
         """)
         self.log_browser.setFont(QFont("Courier", 12))
         self.layout.addWidget(self.log_browser)
+        # The receive thread posts to the sink; only LogView touches the widget
+        self.log_sink = MessageSink()
+        self.log_view = LogView(self.log_browser, self.log_sink)
 
     def initMessageEntry(self):
         self.entry_layout = QHBoxLayout()
@@ -53,7 +90,7 @@ class ClientGUI(QMainWindow):
             padding: 5px;
         """)
         self.message_entry.setFont(QFont("Arial", 12))
-        self.message_entry.setPlaceholderText("Type your message here...")
+        self.message_entry.setPlaceholderText("Type your message here... (/join, /leave or /room <name> for rooms)")
         self.message_entry.returnPressed.connect(self.send_message)
         self.entry_layout.addWidget(self.message_entry)
 
@@ -84,85 +121,297 @@ class ClientGUI(QMainWindow):
 
     def run_camera_script(self):
         try:
-            subprocess.Popen(['python', 'camera.py'])
+            if not self.camera.launch():
+                self.log_sink.post("Video call already running")
         except Exception as e:
-            self.log_browser.append(f"Error running camera script: {e}")
+            self.log_sink.post(f"Error running camera script: {e}")
 
     def setupSocket(self):
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.client_socket.connect(('10.200.236.220', 5555))  # Change to the appropriate server IP and port
+        self.client_socket.connect(SERVER_ADDRESS)
+        self.decoder = proto.FrameDecoder()
+        self.pending_frames = deque()
         self.authenticated = False
-        self.username = None
+
+    def connect_with_backoff(self):
+        while not self.closing:
+            try:
+                self.setupSocket()
+                return True
+            except OSError as e:
+                delay = self.backoff.next_delay()
+                self.log_sink.post(f"Cannot reach server ({e}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+        return False
+
+    def login(self):
+        # Connecting, with its retries, runs on a worker thread so the window
+        # stays responsive while the server is unreachable
+        threading.Thread(target=self.connect_for_login, daemon=True).start()
+
+    def connect_for_login(self):
+        if self.connect_with_backoff():
+            self.server_reached.emit()
+
+    def finish_login(self):
+        # Full login on the GUI thread: password and username dialogs. Rooms
+        # joined before a session expired are joined again.
+        self.authenticate()
+        self.choose_username()
+        for room in self.rooms - {proto.DEFAULT_ROOM}:
+            self.client_socket.sendall(proto.encode_frame(proto.JOIN, room))
+        if proto.DEFAULT_ROOM not in self.rooms:
+            self.client_socket.sendall(proto.encode_frame(proto.LEAVE, proto.DEFAULT_ROOM))
+        self.on_connected()
+        self.receive_thread = threading.Thread(target=self.receive_messages, daemon=True)
+        self.receive_thread.start()
+
+    def resume_session(self):
+        # Skips both prompts: the server restores username and rooms
+        if self.resume_token is None:
+            return False
+        self.client_socket.sendall(proto.encode_frame(proto.RESUME, self.resume_token))
+        frame = self.recv_frame()
+        while frame is not None and frame[0] == proto.PASSWORD:  # skip the server's prompt
+            frame = self.recv_frame()
+        if frame is not None and frame[0] == proto.AUTH_SUCCESS:
+            self.resume_token = frame[1].decode('utf-8')
+            return True
+        self.resume_token = None
+        return False
+
+    def on_connected(self, resumed=False):
+        self.backoff.reset()
+        # Our own messages were shown when typed; don't repeat them in the replay
+        self.skip_own_history = resumed
+        self.request_history()
+        # Send what was typed while disconnected, in order
+        with self.send_lock:
+            while self.outbox:
+                self.client_socket.sendall(self.outbox[0])
+                self.outbox.popleft()
+            self.connected = True
+
+    def reconnect(self):
+        # Called on the receive thread after the connection drops. Returns
+        # True once the session is resumed, False if a full login is needed.
+        with self.send_lock:
+            self.connected = False
+        self.client_socket.close()
+        while not self.closing:
+            delay = self.backoff.next_delay()
+            self.log_sink.post(f"<span style='color:orange;'>Connection lost, reconnecting in {delay:.1f}s...</span>")
+            time.sleep(delay)
+            try:
+                self.setupSocket()
+                if self.resume_session():
+                    self.on_connected(resumed=True)
+                    self.log_sink.post("<span style='color:orange;'>Reconnected.</span>")
+                    return True
+                self.log_sink.post("Session expired, please log in again.")
+                self.client_socket.close()
+                return False
+            except OSError as e:
+                self.log_sink.post(f"Reconnect failed: {e}")
+                self.client_socket.close()
+        return False
+
+    def send_frame(self, frame):
+        # Sends now if connected, otherwise queues for on_connected()
+        with self.send_lock:
+            if self.removed:
+                return False
+            if self.connected:
+                try:
+                    self.client_socket.sendall(frame)
+                    return True
+                except OSError:
+                    self.connected = False  # the receive thread will notice and reconnect
+            if len(self.outbox) == self.outbox.maxlen:
+                self.log_sink.post("Outbox full, dropping the oldest unsent message.")
+            self.outbox.append(frame)
+            return False
+
+    def closeEvent(self, event):
+        self.closing = True
+        self.camera.close()
+        if self.client_socket is not None:
+            self.client_socket.close()
+        super().closeEvent(event)
+
+    def recv_frame(self):
+        # Returns (type, payload), or None when the server closed the connection
+        while not self.pending_frames:
+            frames = self.decoder.read_from(self.client_socket)
+            if frames is None:
+                return None
+            self.pending_frames.extend(frames)
+        return self.pending_frames.popleft()
 
     def authenticate(self):
         try:
             while not self.authenticated:
                 password, ok = QInputDialog.getText(self, "Authentication", "Enter Password:", QLineEdit.Password)
                 if not ok:
-                    self.log_browser.append("Authentication cancelled.")
+                    self.log_sink.post("Authentication cancelled.")
                     self.client_socket.close()
                     sys.exit()
 
-                self.client_socket.send(password.encode('utf-8'))
-                response = self.client_socket.recv(1024).decode('utf-8')
-                if response == "AUTH_SUCCESS":
+                self.client_socket.sendall(proto.encode_frame(proto.PASSWORD, password))
+                frame = self.recv_frame()
+                while frame is not None and frame[0] == proto.PASSWORD:  # skip the server's prompt
+                    frame = self.recv_frame()
+                if frame is not None and frame[0] == proto.AUTH_SUCCESS:
                     self.authenticated = True
-                    self.log_browser.append("Authenticated successfully.")
-                    self.choose_username()
+                    self.resume_token = frame[1].decode('utf-8')
+                    self.log_sink.post("Authenticated successfully.")
                     return  # Exit the function to stop re-prompting
                 else:
-                    self.log_browser.append("Authentication failed. Try again.")
+                    reason = frame[1].decode('utf-8') if frame is not None and frame[1] else "Try again."
+                    self.log_sink.post(f"Authentication failed. {reason}")
+                    # The server hangs up after a failed attempt
+                    self.client_socket.close()
+                    self.setupSocket()
         except Exception as e:
-            self.log_browser.append(f"Authentication error: {e}")
+            self.log_sink.post(f"Authentication error: {e}")
             self.client_socket.close()
             sys.exit()
 
+    def request_history(self):
+        # Ask for what was missed since last_seq, or the recent backlog on a
+        # first connect; the reply is handled in receive_messages
+        limit = 0 if self.last_seq else HISTORY_BACKLOG
+        self.client_socket.sendall(proto.encode_frame(proto.HISTORY, proto.HISTORY_REQUEST.pack(self.last_seq, limit)))
+
+    def show_chat(self, room, message, color='yellow'):
+        if message.startswith(f"{self.username}: "):
+            color = 'cyan'
+        self.log_sink.post(f"<span style='color:{color};'>{self.room_prefix(room)}{message}</span>")
+
     def choose_username(self):
+        if self.username:
+            # Logging in again after the session expired
+            self.client_socket.sendall(proto.encode_frame(proto.USERNAME, self.username))
+            return
         try:
             while not self.username:
                 username, ok = QInputDialog.getText(self, "Username Selection", "Enter Username:")
                 if not ok:
-                    self.log_browser.append("Username selection cancelled.")
+                    self.log_sink.post("Username selection cancelled.")
                     self.client_socket.close()
                     sys.exit()
                 if username:
                     self.username = username
-                    self.client_socket.send(f"USERNAME:{self.username}".encode('utf-8'))
-                    self.log_browser.append(f"Username set to <span style='color:cyan;'>{self.username}</span>")
+                    self.client_socket.sendall(proto.encode_frame(proto.USERNAME, self.username))
+                    self.log_sink.post(f"Username set to <span style='color:cyan;'>{self.username}</span>")
                 else:
-                    self.log_browser.append("Username cannot be empty. Please try again.")
+                    self.log_sink.post("Username cannot be empty. Please try again.")
         except Exception as e:
-            self.log_browser.append(f"Error setting username: {e}")
+            self.log_sink.post(f"Error setting username: {e}")
             self.client_socket.close()
             sys.exit()
 
+    def room_prefix(self, room):
+        if room in (proto.DEFAULT_ROOM, proto.ALL_ROOMS):
+            return ""
+        return f"[{room}] "
+
+    def handle_room_command(self, message):
+        # /join <room> joins and switches to it, /leave <room> leaves it,
+        # /room <room> switches between rooms already joined
+        command, _, room = message.partition(" ")
+        room = room.strip()
+        if command not in ("/join", "/leave", "/room"):
+            return False
+        if not room:
+            self.log_sink.post(f"Usage: {command} <room>")
+        elif command == "/join" and len(room.encode('utf-8')) > proto.MAX_ROOM_NAME:
+            self.log_sink.post(f"Room names are at most {proto.MAX_ROOM_NAME} bytes")
+        elif command == "/join" and room not in self.rooms and len(self.rooms) >= proto.MAX_ROOMS:
+            self.log_sink.post(f"You can be in at most {proto.MAX_ROOMS} rooms, /leave one first")
+        elif command == "/join":
+            self.send_frame(proto.encode_frame(proto.JOIN, room))
+            self.rooms.add(room)
+            self.current_room = room
+            self.log_sink.post(f"Joined room <span style='color:cyan;'>{room}</span>")
+        elif command == "/leave":
+            if room in self.rooms:
+                self.send_frame(proto.encode_frame(proto.LEAVE, room))
+                self.rooms.discard(room)
+                if self.current_room == room:
+                    self.current_room = proto.DEFAULT_ROOM if proto.DEFAULT_ROOM in self.rooms else next(iter(self.rooms), None)
+                self.log_sink.post(f"Left room {room}")
+        elif room in self.rooms:
+            self.current_room = room
+            self.log_sink.post(f"Now talking in <span style='color:cyan;'>{room}</span>")
+        else:
+            self.log_sink.post(f"Not in room {room}, use /join {room}")
+        return True
+
     def send_message(self):
         message = self.message_entry.text()
         if message:
             try:
-                full_message = f"{self.username}: {message}"
-                self.client_socket.send(full_message.encode('utf-8'))
-                # Display the user's own message in a different color
-                self.log_browser.append(f"<span style='color:cyan;'>{full_message}</span>")
+                if self.removed:
+                    self.log_sink.post("You were removed from the server, messages are no longer sent.")
+                    return
+                if not self.handle_room_command(message):
+                    if self.current_room is None:
+                        self.log_sink.post("You are not in any room, use /join <room>")
+                        return
+                    full_message = f"{self.username}: {message}"
+                    sent = self.send_frame(proto.encode_frame(proto.CHAT, proto.encode_chat(self.current_room, full_message)))
+                    # Display the user's own message in a different color
+                    queued = "" if sent else " <i>(queued until reconnected)</i>"
+                    self.log_sink.post(f"<span style='color:cyan;'>{self.room_prefix(self.current_room)}{full_message}</span>{queued}")
                 self.message_entry.clear()
             except Exception as e:
-                self.log_browser.append(f"Error sending message: {e}")
+                self.log_sink.post(f"Error sending message: {e}")
+
+    def on_kicked(self):
+        self.message_entry.clear()
+        self.message_entry.setEnabled(False)
+        self.message_entry.setPlaceholderText("Removed from the server")
 
     def receive_messages(self):
-        while True:
+        while not self.closing:
             try:
-                message = self.client_socket.recv(1024).decode('utf-8')
-                if message:
+                frame = self.recv_frame()
+                if frame is None:
+                    raise ConnectionError("server closed the connection")
+                msg_type, payload = frame
+                if msg_type == proto.KICK:
+                    self.log_sink.post("<span style='color:red;'>You have been kicked from the server.</span>")
+                    with self.send_lock:
+                        self.connected = False
+                        self.removed = True
+                        self.outbox.clear()
+                    self.client_socket.close()
+                    self.kicked.emit()
+                    break
+                if msg_type == proto.CHAT:
+                    seq, room, message = proto.decode_chat(payload)
+                    self.last_seq = max(self.last_seq, seq)
                     if message.startswith(f"{self.username}: "):
                         # If the message is from the user, display it in cyan (already handled in send_message)
                         pass
                     else:
-                        self.log_browser.append(f"<span style='color:yellow;'>{message}</span>")
-                    self.log_browser.verticalScrollBar().setValue(self.log_browser.verticalScrollBar().maximum())
+                        self.show_chat(room, message)
+                elif msg_type == proto.HISTORY:
+                    # Logged messages arrive in bulk; an empty frame ends the replay
+                    for record in proto.iter_history(payload):
+                        seq, room, message = proto.decode_chat(record)
+                        self.last_seq = max(self.last_seq, seq)
+                        if not (self.skip_own_history and message.startswith(f"{self.username}: ")):
+                            self.show_chat(room, message, color='gray')
             except Exception as e:
-                self.log_browser.append(f"Error receiving message: {e}")
-                self.client_socket.close()
-                break
+                if self.closing:
+                    break
+                self.log_sink.post(f"Disconnected from server: {e}")
+                if not self.reconnect():
+                    if not self.closing:
+                        self.login_required.emit()
+                    break
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
@@ -1,49 +1,92 @@
 import sys
-import socket
-import threading
-import logging
-import random
-import hashlib
+import signal
 import asyncio
-import subprocess
-from aiohttp import web
-from aiortc import RTCPeerConnection, RTCSessionDescription
-from aiortc.contrib.media import MediaPlayer, MediaRecorder
+import logging
+import argparse
+import threading
+from collections import deque
 
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QLineEdit, QPushButton,
-    QVBoxLayout, QTextBrowser, QTabWidget, QListWidget, QMessageBox
+    QVBoxLayout, QTextBrowser, QTabWidget, QListWidget, QListWidgetItem, QMessageBox
 )
 from PyQt5.QtCore import Qt
 
+from chat_server import ChatServer, ChatObserver
+from chat_auth import Authenticator, CredentialStore
+from signaling_server import SignalingServer, SignalingObserver
+from message_log import MessageLog
+from metrics import Registry, MetricsServer, SamplingProfiler, register_process_metrics
+from session_registry import ACTIVE, UPDATED, REMOVED
+from gui_log import MessageSink, LogView
+from camera_launcher import CameraLauncher, MODES as CAMERA_MODES
+
+METRICS_PORT = 9100  # Prometheus scrape target on localhost; the profiler is started through it too
+
 # Setting up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-class ServerGUI(QMainWindow):
-    def __init__(self):
+class ServerEngines:
+    # Chat, WebRTC signaling and the metrics endpoint, each on its own thread.
+    # ServerGUI observes them; --headless runs them with no GUI at all.
+    def __init__(self, options, observer=None):
+        self.options = options
+        # One registry for both engines, scraped from its own thread
+        self.metrics = Registry()
+        register_process_metrics(self.metrics)
+        store = CredentialStore.load(options.credentials) if options.credentials else None
+        auth = Authenticator(store, max_pending_per_host=options.max_pending_auth_per_host)
+        history = MessageLog(options.history_dir) if options.history_dir else None
+        self.chat_server = ChatServer(options.host, options.chat_port, observer=observer, authenticator=auth,
+                                      history=history, metrics=self.metrics)
+        self.signaling_server = SignalingServer('0.0.0.0', options.signaling_port, observer=observer,
+                                                metrics=self.metrics)
+        self.metrics_server = None
+
+    def start(self, wait=True):
+        self.chat_server.start_in_thread()
+        # WebRTC signaling and peer connections get their own asyncio loop too.
+        # The GUI does not wait for it: it imports aiortc as it starts.
+        self.signaling_server.start_in_thread(wait=wait)
+        try:
+            self.metrics_server = MetricsServer(self.metrics, port=self.options.metrics_port,
+                                                profiler=SamplingProfiler()).start_in_thread()
+        except OSError as e:
+            logging.error(f"Metrics endpoint unavailable: {e}")
+
+    def stop(self):
+        self.signaling_server.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        # Flushes the message log
+        future = asyncio.run_coroutine_threadsafe(self.chat_server.stop(), self.chat_server.loop)
+        try:
+            future.result(timeout=5.0)
+        except Exception as e:
+            logging.error(f"Chat server did not stop cleanly: {e}")
+
+class ServerGUI(QMainWindow, ChatObserver, SignalingObserver):
+    def __init__(self, options=None):
         super().__init__()
 
         self.setWindowTitle("Server Monitor")
+        self.log_sink = MessageSink()  # engine callbacks post here, never to widgets
+        self.session_events = deque()  # (event, session id, label, state) from the engine thread
+        self.client_items = {}  # session id -> QListWidgetItem
         self.setup_ui()
+        options = options or parse_args([])
 
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind(('10.200.236.221', 5555))  # Bind to all interfaces
-        self.server.listen(5)
-
-        self.clients = {}  
-        self.authenticated_clients = {}  
-
-        self.log_browser.append("Server started...")
+        # The GUI only observes the engines, which run on their own event loops
+        self.engines = ServerEngines(options, observer=self)
+        self.chat_server = self.engines.chat_server
+        self.signaling_server = self.engines.signaling_server
+        self.chat_server.sessions.subscribe(self.on_session_event)
+        self.engines.start(wait=False)
+        self.camera = CameraLauncher(options.camera_mode)
 
-        self.accept_thread = threading.Thread(target=self.accept_clients)
-        self.accept_thread.daemon = True  # Allows thread to exit when main program exits
-        self.accept_thread.start()
-
-        # WebRTC signaling server
-        self.signaling_server = web.Application()
-        self.signaling_server.router.add_post('/offer', self.offer)
-        self.signaling_runner = web.AppRunner(self.signaling_server)
-        asyncio.ensure_future(self.start_signaling_server())
+        self.log_sink.post("Server started...")
+        if self.engines.metrics_server is not None:
+            self.log_sink.post(f"Metrics on http://127.0.0.1:{self.engines.metrics_server.port}/metrics")
 
     def setup_ui(self):
         self.central_widget = QWidget()
@@ -72,6 +115,8 @@ class ServerGUI(QMainWindow):
         self.log_browser = QTextBrowser()
         self.log_browser.setStyleSheet("background-color: black; color: green; font-size: 16px;")
         self.log_layout.addWidget(self.log_browser)
+        self.log_view = LogView(self.log_browser, self.log_sink)
+        self.log_view.timer.timeout.connect(self.apply_session_events)
 
         self.message_entry = QLineEdit()
         self.message_entry.setStyleSheet("color: white; font-size: 16px;")
@@ -91,160 +136,111 @@ class ServerGUI(QMainWindow):
         self.kick_button.clicked.connect(self.kick_client)
         self.client_layout.addWidget(self.kick_button)
 
-    async def start_signaling_server(self):
-        await self.signaling_runner.setup()
-        site = web.TCPSite(self.signaling_runner, '0.0.0.0', 8080)
-        await site.start()
-        self.log_browser.append("WebRTC signaling server started on port 8080...")
-
-    async def offer(self, request):
-        params = await request.json()
-        offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
-
-        pc = RTCPeerConnection()
-        self.clients[pc] = params["client_id"]
-
-        @pc.on("datachannel")
-        def on_datachannel(channel):
-            @channel.on("message")
-            async def on_message(message):
-                logging.info(f"Received message from {params['client_id']}: {message}")
-                for other_pc in self.clients:
-                    if other_pc != pc:
-                        await other_pc.send(message)
-
-        @pc.on("icecandidate")
-        async def on_icecandidate(candidate):
-            await self.send_ice_candidate(params["client_id"], candidate)
-
-        @pc.on("track")
-        def on_track(track):
-            logging.info(f"Received track: {track.kind}")
-            pc.addTrack(track)
-
-        await pc.setRemoteDescription(offer)
-        answer = await pc.createAnswer()
-        await pc.setLocalDescription(answer)
-
-        return web.json_response({
-            "sdp": pc.localDescription.sdp,
-            "type": pc.localDescription.type
-        })
-
-    async def send_ice_candidate(self, client_id, candidate):
-        # Implementation for sending ICE candidates to the client
-        pass
+    # ChatObserver, SignalingObserver and registry hooks run on the engines'
+    # threads: they only queue log lines and list events, the GUI thread
+    # applies both on its timer
+    def on_session_event(self, event, session):
+        self.session_events.append((event, session.session_id, session.label, session.state))
 
-    def accept_clients(self):
-        while True:
-            try:
-                client_socket, addr = self.server.accept()
-                logging.info(f"Accepted connection from {addr}")
-                client_color = "#{:06x}".format(random.randint(0, 0xFFFFFF))
-
-                client_handler = threading.Thread(target=self.handle_client, args=(client_socket, addr, client_color))
-                client_handler.daemon = True
-                client_handler.start()
-            except Exception as e:
-                logging.error(f"Error accepting clients: {e}")
-
-    def handle_client(self, client_socket, client_address, client_color):
-        if self.authenticate(client_socket, client_address):
-            self.clients[client_socket] = client_address
-            receive_thread = threading.Thread(target=self.receive, args=(client_socket, client_address, client_color))
-            receive_thread.daemon = True
-            receive_thread.start()
-
-    def authenticate(self, client_socket, client_address):
-        try:
-            client_socket.send("PASSWORD:".encode('utf-8'))
-            password = client_socket.recv(1024).decode('utf-8')
-            hashed_password = hashlib.sha256(password.encode()).hexdigest()
-            if hashed_password == hashlib.sha256("MCCTC".encode()).hexdigest():  # Store hashed password securely
-                self.authenticated_clients[client_socket] = client_address
-                self.update_client_list()
-                client_socket.send("AUTH_SUCCESS".encode('utf-8'))
-                return True
-            else:
-                client_socket.send("AUTH_FAIL".encode('utf-8'))
-                client_socket.close()
-                return False
-        except Exception as e:
-            logging.error(f"Authentication error with {client_address}: {e}")
-            return False
+    def on_message(self, client, room, message):
+        message = f"<span style='color:{client.color}'>[{room}] Received from {client.address}: {message}</span>"
+        self.log_sink.post(message)
 
-    def receive(self, client_socket, client_address, client_color):
-        try:
-            while True:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
-                    break
-                logging.info(f"Received from {client_address}: {data}")
+    def on_signaling_started(self, address):
+        self.log_sink.post(f"WebRTC signaling server started on port {address[1]}...")
 
-                self.broadcast_message(data, client_socket)
+    def on_offer_answered(self, client_id, peer_count):
+        self.log_sink.post(f"WebRTC offer from {client_id} answered ({peer_count} peers)")
 
-                message = f"<span style='color:{client_color}'>Received from {client_address}: {data}</span>"
-                self.log_browser.append(message)
-                self.log_browser.verticalScrollBar().setValue(self.log_browser.verticalScrollBar().maximum())
-        except Exception as e:
-            logging.error(f"Error receiving data from {client_address}: {e}")
-        finally:
-            self.disconnect_client(client_socket, client_address)
-
-    def broadcast_message(self, message, sender_socket):
-        for client in self.authenticated_clients.keys():
-            if client != sender_socket:
-                try:
-                    client.send(message.encode('utf-8'))
-                except Exception as e:
-                    logging.error(f"Error broadcasting message to a client: {e}")
+    def on_peer_closed(self, client_id, peer_count):
+        self.log_sink.post(f"WebRTC peer {client_id} closed ({peer_count} peers)")
+
+    def closeEvent(self, event):
+        self.camera.close()
+        self.engines.stop()
+        super().closeEvent(event)
+
+    def on_client_disconnected(self, client):
+        self.log_sink.post(f"<span style='color:red'>Client disconnected: {client.address}</span>")
+
+    def on_client_kicked(self, client):
+        self.log_sink.post(f"<span style='color:red'>Kicked client: {client.address}</span>")
 
     def send_server_message(self):
         message = self.message_entry.text()
         if message:
-            self.broadcast_message(message, None)
+            self.chat_server.call_threadsafe(self.chat_server.broadcast_message, message, None)
             server_message = f"<span style='color:green'>Server Message: {message}</span>"
-            self.log_browser.append(server_message)
-            self.log_browser.verticalScrollBar().setValue(self.log_browser.verticalScrollBar().maximum())
+            self.log_sink.post(server_message)
             self.message_entry.clear()
 
-    def update_client_list(self):
-        self.client_list.clear()
-        for client_address in self.authenticated_clients.values():
-            self.client_list.addItem(f"{client_address}")
+    def apply_session_events(self):
+        # Incremental: only the sessions that changed are added, relabelled or removed
+        if not self.session_events:
+            return
+        self.client_list.setUpdatesEnabled(False)
+        while self.session_events:
+            event, session_id, label, state = self.session_events.popleft()
+            item = self.client_items.get(session_id)
+            if event == REMOVED:
+                if item is not None:
+                    self.client_list.takeItem(self.client_list.row(item))
+                    del self.client_items[session_id]
+            elif state == ACTIVE:
+                if item is None:
+                    item = QListWidgetItem(label)
+                    item.setData(Qt.UserRole, session_id)
+                    self.client_list.addItem(item)
+                    self.client_items[session_id] = item
+                elif event == UPDATED:
+                    item.setText(label)
+        self.client_list.setUpdatesEnabled(True)
 
     def kick_client(self):
         selected_items = self.client_list.selectedItems()
         if selected_items:
-            selected_item = selected_items[0]
-            client_info = selected_item.text()
-
-            for client_socket, client_address in list(self.authenticated_clients.items()):
-                if f"{client_address}" == client_info:
-                    client_socket.send("KICK".encode('utf-8'))
-                    client_socket.close()
-                    del self.authenticated_clients[client_socket]
-                    self.update_client_list()
-                    self.log_browser.append(f"<span style='color:red'>Kicked client: {client_address}</span>")
-                    self.log_browser.verticalScrollBar().setValue(self.log_browser.verticalScrollBar().maximum())
-                    break
-
-    def disconnect_client(self, client_socket, client_address):
-        client_socket.close()
-        if client_socket in self.authenticated_clients:
-            del self.authenticated_clients[client_socket]
-            self.update_client_list()
-            self.log_browser.append(f"<span style='color:red'>Client disconnected: {client_address}</span>")
-            self.log_browser.verticalScrollBar().setValue(self.log_browser.verticalScrollBar().maximum())
+            session_id = selected_items[0].data(Qt.UserRole)
+            self.chat_server.call_threadsafe(self.chat_server.kick_session, session_id)
 
     def run_camera_script(self):
         try:
-            subprocess.Popen(["python", "camera.py"])
+            if not self.camera.launch():
+                self.log_sink.post("Video call already running")
         except Exception as e:
             logging.error(f"Failed to run camera.py: {e}")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chat and WebRTC server")
+    parser.add_argument("--headless", action="store_true", help="run the servers without the monitor window")
+    parser.add_argument("--host", default='10.200.236.221', help="chat server address")
+    parser.add_argument("--chat-port", type=int, default=5555)
+    parser.add_argument("--signaling-port", type=int, default=8080)
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT)
+    parser.add_argument("--history-dir", default="chat_history", help="message log directory, '' to disable")
+    parser.add_argument("--credentials", help="credentials file written by chat_auth.py")
+    parser.add_argument("--max-pending-auth-per-host", type=int, default=16,
+                        help="handshakes in flight at once from one address")
+    parser.add_argument("--camera-mode", choices=CAMERA_MODES, default="prewarm",
+                        help="how Join Video Call starts camera.py, see camera_launcher.py")
+    return parser.parse_args(argv)
+
+def run_headless(options):
+    engines = ServerEngines(options)
+    engines.start()
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    try:
+        while not stopping.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    engines.stop()
+
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    gui = ServerGUI()
+    options = parse_args()
+    if options.headless:
+        sys.exit(run_headless(options))
+    app = QApplication(sys.argv[:1])
+    gui = ServerGUI(options)
     gui.show()
     sys.exit(app.exec_())
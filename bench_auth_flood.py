@@ -0,0 +1,151 @@
+import sys
+import time
+import asyncio
+import argparse
+import logging
+import statistics
+
+import chat_protocol as proto
+from chat_server import ChatServer
+from chat_auth import Authenticator, FailureLimiter
+from bench_chat_load import PASSWORD, raise_fd_limit
+
+# Connection-flood test for the chat server's authentication stage. A few
+# legitimate clients log in over and over from 127.0.0.1 while 127.0.0.2
+# opens connections that never send a password and 127.0.0.3 hammers the
+# server with wrong ones. Login throughput and latency for the legitimate
+# clients are reported before and during the flood.
+#
+#   python bench_auth_flood.py --idle 2000 --attackers 50 --duration 10
+#   python bench_auth_flood.py --unprotected   # same flood, limits switched off
+
+
+async def login(port, password, local_host):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port, local_addr=(local_host, 0))
+    decoder = proto.FrameDecoder()
+    try:
+        writer.write(proto.encode_frame(proto.PASSWORD, password))
+        while True:
+            data = await reader.read(1024)
+            if not data:
+                return False
+            types = [msg_type for msg_type, _ in decoder.feed(data)]
+            if proto.AUTH_SUCCESS in types:
+                return True
+            if proto.AUTH_FAIL in types:
+                return False
+    finally:
+        writer.close()
+
+
+async def legit_worker(port, stop, latencies, failures):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            ok = await login(port, PASSWORD, "127.0.0.1")
+        except OSError:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            failures.append(1)
+            await asyncio.sleep(0.05)
+
+
+async def attacker(port, stop, counter, retry_delay):
+    while not stop.is_set():
+        try:
+            await login(port, "wrong password", "127.0.0.3")
+            counter[0] += 1
+        except OSError:
+            pass
+        await asyncio.sleep(retry_delay)
+
+
+async def idler(port, stop, held, retry_delay):
+    # Connects and never answers the password prompt; reconnects once the
+    # server gives up on it so the pressure stays constant
+    while not stop.is_set():
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port, local_addr=("127.0.0.2", 0))
+        except OSError:
+            await asyncio.sleep(retry_delay)
+            continue
+        held[0] += 1
+        try:
+            while not stop.is_set() and await reader.read(1024):
+                pass
+        except (OSError, asyncio.CancelledError):
+            pass
+        finally:
+            held[0] -= 1
+            writer.close()
+        await asyncio.sleep(retry_delay)
+
+
+async def measure(port, args, label, flood):
+    stop = asyncio.Event()
+    latencies, failures = [], []
+    attempts, held = [0], [0]
+    tasks = []
+    if flood:
+        tasks += [asyncio.ensure_future(idler(port, stop, held, args.retry_delay)) for _ in range(args.idle)]
+        tasks += [asyncio.ensure_future(attacker(port, stop, attempts, args.retry_delay)) for _ in range(args.attackers)]
+        await asyncio.sleep(1.0)  # let the flood build up first
+    tasks += [asyncio.ensure_future(legit_worker(port, stop, latencies, failures)) for _ in range(args.legit)]
+    await asyncio.sleep(args.duration)
+    still_held = held[0]
+    stop.set()
+    await asyncio.sleep(0.2)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    line = f"{label:<10}{len(latencies) / args.duration:>10.1f}{len(failures):>8}"
+    if latencies:
+        latencies.sort()
+        line += (f"{statistics.median(latencies) * 1000:>10.1f}"
+                 f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:>10.1f}")
+    else:
+        line += f"{'-':>10}{'-':>10}"
+    if flood:
+        line += f"   idle connections open {still_held}, bad passwords answered {attempts[0]}"
+    print(line)
+    return len(latencies) / args.duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat authentication flood test")
+    parser.add_argument("--legit", type=int, default=4, help="concurrent legitimate login loops")
+    parser.add_argument("--idle", type=int, default=1000, help="connections that never authenticate")
+    parser.add_argument("--attackers", type=int, default=50, help="wrong-password login loops")
+    parser.add_argument("--retry-delay", type=float, default=0.5,
+                        help="seconds a flooding connection waits before trying again")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per phase")
+    parser.add_argument("--auth-timeout", type=float, default=5.0)
+    parser.add_argument("--unprotected", action="store_true",
+                        help="disable the pending caps and failure lockout for comparison")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    raise_fd_limit()
+    if args.unprotected:
+        auth = Authenticator(timeout=args.auth_timeout, max_pending=10 ** 9, max_pending_per_host=10 ** 9,
+                             limiter=FailureLimiter(max_failures=10 ** 9))
+    else:
+        auth = Authenticator(timeout=args.auth_timeout)
+    server = ChatServer("127.0.0.1", 0, authenticator=auth)
+    server.start_in_thread()
+
+    async def run():
+        print(f"{'phase':<10}{'logins/s':>10}{'failed':>8}{'p50 ms':>10}{'p99 ms':>10}")
+        baseline = await measure(server.port, args, "baseline", flood=False)
+        flooded = await measure(server.port, args, "flood", flood=True)
+        print(f"\nLegitimate throughput under flood: {flooded / baseline * 100 if baseline else 0:.0f}% of baseline")
+        print(f"Server auth stats: { {k: v for k, v in server.stats().items() if k.startswith('auth')} }")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import resource
+import subprocess
+import statistics
+
+import chat_protocol as proto
+from chat_auth import CredentialStore
+
+# Load benchmark for chat_server.py: opens many simulated clients, reports the
+# accept (connect + authenticate) rate and per-message fan-out latency.
+#
+# The spawned server gets a password hashed with few PBKDF2 iterations, so
+# the accept rate measures connection handling rather than the KDF.
+#
+#   python bench_chat_load.py --clients 10000 --messages 20
+
+PASSWORD = "MCCTC"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+class BenchClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.decoder = proto.FrameDecoder()
+        self.arrivals = []  # perf_counter() of every chat message seen, in order
+
+    async def read_forever(self):
+        try:
+            while True:
+                data = await self.reader.read(64 * 1024)
+                if not data:
+                    break
+                now = time.perf_counter()
+                for msg_type, _ in self.decoder.feed(data):
+                    if msg_type == proto.CHAT:
+                        self.arrivals.append(now)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+
+async def connect(host, port, semaphore):
+    async with semaphore:
+        reader, writer = await asyncio.open_connection(host, port)
+        client = BenchClient(reader, writer)
+        writer.write(proto.encode_frame(proto.PASSWORD, PASSWORD))
+        while True:
+            data = await reader.read(1024)
+            if not data:
+                raise ConnectionError("server closed connection during auth")
+            types = [msg_type for msg_type, _ in client.decoder.feed(data)]
+            if proto.AUTH_SUCCESS in types:
+                return client
+            if proto.AUTH_FAIL in types:
+                raise ConnectionError("authentication failed")
+
+
+async def run(args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(connect(args.host, args.port, semaphore) for _ in range(args.clients)),
+        return_exceptions=True)
+    accept_time = time.perf_counter() - start
+
+    clients = [c for c in results if isinstance(c, BenchClient)]
+    failures = len(results) - len(clients)
+    print(f"Connected {len(clients)}/{args.clients} clients in {accept_time:.2f}s "
+          f"({len(clients) / accept_time:.0f} accepts/s, {failures} failed)")
+    if len(clients) < 2:
+        return 1
+
+    sender, receivers = clients[0], clients[1:]
+    readers = [asyncio.ensure_future(c.read_forever()) for c in receivers]
+
+    sent_at = []
+    for i in range(args.messages):
+        sent_at.append(time.perf_counter())
+        sender.writer.write(proto.encode_frame(proto.CHAT, proto.encode_chat(proto.DEFAULT_ROOM, f"bench: message {i}")))
+        await sender.writer.drain()
+        await asyncio.sleep(args.interval)
+
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        if all(len(c.arrivals) >= args.messages for c in receivers):
+            break
+        await asyncio.sleep(0.05)
+
+    fanout = []  # time until the last receiver saw message i
+    latencies = []
+    for i, t0 in enumerate(sent_at):
+        seen = [c.arrivals[i] - t0 for c in receivers if len(c.arrivals) > i]
+        latencies.extend(seen)
+        if len(seen) == len(receivers):
+            fanout.append(max(seen))
+
+    delivered = sum(min(len(c.arrivals), args.messages) for c in receivers)
+    expected = len(receivers) * args.messages
+    print(f"Delivered {delivered}/{expected} messages to {len(receivers)} receivers")
+    if latencies:
+        latencies.sort()
+        print(f"Per-recipient latency: mean {statistics.mean(latencies) * 1000:.2f} ms, "
+              f"p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f} ms")
+    if fanout:
+        print(f"Full fan-out latency per message: mean {statistics.mean(fanout) * 1000:.2f} ms, "
+              f"max {max(fanout) * 1000:.2f} ms")
+
+    for task in readers:
+        task.cancel()
+    for c in clients:
+        c.writer.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat server load benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5599)
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.2, help="seconds between messages")
+    parser.add_argument("--concurrency", type=int, default=500, help="connects in flight")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--kdf-iterations", type=int, default=1000,
+                        help="PBKDF2 iterations of the spawned server's password")
+    parser.add_argument("--external", action="store_true",
+                        help="benchmark an already running server instead of spawning one")
+    args = parser.parse_args()
+
+    limit = raise_fd_limit()
+    if args.clients + 64 > limit:
+        print(f"Warning: open file limit is {limit}, some connections will fail")
+
+    server = None
+    workdir = None
+    if not args.external:
+        workdir = tempfile.mkdtemp(prefix="bench_chat_load_")
+        credentials = os.path.join(workdir, "credentials.json")
+        CredentialStore([CredentialStore.hash_password(PASSWORD, iterations=args.kdf_iterations)]).save(credentials)
+        server = subprocess.Popen([sys.executable, os.path.join(HERE, "chat_server.py"), "--host", args.host,
+                                   "--port", str(args.port), "--credentials", credentials,
+                                   "--history-dir", os.path.join(workdir, "history"),
+                                   # every simulated client comes from one address
+                                   "--max-pending-auth", str(args.concurrency),
+                                   "--max-pending-auth-per-host", str(args.concurrency)],
+                                  stderr=subprocess.DEVNULL)
+        time.sleep(1.0)
+    try:
+        return asyncio.run(run(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
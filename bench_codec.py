@@ -0,0 +1,89 @@
+import sys
+import time
+import pickle
+import argparse
+import statistics
+
+import cv2
+
+from video_codec import make_codec, make_test_frame
+
+# Bytes per frame and encode/decode time for each video codec, compared with
+# the old pickle-the-ndarray format.
+#
+#   python bench_codec.py --frames 100
+#   python bench_codec.py --camera 0
+
+
+CONFIGS = [
+    ("raw", {}),
+    ("jpeg", {"quality": 50}),
+    ("jpeg", {"quality": 80}),
+    ("jpeg", {"quality": 95}),
+    ("jpeg", {"quality": 80, "scale": 0.5}),
+]
+
+
+def load_frames(args):
+    if args.camera is None:
+        return [make_test_frame(args.width, args.height, i) for i in range(args.frames)]
+    cap = cv2.VideoCapture(args.camera)
+    frames = []
+    while len(frames) < args.frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def ms(values):
+    return statistics.mean(values) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Video codec benchmark")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--camera", type=int, default=None, help="use a real camera instead of synthetic frames")
+    args = parser.parse_args()
+
+    frames = load_frames(args)
+    if not frames:
+        print("No frames captured")
+        return 1
+    height, width = frames[0].shape[:2]
+    print(f"{len(frames)} frames of {width}x{height}")
+    print(f"{'codec':<24}{'bytes/frame':>14}{'encode ms':>12}{'decode ms':>12}")
+
+    sizes, encode_times, decode_times = [], [], []
+    for frame in frames:
+        start = time.perf_counter()
+        data = pickle.dumps(frame)
+        encode_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        pickle.loads(data)
+        decode_times.append(time.perf_counter() - start)
+        sizes.append(len(data))
+    print(f"{'pickle (old)':<24}{statistics.mean(sizes):>14,.0f}{ms(encode_times):>12.2f}{ms(decode_times):>12.2f}")
+
+    for name, options in CONFIGS:
+        codec = make_codec(name, **options)
+        sizes, encode_times, decode_times = [], [], []
+        for frame in frames:
+            start = time.perf_counter()
+            payload, w, h = codec.encode(frame)
+            encode_times.append(time.perf_counter() - start)
+            sizes.append(len(payload))
+            start = time.perf_counter()
+            codec.decode(payload, w, h)
+            decode_times.append(time.perf_counter() - start)
+        label = name + "".join(f" {k}={v}" for k, v in options.items())
+        print(f"{label:<24}{statistics.mean(sizes):>14,.0f}{ms(encode_times):>12.2f}{ms(decode_times):>12.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
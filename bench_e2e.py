@@ -0,0 +1,514 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import urllib.request
+
+import chat_protocol as proto
+import video_protocol
+from chat_auth import CredentialStore
+from bench_chat_load import PASSWORD, raise_fd_limit
+
+# End-to-end load harness. Virtual users speak the same protocols as
+# ClientGUI (PASSWORD, USERNAME, JOIN, CHAT) and camera.py (video frames,
+# simulcast subscribe) from one asyncio process, with synthetic frames
+# instead of a webcam, so thousands of them fit on one machine.
+#
+# By default the server is spawned: `Final_Server.py --headless` for chat
+# and new_camera_server.py for video, each with its metrics endpoint, which
+# is where server CPU and RSS come from. --connect/--metrics-url point the
+# harness at servers that are already running instead.
+#
+# Latency is measured from send to receipt by the same process (chat messages
+# carry their send time, video frames the header timestamp), so both ends
+# share a clock. --json saves the run; --compare prints it against a saved
+# run, flagging results that got worse by more than --tolerance.
+#
+#   python bench_e2e.py chat --users 2000 --senders 20 --rate 2 --duration 20 --json chat.json
+#   python bench_e2e.py video --senders 4 --viewers 200 --fps 15 --tile 426 240 --json video.json
+#   python bench_e2e.py chat --users 2000 --compare chat.json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Results where a larger number is better; for the rest (latency, CPU, memory,
+# bandwidth) smaller is better. Counts that follow from the parameters are
+# not compared.
+HIGHER_IS_BETTER = {"logged_in", "logins_per_s", "messages_per_s", "deliveries", "delivered_ratio",
+                    "deliveries_per_s", "connected", "frames_received", "frames_per_s", "fps_per_stream"}
+NOT_COMPARED = {"messages_sent", "deliveries_expected"}
+
+
+def percentiles(values):
+    if not values:
+        return {"p50_ms": None, "p99_ms": None, "max_ms": None}
+    values = sorted(values)
+    return {"p50_ms": values[len(values) // 2] * 1000,
+            "p99_ms": values[max(0, int(len(values) * 0.99) - 1)] * 1000,
+            "max_ms": values[-1] * 1000}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def scrape(url):
+    # Unlabelled samples from a Prometheus text page
+    with urllib.request.urlopen(url, timeout=5) as response:
+        text = response.read().decode("utf-8")
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#") and "{" not in line:
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+class ServerMonitor:
+    # Samples the server's metrics endpoint once a second during the run
+    def __init__(self, url):
+        self.url = url
+        self.samples = []  # (monotonic time, process CPU seconds, RSS bytes)
+        self.task = None
+
+    async def sample(self):
+        loop = asyncio.get_running_loop()
+        try:
+            values = await loop.run_in_executor(None, scrape, self.url)
+        except OSError:
+            return
+        self.samples.append((time.monotonic(), values.get("process_cpu_seconds_total"),
+                             values.get("process_resident_memory_bytes")))
+
+    async def run(self):
+        while True:
+            await self.sample()
+            await asyncio.sleep(1.0)
+
+    def start(self):
+        if self.url:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return {}
+        self.task.cancel()
+        await self.sample()
+        samples = [s for s in self.samples if s[1] is not None]
+        if len(samples) < 2:
+            return {}
+        (t0, cpu0, _), (t1, cpu1, _) = samples[0], samples[-1]
+        return {"server_cpu_percent": (cpu1 - cpu0) / (t1 - t0) * 100,
+                "server_rss_max_mb": max(s[2] for s in samples) / 1e6}
+
+
+def spawn(command, port, timeout=20.0):
+    server = subprocess.Popen(command, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"{command[1]} exited with status {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError(f"{command[1]} did not start listening on {port}")
+
+
+# --- chat -------------------------------------------------------------------
+
+class ChatUser:
+    def __init__(self, index, room):
+        self.index = index
+        self.room = room
+        self.decoder = proto.FrameDecoder()
+        self.reader = self.writer = None
+        self.login_seconds = None
+        self.received = 0
+
+    async def login(self, host, port, timeout):
+        start = time.perf_counter()
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.write(proto.encode_frame(proto.PASSWORD, PASSWORD))
+        while True:
+            data = await asyncio.wait_for(self.reader.read(4096), timeout)
+            if not data:
+                raise ConnectionError("server closed the connection during login")
+            types = [msg_type for msg_type, _ in self.decoder.feed(data)]
+            if proto.AUTH_FAIL in types:
+                raise ConnectionError("login refused")
+            if proto.AUTH_SUCCESS in types:
+                break
+        self.login_seconds = time.perf_counter() - start
+        self.writer.write(proto.encode_frame(proto.USERNAME, f"user{self.index}"))
+        if self.room != proto.DEFAULT_ROOM:
+            self.writer.write(proto.encode_frame(proto.JOIN, self.room))
+            self.writer.write(proto.encode_frame(proto.LEAVE, proto.DEFAULT_ROOM))
+
+    async def read_forever(self, latencies):
+        try:
+            while True:
+                data = await self.reader.read(256 * 1024)
+                if not data:
+                    break
+                now = time.perf_counter()
+                for msg_type, payload in self.decoder.feed(data):
+                    if msg_type == proto.CHAT:
+                        _, _, text = proto.decode_chat(payload)
+                        stamp, _, _ = text.partition(" ")
+                        try:
+                            latencies.append(now - float(stamp))
+                        except ValueError:
+                            continue  # not one of ours
+                        self.received += 1
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def send_loop(self, rate, until, sent):
+        interval = 1.0 / rate
+        next_send = time.perf_counter()
+        while next_send < until:
+            self.writer.write(proto.encode_frame(proto.CHAT, proto.encode_chat(
+                self.room, f"{time.perf_counter():.6f} load test message from user{self.index}")))
+            sent[self.room] = sent.get(self.room, 0) + 1
+            await self.writer.drain()
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+
+async def login_all(users, host, port, concurrency, timeout):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login(user):
+        async with semaphore:
+            for _ in range(5):  # the server refuses handshakes past its per-address cap
+                try:
+                    await user.login(host, port, timeout)
+                    return True
+                except ConnectionError:
+                    if user.writer is not None:
+                        user.writer.close()
+                    await asyncio.sleep(0.2)
+                except (OSError, asyncio.TimeoutError):
+                    return False
+            return False
+
+    return await asyncio.gather(*(login(user) for user in users))
+
+
+async def run_chat(args, address, metrics_url):
+    host, port = address
+    rooms = [proto.DEFAULT_ROOM] if args.rooms == 1 else [f"load-{i}" for i in range(args.rooms)]
+    users = [ChatUser(i, rooms[i % len(rooms)]) for i in range(args.users)]
+
+    monitor = ServerMonitor(metrics_url)
+    monitor.start()
+    start = time.perf_counter()
+    results = await login_all(users, host, port, args.concurrency, args.timeout)
+    login_wall = time.perf_counter() - start
+    online = [user for user, ok in zip(users, results) if ok]
+    print(f"Logged in {len(online)}/{len(users)} users in {login_wall:.1f}s")
+    if len(online) < 2:
+        await monitor.stop()
+        return None
+
+    latencies = []
+    readers = [asyncio.ensure_future(user.read_forever(latencies)) for user in online]
+    await asyncio.sleep(1.0)  # let JOIN/LEAVE land before anything is sent
+    members = {}
+    for user in online:
+        members[user.room] = members.get(user.room, 0) + 1
+
+    sent = {}
+    senders = online[:args.senders]
+    start = time.perf_counter()
+    await asyncio.gather(*(user.send_loop(args.rate, start + args.duration, sent) for user in senders))
+    send_wall = time.perf_counter() - start
+    # Senders do not get their own messages back
+    expected = sum(count * (members[room] - 1) for room, count in sent.items())
+    deadline = time.perf_counter() + args.timeout
+    while len(latencies) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    wall = time.perf_counter() - start
+    server = await monitor.stop()
+
+    for task in readers:
+        task.cancel()
+    for user in online:
+        user.writer.close()
+
+    messages = sum(sent.values())
+    results = {
+        "logged_in": len(online),
+        "logins_per_s": len(online) / login_wall,
+        "login": percentiles([user.login_seconds for user in online]),
+        "messages_sent": messages,
+        "messages_per_s": messages / send_wall,
+        "deliveries_expected": expected,
+        "deliveries": len(latencies),
+        "delivered_ratio": len(latencies) / expected if expected else 1.0,
+        "deliveries_per_s": len(latencies) / wall,
+        "latency": percentiles(latencies),
+    }
+    results.update(server)
+    return results
+
+
+def chat_server(args):
+    # A cheap KDF unless asked otherwise: the point is the server, not PBKDF2
+    credentials = os.path.join(tempfile.mkdtemp(prefix="bench_e2e_"), "credentials.json")
+    CredentialStore([CredentialStore.hash_password(PASSWORD, iterations=args.kdf_iterations)]).save(credentials)
+    port, metrics_port = free_port(), free_port()
+    command = [sys.executable, "Final_Server.py", "--headless", "--host", "127.0.0.1",
+               "--chat-port", str(port), "--signaling-port", "0", "--metrics-port", str(metrics_port),
+               "--history-dir", os.path.join(os.path.dirname(credentials), "history"),
+               "--credentials", credentials,
+               # every virtual user comes from one address
+               "--max-pending-auth-per-host", str(args.concurrency)]
+    return spawn(command, port), ("127.0.0.1", port), f"http://127.0.0.1:{metrics_port}/metrics"
+
+
+# --- video ------------------------------------------------------------------
+
+class VideoUser:
+    def __init__(self, index, layers, tile):
+        self.index = index
+        self.layers = layers  # [(payload, width, height, codec id)], largest first
+        self.tile = tile
+        self.reader = self.writer = None
+        self.received = 0
+        self.received_bytes = 0
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.tile:
+            self.writer.write(video_protocol.pack_subscribe(*self.tile))
+
+    async def send_loop(self, fps, until):
+        interval = 1.0 / fps
+        sequence = 0
+        next_send = time.perf_counter()
+        while next_send < until:
+            timestamp = time.time()
+            for layer, (payload, width, height, codec_id) in enumerate(self.layers):
+                self.writer.write(video_protocol.pack_header(0, sequence, timestamp, width, height, codec_id,
+                                                             len(payload), layer))
+                self.writer.write(payload)
+            await self.writer.drain()
+            sequence += 1
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+    async def read_forever(self, latencies, measuring):
+        try:
+            while True:
+                header = video_protocol.unpack_header(await self.reader.readexactly(video_protocol.HEADER_SIZE))
+                await self.reader.readexactly(header.length)
+                if header.codec == video_protocol.CODEC_FEEDBACK or not measuring[0]:
+                    continue
+                latencies.append(time.time() - header.timestamp)
+                self.received += 1
+                self.received_bytes += video_protocol.HEADER_SIZE + header.length
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+
+
+def encode_layers(args):
+    # cv2 is only needed here, so the chat benchmark runs without it
+    from video_codec import make_codec, make_test_frame
+    frame = make_test_frame(*args.frame_size)
+    layers = []
+    for layer_scale in args.layers:
+        codec = make_codec("jpeg", quality=args.quality, scale=layer_scale)
+        payload, width, height = codec.encode(frame)
+        layers.append((bytes(payload), width, height, codec.codec_id))
+    return layers
+
+
+async def run_video(args, address, metrics_url):
+    host, port = address
+    layers = encode_layers(args)
+    print("Layers: " + ", ".join(f"{w}x{h} {len(p):,} bytes" for p, w, h, _ in layers))
+    senders = [VideoUser(i, layers, args.tile) for i in range(args.senders)]
+    viewers = [VideoUser(args.senders + i, layers, args.tile) for i in range(args.viewers)]
+    everyone = senders + viewers
+
+    monitor = ServerMonitor(metrics_url)
+    monitor.start()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def connect(user):
+        async with semaphore:
+            try:
+                await user.connect(host, port)
+                return True
+            except OSError:
+                return False
+
+    start = time.perf_counter()
+    connected = await asyncio.gather(*(connect(user) for user in everyone))
+    online = [user for user, ok in zip(everyone, connected) if ok]
+    connect_wall = time.perf_counter() - start
+    print(f"Connected {len(online)}/{len(everyone)} participants in {connect_wall:.1f}s")
+
+    latencies = []
+    measuring = [False]
+    readers = [asyncio.ensure_future(user.read_forever(latencies, measuring)) for user in online]
+    warmup_until = time.perf_counter() + args.warmup
+    until = warmup_until + args.duration
+    sending = asyncio.gather(*(user.send_loop(args.fps, until) for user in senders if user in online),
+                             return_exceptions=True)
+    await asyncio.sleep(args.warmup)
+    measuring[0] = True
+    start = time.perf_counter()
+    await sending
+    wall = time.perf_counter() - start
+    measuring[0] = False
+    server = await monitor.stop()
+
+    for task in readers:
+        task.cancel()
+    for user in online:
+        user.writer.close()
+
+    received = sum(user.received for user in online)
+    # Every participant, senders included, receives every sender's stream
+    expected = len([s for s in senders if s in online]) * len(online) * args.fps * wall
+    results = {
+        "connected": len(online),
+        "frames_received": received,
+        "frames_per_s": received / wall,
+        "delivered_ratio": received / expected if expected else 1.0,
+        "fps_per_stream": received / wall / max(1, len(online)) / max(1, len(senders)),
+        "downlink_mb_per_s": sum(user.received_bytes for user in online) / wall / 1e6,
+        "latency": percentiles(latencies),
+    }
+    results.update(server)
+    return results
+
+
+def video_server(args):
+    port, metrics_port = free_port(), free_port()
+    command = [sys.executable, "new_camera_server.py", "--host", "127.0.0.1", "--port", str(port),
+               "--metrics-port", str(metrics_port)]
+    return spawn(command, port), ("127.0.0.1", port), f"http://127.0.0.1:{metrics_port}/metrics"
+
+
+# --- reporting --------------------------------------------------------------
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def print_results(results):
+    for key, value in flatten(results).items():
+        print(f"  {key:<28} {value:.2f}" if isinstance(value, float) else f"  {key:<28} {value}")
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = flatten(json.load(f)["results"])
+    regressions = []
+    print(f"\nCompared with {baseline_path}:")
+    for key, value in flatten(results).items():
+        old = baseline.get(key)
+        if key in NOT_COMPARED or not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+            continue
+        change = (value - old) / abs(old)
+        worse = -change if key in HIGHER_IS_BETTER else change
+        flag = "  REGRESSION" if worse > tolerance else ""
+        if flag:
+            regressions.append(key)
+        print(f"  {key:<28} {old:>12.2f} -> {value:>12.2f} ({change * 100:+.1f}%){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end chat and video load harness")
+    parser.add_argument("--connect", metavar="HOST:PORT", help="use a running server instead of spawning one")
+    parser.add_argument("--metrics-url", help="metrics endpoint of a --connect server, for CPU and RSS")
+    parser.add_argument("--concurrency", type=int, default=500, help="connects in flight")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--json", metavar="PATH", help="write the run's parameters and results here")
+    parser.add_argument("--compare", metavar="PATH", help="compare with a run saved by --json")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change counted as a regression")
+    scenarios = parser.add_subparsers(dest="scenario", required=True)
+
+    chat = scenarios.add_parser("chat", help="chat users against Final_Server.py --headless")
+    chat.add_argument("--users", type=int, default=1000)
+    chat.add_argument("--senders", type=int, default=10, help="users that send messages")
+    chat.add_argument("--rate", type=float, default=2.0, help="messages per second per sender")
+    chat.add_argument("--rooms", type=int, default=1, help="users are spread evenly across this many rooms")
+    chat.add_argument("--duration", type=float, default=10.0)
+    chat.add_argument("--kdf-iterations", type=int, default=1000,
+                      help="PBKDF2 iterations of the spawned server's password")
+
+    video = scenarios.add_parser("video", help="video participants against new_camera_server.py")
+    video.add_argument("--senders", type=int, default=4)
+    video.add_argument("--viewers", type=int, default=50, help="participants that only receive")
+    video.add_argument("--fps", type=int, default=15)
+    video.add_argument("--frame-size", type=int, nargs=2, default=(640, 480), metavar=("W", "H"))
+    video.add_argument("--quality", type=int, default=70)
+    video.add_argument("--layers", type=float, nargs="+", default=[1.0], help="simulcast layer scales")
+    video.add_argument("--tile", type=int, nargs=2, metavar=("W", "H"), help="tile size viewers subscribe with")
+    video.add_argument("--warmup", type=float, default=2.0)
+    video.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    limit = raise_fd_limit()
+    users = args.users if args.scenario == "chat" else args.senders + args.viewers
+    if users + 64 > limit:
+        print(f"Warning: open file limit is {limit}, some connections will fail")
+
+    server = None
+    metrics_url = args.metrics_url
+    if args.connect:
+        host, port = args.connect.rsplit(":", 1)
+        address = (host, int(port))
+    elif args.scenario == "chat":
+        server, address, metrics_url = chat_server(args)
+    else:
+        server, address, metrics_url = video_server(args)
+
+    run = run_chat if args.scenario == "chat" else run_video
+    try:
+        results = asyncio.run(run(args, address, metrics_url))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    if results is None:
+        return 1
+
+    print(f"{args.scenario} results:")
+    print_results(results)
+    if args.json:
+        params = {key: value for key, value in vars(args).items() if key not in ("json", "compare")}
+        with open(args.json, "w") as f:
+            json.dump({"scenario": args.scenario, "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "host": platform.node(), "python": platform.python_version(),
+                       "params": params, "results": results}, f, indent=2)
+        print(f"Wrote {args.json}")
+    if args.compare:
+        return 1 if compare(results, args.compare, args.tolerance) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import chat_protocol as proto
+from message_log import MessageLog
+
+# Benchmark for message_log.py: cost of append() on the broadcast path, how
+# quickly the background writer keeps up (and how many fsyncs it needs),
+# catch-up reads from memory and from disk, and index rebuild on restart.
+#
+#   python bench_history.py --messages 200000 --rooms 20
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def catch_up(log, since):
+    # What ChatServer.send_history does, minus the sockets
+    count = 0
+    while since < log.last_seq:
+        payloads = log.read_since(since)
+        if not payloads:
+            break
+        count += len(payloads)
+        since = proto.chat_seq(payloads[-1])
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat message log benchmark")
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--size", type=int, default=80, help="characters per message")
+    parser.add_argument("--segment-bytes", type=int, default=1024 * 1024)
+    parser.add_argument("--keep-per-room", type=int, default=1000)
+    parser.add_argument("--dir", help="log directory (default: a temporary one)")
+    args = parser.parse_args()
+
+    directory = args.dir or tempfile.mkdtemp(prefix="chat_history_")
+    text = "x" * args.size
+    rooms = [f"room-{i}" for i in range(args.rooms)]
+    try:
+        log = MessageLog(directory, segment_bytes=args.segment_bytes, keep_per_room=args.keep_per_room)
+        start = time.perf_counter()
+        for i in range(args.messages):
+            proto.encode_chat(rooms[i % args.rooms], text, i)
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(args.messages):
+            log.append(rooms[i % args.rooms], text)
+        append_time = time.perf_counter() - start
+        while log.stats["history_written"] < args.messages:
+            time.sleep(0.01)
+        written_time = time.perf_counter() - start
+
+        print(f"encode_chat alone:   {encode_time / args.messages * 1e6:.2f} us/message")
+        print(f"append (hot path):   {append_time / args.messages * 1e6:.2f} us/message")
+        print(f"writer caught up in  {written_time:.2f}s ({args.messages / written_time:.0f} messages/s, "
+              f"{log.stats['history_fsyncs']} fsyncs in {log.stats['history_batches']} batches)")
+        print(f"segments: {len(log.segments)}, compactions: {log.stats['history_compactions']}")
+
+        last = log.last_seq
+        for back in (100, 1000, 10000, args.messages):
+            count, seconds = timed(catch_up, log, max(0, last - back))
+            print(f"catch-up of last {back:>7}: {count:>7} messages in {seconds * 1000:8.2f} ms")
+        log.close()
+
+        reopened, seconds = timed(MessageLog, directory)
+        print(f"reopen (index rebuild): {seconds * 1000:.1f} ms, next seq {reopened.next_seq} "
+              f"({'ok' if reopened.next_seq == last + 1 else 'MISMATCH'})")
+        count, seconds = timed(catch_up, reopened, 0)
+        print(f"full replay after reopen: {count} messages in {seconds * 1000:.1f} ms")
+        reopened.close()
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
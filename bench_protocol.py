@@ -0,0 +1,49 @@
+import sys
+import time
+import argparse
+
+import chat_protocol as proto
+
+# Throughput microbenchmark for chat_protocol encode/decode.
+#
+#   python bench_protocol.py --frames 200000 --size 64
+
+
+def bench_encode(count, payload):
+    start = time.perf_counter()
+    frames = [proto.encode_frame(proto.CHAT, payload) for _ in range(count)]
+    return time.perf_counter() - start, b"".join(frames)
+
+
+def bench_decode(stream, chunk_size):
+    decoder = proto.FrameDecoder()
+    view = memoryview(stream)
+    decoded = 0
+    start = time.perf_counter()
+    for offset in range(0, len(stream), chunk_size):
+        decoded += len(decoder.feed(view[offset:offset + chunk_size]))
+    return time.perf_counter() - start, decoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat frame encode/decode benchmark")
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--size", type=int, nargs="+", default=[16, 256, 4096], help="payload sizes in bytes")
+    parser.add_argument("--chunk", type=int, nargs="+", default=[1024, 64 * 1024], help="bytes per simulated recv")
+    args = parser.parse_args()
+
+    for size in args.size:
+        payload = b"x" * size
+        elapsed, stream = bench_encode(args.frames, payload)
+        print(f"encode {size:>6} B: {args.frames / elapsed:>12,.0f} frames/s "
+              f"{len(stream) / elapsed / 1e6:>9.1f} MB/s")
+        for chunk in args.chunk:
+            elapsed, decoded = bench_decode(stream, chunk)
+            assert decoded == args.frames, f"decoded {decoded} of {args.frames} frames"
+            print(f"decode {size:>6} B in {chunk:>6} B reads: {decoded / elapsed:>12,.0f} frames/s "
+                  f"{len(stream) / elapsed / 1e6:>9.1f} MB/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import sys
+import time
+import asyncio
+import argparse
+import logging
+
+import chat_protocol as proto
+from chat_server import ChatServer
+from chat_auth import Authenticator, CredentialStore
+from bench_chat_load import PASSWORD, BenchClient, raise_fd_limit
+
+# Room routing benchmark: the same clients and the same number of messages,
+# first all in one global room, then split across more and more rooms. The
+# server runs in-process so its fan-out counters can be read directly.
+#
+#   python bench_rooms.py --clients 2000 --messages 200 --rooms 1 10 100
+
+
+async def join(host, port, room, semaphore):
+    async with semaphore:
+        reader, writer = await asyncio.open_connection(host, port)
+        client = BenchClient(reader, writer)
+        writer.write(proto.encode_frame(proto.PASSWORD, PASSWORD))
+        while True:
+            data = await reader.read(1024)
+            if not data:
+                raise ConnectionError("server closed connection during auth")
+            types = [msg_type for msg_type, _ in client.decoder.feed(data)]
+            if proto.AUTH_SUCCESS in types:
+                break
+            if proto.AUTH_FAIL in types:
+                raise ConnectionError("authentication failed")
+        if room != proto.DEFAULT_ROOM:
+            writer.write(proto.encode_frame(proto.JOIN, room))
+            writer.write(proto.encode_frame(proto.LEAVE, proto.DEFAULT_ROOM))
+        client.room = room
+        return client
+
+
+async def run_case(args, room_count):
+    # A cheap KDF keeps the login phase short; this benchmark is about routing
+    auth = Authenticator(CredentialStore.from_password(PASSWORD, iterations=1000),
+                         max_pending_per_host=args.concurrency)
+    server = ChatServer(args.host, 0, max_queue=args.messages + 16, authenticator=auth)
+    await server.start()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    names = [proto.DEFAULT_ROOM] if room_count == 1 else [f"room-{i}" for i in range(room_count)]
+    clients = await asyncio.gather(
+        *(join(args.host, server.port, names[i % room_count], semaphore) for i in range(args.clients)))
+    readers = [asyncio.ensure_future(c.read_forever()) for c in clients]
+    # Let the JOIN/LEAVE frames land before any chat goes out
+    while sum(len(m) for m in server.rooms.rooms.values()) != args.clients or \
+            len(server.rooms) != room_count:
+        await asyncio.sleep(0.01)
+
+    senders = {}
+    for c in clients:
+        senders.setdefault(c.room, c)
+    expected = 0
+    start = time.perf_counter()
+    for i in range(args.messages):
+        room = names[i % room_count]
+        sender = senders[room]
+        sender.writer.write(proto.encode_frame(proto.CHAT, proto.encode_chat(room, f"bench: message {i}")))
+        expected += len(server.rooms.members(room)) - 1  # the sender is skipped
+        await sender.writer.drain()
+    deadline = time.perf_counter() + args.timeout
+    while sum(len(c.arrivals) for c in clients) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.005)
+    wall = time.perf_counter() - start
+
+    stats = server.stats()
+    received = sum(len(c.arrivals) for c in clients)
+    for task in readers:
+        task.cancel()
+    for c in clients:
+        c.writer.close()
+    # Give the server's handlers a chance to see EOF before tearing it down
+    deadline = time.perf_counter() + 5.0
+    while len(server.sessions) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    await server.stop()
+    return {
+        "rooms": room_count,
+        "received": received,
+        "expected": expected,
+        "per_message": stats["deliveries"] / max(stats["messages"], 1),
+        "fanout_ms_avg": stats["fanout_ms_avg"],
+        "fanout_ms_max": stats["fanout_ms_max"],
+        "wall": wall,
+    }
+
+
+async def run(args):
+    print(f"{args.clients} clients, {args.messages} messages per case")
+    print(f"{'rooms':>7}{'delivered':>14}{'per msg':>10}{'fanout ms avg':>15}{'max':>9}{'wall s':>9}{'msgs/s':>10}")
+    results = []
+    for room_count in args.rooms:
+        r = await run_case(args, room_count)
+        results.append(r)
+        print(f"{r['rooms']:>7}{r['received']:>8}/{r['expected']:<6}{r['per_message']:>9.1f}"
+              f"{r['fanout_ms_avg']:>15.3f}{r['fanout_ms_max']:>9.2f}{r['wall']:>9.2f}"
+              f"{args.messages / r['wall']:>10.0f}")
+    return 0 if all(r['received'] == r['expected'] for r in results) else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat room fan-out benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rooms", type=int, nargs="+", default=[1, 10, 100],
+                        help="room counts to compare, 1 means everyone in the lobby")
+    parser.add_argument("--concurrency", type=int, default=500, help="connects in flight")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    limit = raise_fd_limit()
+    if args.clients * 2 + 64 > limit:
+        print(f"Warning: open file limit is {limit}, some connections will fail")
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import subprocess
+
+import aiohttp
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration
+from aiortc.contrib.media import MediaPlayer
+from aiortc.mediastreams import MediaStreamError
+
+# Multi-peer forwarding benchmark for signaling_server.py. The server runs in
+# a subprocess so its CPU time can be read from /proc. Each room gets one
+# publisher streaming a synthetic ffmpeg test pattern and --subscribers peers
+# receiving it; after a warm-up, the frames each subscriber decodes and the
+# server's CPU use are measured. Each subscriber also sends one datachannel
+# message, which every other peer in its room should receive.
+#
+#   python bench_sfu.py --rooms 2 --subscribers 4
+#   python bench_sfu.py --rooms 2 --subscribers 4 --per-subscriber-encoding
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")  # utime + stime
+
+
+async def wait_for_server(port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+class BenchPeer:
+    def __init__(self, client_id, room):
+        self.client_id = client_id
+        self.room = room
+        self.pc = RTCPeerConnection(RTCConfiguration(iceServers=[]))
+        self.channel = self.pc.createDataChannel("chat")
+        self.frames = 0
+        self.messages = 0
+        self.opened = asyncio.get_running_loop().create_future()
+
+        @self.channel.on("open")
+        def on_open():
+            self.opened.set_result(True)
+
+        @self.channel.on("message")
+        def on_message(message):
+            if not message.startswith("{"):  # skip the server's publisher notices
+                self.messages += 1
+
+        @self.pc.on("track")
+        def on_track(track):
+            asyncio.ensure_future(self.consume(track))
+
+    async def consume(self, track):
+        try:
+            while True:
+                await track.recv()
+                self.frames += 1
+        except MediaStreamError:
+            pass
+
+    async def negotiate(self, session, url, role):
+        await self.pc.setLocalDescription(await self.pc.createOffer())
+        async with session.post(url, json={"sdp": self.pc.localDescription.sdp, "type": self.pc.localDescription.type,
+                                           "client_id": self.client_id, "room": self.room, "role": role}) as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}: {await response.text()}")
+            answer = await response.json()
+        await self.pc.setRemoteDescription(RTCSessionDescription(sdp=answer["sdp"], type=answer["type"]))
+        await asyncio.wait_for(self.opened, 30)
+
+
+async def run(args, url, server_pid):
+    players = []
+    publishers = []
+    subscribers = []
+    async with aiohttp.ClientSession() as session:
+        for r in range(args.rooms):
+            room = f"bench-{r}"
+            player = MediaPlayer(f"testsrc=size={args.size}:rate={args.fps}", format="lavfi")
+            players.append(player)
+            publisher = BenchPeer(f"pub-{r}", room)
+            publisher.pc.addTrack(player.video)
+            await publisher.negotiate(session, url, "publish")
+            publishers.append(publisher)
+            for s in range(args.subscribers):
+                subscriber = BenchPeer(f"sub-{r}-{s}", room)
+                subscriber.pc.addTransceiver("video", direction="recvonly")
+                subscribers.append(subscriber)
+        await asyncio.gather(*(s.negotiate(session, url, "subscribe") for s in subscribers))
+        print(f"{len(publishers)} publisher(s), {len(subscribers)} subscriber(s) connected")
+
+        await asyncio.sleep(args.warmup)
+        frames = [s.frames for s in subscribers]
+        cpu = cpu_seconds(server_pid) if server_pid else None
+        start = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        wall = time.perf_counter() - start
+        fps = sorted((s.frames - f) / wall for s, f in zip(subscribers, frames))
+
+        for subscriber in subscribers:
+            subscriber.channel.send(f"hello from {subscriber.client_id}")
+        await asyncio.sleep(1.0)
+
+    print(f"Subscriber fps over {wall:.1f}s: min {fps[0]:.1f}, median {fps[len(fps) // 2]:.1f}, "
+          f"max {fps[-1]:.1f} (source {args.fps})")
+    if cpu is not None:
+        used = cpu_seconds(server_pid) - cpu
+        print(f"Server CPU: {used / wall * 100:.0f}% of one core "
+              f"({used / wall / max(1, len(subscribers)) * 100:.1f}% per subscriber)")
+    expected = args.subscribers * (args.subscribers - 1) + args.subscribers  # other subscribers + the publisher
+    received = sum(p.messages for p in subscribers + publishers)
+    print(f"Datachannel fan-out: {received}/{expected * args.rooms} deliveries")
+
+    for player in players:
+        if player.video:
+            player.video.stop()
+    await asyncio.gather(*(p.pc.close() for p in publishers + subscribers), return_exceptions=True)
+    return 0 if fps[0] > 0 else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SFU forwarding benchmark")
+    parser.add_argument("--rooms", type=int, default=1)
+    parser.add_argument("--subscribers", type=int, default=4, help="subscribers per room")
+    parser.add_argument("--size", default="320x240")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--per-subscriber-encoding", action="store_true",
+                        help="make the server encode video separately for each subscriber")
+    parser.add_argument("--url", help="benchmark a running server instead of starting one (no CPU figures)")
+    args = parser.parse_args()
+
+    if args.url:
+        return asyncio.run(run(args, args.url, None))
+
+    port = free_port()
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "signaling_server.py"),
+               "--host", "127.0.0.1", "--port", str(port)]
+    if args.per_subscriber_encoding:
+        command.append("--per-subscriber-encoding")
+    server = subprocess.Popen(command, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_for_server(port))
+        return asyncio.run(run(args, f"http://127.0.0.1:{port}/offer", server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import sys
+import time
+import asyncio
+import argparse
+import logging
+import statistics
+
+import aiohttp
+from aiortc import RTCPeerConnection, RTCSessionDescription, RTCConfiguration
+
+from signaling_server import SignalingServer
+
+# Concurrent-offer load test for signaling_server.py. Offers are prepared up
+# front (each with a datachannel so the SDP has something to negotiate), then
+# POSTed to /offer together; the time to each answer is reported. With
+# --connect the answers are applied and the time until each peer connection
+# reaches "connected" is reported too.
+#
+#   python bench_signaling.py --offers 300 --concurrency 300
+#   python bench_signaling.py --url http://10.200.236.221:8080/offer
+
+
+async def prepare_offer():
+    pc = RTCPeerConnection(RTCConfiguration(iceServers=[]))  # host candidates only, like the server
+    pc.createDataChannel("chat")
+    await pc.setLocalDescription(await pc.createOffer())
+    return pc
+
+
+async def negotiate(session, url, pc, client_id, semaphore, connect):
+    async with semaphore:
+        start = time.perf_counter()
+        async with session.post(url, json={"sdp": pc.localDescription.sdp, "type": pc.localDescription.type,
+                                           "client_id": client_id}) as response:
+            if response.status != 200:
+                raise RuntimeError(f"HTTP {response.status}")
+            answer = await response.json()
+        answered = time.perf_counter() - start
+    if not connect:
+        return answered, None
+    connected = asyncio.get_running_loop().create_future()
+
+    @pc.on("connectionstatechange")
+    def on_state():
+        if pc.connectionState in ("connected", "failed") and not connected.done():
+            connected.set_result(pc.connectionState)
+
+    await pc.setRemoteDescription(RTCSessionDescription(sdp=answer["sdp"], type=answer["type"]))
+    state = await asyncio.wait_for(connected, 30)
+    if state != "connected":
+        raise RuntimeError("ICE/DTLS failed")
+    return answered, time.perf_counter() - start
+
+
+def percentiles(values):
+    values = sorted(values)
+    return (f"p50 {statistics.median(values) * 1000:.1f} ms, p99 {values[int(len(values) * 0.99) - 1] * 1000:.1f} ms, "
+            f"max {values[-1] * 1000:.1f} ms")
+
+
+async def run(args, url):
+    start = time.perf_counter()
+    pcs = await asyncio.gather(*(prepare_offer() for _ in range(args.offers)))
+    print(f"Prepared {len(pcs)} offers in {time.perf_counter() - start:.2f}s")
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(negotiate(session, url, pc, f"bench-{i}", semaphore, args.connect) for i, pc in enumerate(pcs)),
+            return_exceptions=True)
+        wall = time.perf_counter() - start
+
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    errors = [r for r in results if isinstance(r, BaseException)]
+    print(f"{len(ok)}/{len(results)} answered in {wall:.2f}s ({len(ok) / wall:.0f} offers/s)")
+    if errors:
+        print(f"First error: {errors[0]!r}")
+    if ok:
+        print(f"Answer latency: {percentiles([r[0] for r in ok])}")
+        if args.connect:
+            print(f"Time to connected: {percentiles([r[1] for r in ok])}")
+    await asyncio.gather(*(pc.close() for pc in pcs), return_exceptions=True)
+    return 0 if not errors else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebRTC signaling load test")
+    parser.add_argument("--offers", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=300, help="offers in flight")
+    parser.add_argument("--connect", action="store_true", help="also complete ICE/DTLS for every peer")
+    parser.add_argument("--url", help="benchmark a running server instead of starting one in-process")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    server = None
+    url = args.url
+    if url is None:
+        # Its own loop thread, exactly as ServerGUI runs it
+        server = SignalingServer('127.0.0.1', 0)
+        server.start_in_thread()
+        url = f"http://127.0.0.1:{server.port}/offer"
+    try:
+        return asyncio.run(run(args, url))
+    finally:
+        if server is not None:
+            print(f"Server: {server.stats}, {len(server.sfu.peers)} peer connections open")
+            server.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
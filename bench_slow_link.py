@@ -0,0 +1,127 @@
+import sys
+import time
+import socket
+import argparse
+import threading
+import statistics
+
+import camera
+import video_protocol
+from video_codec import SyntheticCapture
+from rate_control import AdaptiveController, Level
+
+# Slow-link harness for the adaptive sender. A local "relay" reads from the
+# socket no faster than the configured bandwidth and answers with the same
+# feedback packets new_camera_server.py sends. The camera pipeline runs
+# against it with synthetic frames; the bandwidth changes per phase and the
+# harness reports whether round-trip latency settles under the target.
+#
+#   python bench_slow_link.py --bandwidth 4000 800 2500 --phase 15
+
+
+class ThrottledRelay:
+    def __init__(self, phases, phase_seconds, recv_buffer=32 * 1024):
+        self.phases = phases  # kbit/s per phase
+        self.phase_seconds = phase_seconds
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # A small receive buffer makes the link back up quickly, like a slow uplink
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, recv_buffer)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.address = self.listener.getsockname()
+        self.start_time = None
+
+    def bandwidth(self):
+        phase = int((time.monotonic() - self.start_time) / self.phase_seconds)
+        return self.phases[min(phase, len(self.phases) - 1)] * 1000 / 8  # bytes/s
+
+    def throttled_read(self, sock, view):
+        # recv at most the bytes the link allows, sleeping off the rest
+        while view:
+            chunk = min(len(view), 4096)
+            n = sock.recv_into(view[:chunk])
+            if not n:
+                raise ConnectionError("Sender closed the link")
+            view = view[n:]
+            time.sleep(n / self.bandwidth())
+
+    def serve(self):
+        sock, _ = self.listener.accept()
+        self.start_time = time.monotonic()
+        header_buffer = bytearray(video_protocol.HEADER_SIZE)
+        payload = bytearray(video_protocol.MAX_PAYLOAD)
+        try:
+            while True:
+                self.throttled_read(sock, memoryview(header_buffer))
+                header = video_protocol.unpack_header(header_buffer)
+                self.throttled_read(sock, memoryview(payload)[:header.length])
+                if video_protocol.is_control(header.codec):
+                    continue  # JOIN and SUBSCRIBE carry no timestamp to echo; the relay ignores them too
+                sock.sendall(video_protocol.pack_feedback(0, header.timestamp, header.sequence, 0, 0))
+        except (ConnectionError, OSError):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Adaptive sender slow-link harness")
+    parser.add_argument("--bandwidth", type=int, nargs="+", default=[4000, 800, 2500],
+                        help="link speed in kbit/s for each phase")
+    parser.add_argument("--phase", type=float, default=15.0, help="seconds per phase")
+    parser.add_argument("--target-latency", type=float, default=0.2)
+    parser.add_argument("--fixed", action="store_true", help="send at a fixed quality for comparison")
+    args = parser.parse_args()
+
+    relay = ThrottledRelay(args.bandwidth, args.phase)
+    threading.Thread(target=relay.serve, daemon=True).start()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Keep the kernel send buffer near a real uplink's, otherwise loopback
+    # hides seconds of backlog in it and sendall never blocks
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 64 * 1024)
+    sock.connect(relay.address)
+    video_protocol.set_low_latency(sock)
+    if args.fixed:
+        # A one-level ladder still measures round trip but never adapts
+        controller = AdaptiveController(args.target_latency, ladder=[Level(1.0, camera.jpeg_quality, 30)])
+    else:
+        controller = AdaptiveController(args.target_latency)
+    camera.codec_name = 'jpeg'
+    pipeline = camera.CameraPipeline(sock, controller, SyntheticCapture(), display=False)
+    threading.Thread(target=pipeline.run, daemon=True).start()
+
+    print(f"{'t':>5}{'kbit/s link':>13}{'level':>7}{'fps':>6}{'kbit/s sent':>13}{'rtt ms':>9}{'blocked ms':>12}")
+    samples = {i: [] for i in range(len(args.bandwidth))}
+    start = time.monotonic()
+    last_report = None
+    try:
+        while time.monotonic() - start < args.phase * len(args.bandwidth):
+            time.sleep(0.25)
+            report = controller.last_window
+            if report is None or report is last_report:
+                continue
+            last_report = report
+            elapsed = time.monotonic() - start
+            phase = min(int(elapsed / args.phase), len(args.bandwidth) - 1)
+            print(f"{elapsed:>5.0f}{args.bandwidth[phase]:>13}{report['level']:>7}{report['fps']:>6.1f}"
+                  f"{report['kbps']:>13.0f}{report['rtt_ms']:>9.0f}{report['blocked_ms']:>12.1f}")
+            if elapsed - phase * args.phase > args.phase / 2:
+                samples[phase].append(report['max_rtt_ms'])
+    finally:
+        pipeline.stop()
+        sock.close()
+
+    print()
+    ok = True
+    for phase, values in samples.items():
+        if not values:
+            continue
+        settled = statistics.median(values)
+        within = settled <= args.target_latency * 1000
+        ok = ok and within
+        print(f"Phase {phase} ({args.bandwidth[phase]} kbit/s): settled max RTT {settled:.0f} ms "
+              f"({'within' if within else 'ABOVE'} {args.target_latency * 1000:.0f} ms target)")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
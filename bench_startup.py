@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+
+import video_protocol
+from camera_launcher import CameraLauncher, MODES
+
+# Cold-start benchmark for the GUIs and the video call.
+#
+# "window" starts Final_Server.py's monitor window in a fresh interpreter,
+# with its engines on free ports, and reports time to imports done, to the
+# window's first event loop turn and to the signaling server listening, all
+# from just before the interpreter is started.
+#
+# "camera" measures time to first frame for each camera_launcher mode: from
+# "Join Video Call" until a stand-in relay receives the first video packet.
+# camera.py sends a generated video file instead of a webcam and shows no
+# window. Prewarmed helpers get --warm seconds to load first, as they would
+# while the GUI sits open; in-process runs after the first reuse the loaded
+# modules.
+#
+#   QT_QPA_PLATFORM=offscreen python bench_startup.py window --runs 5
+#   python bench_startup.py camera --runs 3
+#   python bench_startup.py camera --modes prewarm subprocess --source 0   # a real webcam
+
+WINDOW_DRIVER = r"""
+import os, sys, time, json
+started = float(sys.argv[1])
+import Final_Server
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QTimer
+imported = time.time()
+app = QApplication(sys.argv[:1])
+options = Final_Server.parse_args(["--host", "127.0.0.1", "--chat-port", "0", "--signaling-port", "0",
+                                   "--metrics-port", "0", "--history-dir", "", "--camera-mode", sys.argv[2]])
+gui = Final_Server.ServerGUI(options)
+gui.show()
+times = {"import": imported - started}
+
+def shown():
+    times["window"] = time.time() - started
+
+def poll():
+    if gui.signaling_server.runner is None:
+        return
+    times["signaling"] = time.time() - started
+    print(json.dumps(times), flush=True)
+    gui.camera.close()
+    os._exit(0)
+
+QTimer.singleShot(0, shown)
+timer = QTimer()
+timer.timeout.connect(poll)
+timer.start(5)
+app.exec_()
+"""
+
+VIDEO_WRITER = r"""
+import sys, cv2
+from video_codec import make_test_frame
+writer = cv2.VideoWriter(sys.argv[1], cv2.VideoWriter_fourcc(*"MJPG"), 30, (640, 480))
+for i in range(90):
+    writer.write(make_test_frame(index=i))
+writer.release()
+"""
+
+
+def run_window(args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    if not env.get("DISPLAY") and not env.get("WAYLAND_DISPLAY"):
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    results = []
+    print(f"{'run':>4}{'imports ms':>12}{'window ms':>12}{'signaling ms':>14}")
+    for run in range(args.runs):
+        started = time.time()
+        output = subprocess.run([sys.executable, "-c", WINDOW_DRIVER, repr(started), args.camera_mode],
+                                cwd=here, env=env, capture_output=True, text=True, timeout=60)
+        lines = [line for line in output.stdout.splitlines() if line.startswith("{")]
+        if not lines:
+            print(f"Run {run + 1} failed:\n{output.stderr[-2000:]}")
+            return 1
+        times = json.loads(lines[-1])
+        results.append(times)
+        print(f"{run + 1:>4}{times['import'] * 1000:>12.0f}{times['window'] * 1000:>12.0f}"
+              f"{times['signaling'] * 1000:>14.0f}")
+    print(f"{'med':>4}" + "".join(f"{statistics.median(r[key] for r in results) * 1000:>{width}.0f}"
+                                  for key, width in (("import", 12), ("window", 12), ("signaling", 14))))
+    return 0
+
+
+class FirstFrameRelay:
+    # Accepts camera.py connections and notes when the first video packet arrives
+    def __init__(self):
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.first_frame = threading.Event()
+        self.first_frame_at = None
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def reset(self):
+        self.first_frame_at = None
+        self.first_frame.clear()
+
+    def accept_loop(self):
+        while True:
+            client, _ = self.server.accept()
+            threading.Thread(target=self.read_loop, args=(client,), daemon=True).start()
+
+    def read_loop(self, client):
+        reader = video_protocol.PacketReader(client)
+        try:
+            while True:
+                header, _ = reader.read()
+                if not video_protocol.is_control(header.codec) and not self.first_frame.is_set():
+                    self.first_frame_at = time.perf_counter()
+                    self.first_frame.set()
+        except (OSError, ValueError):
+            client.close()
+
+
+def run_camera(args):
+    relay = FirstFrameRelay()
+    with tempfile.TemporaryDirectory() as directory:
+        source = args.source
+        if source is None:
+            source = os.path.join(directory, "source.avi")
+            subprocess.run([sys.executable, "-c", VIDEO_WRITER, source], check=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+        camera_args = ["--server", "127.0.0.1", "--port", str(relay.port), "--source", source, "--no-display"]
+        print(f"{'mode':>12}{'run':>5}{'first frame ms':>16}")
+        in_process = None
+        for mode in args.modes:
+            results = []
+            for run in range(args.runs):
+                if mode == "inprocess":
+                    launcher = in_process = in_process or CameraLauncher(mode, camera_args)
+                else:
+                    launcher = CameraLauncher(mode, camera_args, output=subprocess.DEVNULL)
+                if mode == "prewarm":
+                    time.sleep(args.warm)
+                relay.reset()
+                start = time.perf_counter()
+                launcher.launch()
+                got_frame = relay.first_frame.wait(args.timeout)
+                elapsed = relay.first_frame_at - start if got_frame else None
+                launcher.hang_up()
+                if launcher is not in_process:
+                    launcher.close()
+                if elapsed is None:
+                    print(f"{mode:>12}{run + 1:>5}{'timeout':>16}")
+                    continue
+                results.append(elapsed)
+                print(f"{mode:>12}{run + 1:>5}{elapsed * 1000:>16.0f}")
+            if results:
+                print(f"{mode:>12}{'med':>5}{statistics.median(results) * 1000:>16.0f}")
+        if in_process is not None:
+            in_process.close()
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GUI and video call cold-start benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+    window = commands.add_parser("window", help="time to Final_Server's window")
+    window.add_argument("--runs", type=int, default=5)
+    window.add_argument("--camera-mode", choices=MODES, default="prewarm")
+    camera = commands.add_parser("camera", help="time to first video frame per launch mode")
+    camera.add_argument("--modes", nargs="+", choices=MODES, default=["subprocess", "prewarm", "inprocess"])
+    camera.add_argument("--runs", type=int, default=3)
+    camera.add_argument("--source", help="camera index or video file, default a generated clip")
+    camera.add_argument("--warm", type=float, default=3.0, help="seconds a prewarmed helper gets to load")
+    camera.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+    return run_window(args) if args.command == "window" else run_camera(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
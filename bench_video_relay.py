@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+
+import video_protocol
+from video_codec import make_codec, make_test_frame
+
+# Relay benchmark for new_camera_server.py: N synthetic participants each send
+# pre-encoded frames at a fixed rate and count what they receive. Reports the
+# server's CPU use and delivered frames per second as N grows. With
+# --slow-viewers, that many extra participants read at a crawl; the other
+# participants' frame rate should not change. With --layers each frame is sent
+# as simulcast layers at those scales, and --tile has every participant ask
+# the relay for layers that fit a tile of that size, as camera.py does.
+#
+#   python bench_video_relay.py --participants 2 4 8 16 32 --fps 15
+#   python bench_video_relay.py --participants 8 --slow-viewers 2
+#   python bench_video_relay.py --participants 8 --scale 1 --layers 1 0.5 0.25 --tile 426 240
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "new_camera_server.py")
+
+
+def server_cpu_seconds(pid):
+    # utime + stime from /proc/<pid>/stat, in seconds
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class Participant:
+    def __init__(self, host, port, layers, codec_id, fps, read_delay=0.0, tile=None):
+        self.socket = socket.create_connection((host, port))
+        video_protocol.set_low_latency(self.socket)
+        if tile:
+            self.socket.sendall(video_protocol.pack_subscribe(*tile))
+        self.layers = layers  # [(payload, width, height)], largest first
+        self.codec_id = codec_id
+        self.fps = fps
+        self.read_delay = read_delay
+        self.received = 0
+        self.received_bytes = 0
+        self.stop = threading.Event()
+
+    def send_loop(self):
+        interval = 1.0 / self.fps
+        sequence = 0
+        next_send = time.perf_counter()
+        try:
+            while not self.stop.is_set():
+                timestamp = time.time()
+                for layer, (payload, width, height) in enumerate(self.layers):
+                    header = video_protocol.pack_header(0, sequence, timestamp, width, height,
+                                                        self.codec_id, len(payload), layer)
+                    video_protocol.send_packet(self.socket, header, payload)
+                sequence += 1
+                next_send += interval
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except OSError:
+            pass
+
+    def receive_loop(self):
+        reader = video_protocol.PacketReader(self.socket)
+        try:
+            while not self.stop.is_set():
+                header, payload = reader.read()
+                if not video_protocol.is_control(header.codec):  # feedback is not a delivered frame
+                    self.received += 1
+                    self.received_bytes += video_protocol.HEADER_SIZE + header.length
+                if self.read_delay:
+                    time.sleep(self.read_delay)
+        except (OSError, ValueError):
+            pass
+
+    def start(self):
+        self.threads = [threading.Thread(target=self.send_loop, daemon=True),
+                        threading.Thread(target=self.receive_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def close(self):
+        self.stop.set()
+        self.socket.close()
+
+
+def run_round(args, server, count, layers, codec_id):
+    participants = [Participant(args.host, args.port, layers, codec_id, args.fps, tile=args.tile)
+                    for _ in range(count)]
+    slow = [Participant(args.host, args.port, layers, codec_id, args.fps, read_delay=0.5, tile=args.tile)
+            for _ in range(args.slow_viewers)]
+    for p in participants + slow:
+        p.start()
+    time.sleep(args.warmup)
+
+    received = sum(p.received for p in participants)
+    received_bytes = sum(p.received_bytes for p in participants)
+    cpu = server_cpu_seconds(server.pid)
+    start = time.perf_counter()
+    time.sleep(args.duration)
+    elapsed = time.perf_counter() - start
+    cpu = server_cpu_seconds(server.pid) - cpu
+    received = sum(p.received for p in participants) - received
+    received_bytes = sum(p.received_bytes for p in participants) - received_bytes
+
+    for p in participants + slow:
+        p.close()
+    time.sleep(0.5)
+
+    # every participant sees every stream, including its own and the slow viewers'
+    expected = count * (count + len(slow)) * args.fps
+    print(f"{count:>12}{received / elapsed:>14.0f}{expected:>12}"
+          f"{received / elapsed / count:>16.1f}{received_bytes / elapsed / 1e6:>10.1f}"
+          f"{cpu / elapsed * 100:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Video relay benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--participants", type=int, nargs="+", default=[2, 4, 8, 16, 32])
+    parser.add_argument("--fps", type=int, default=15, help="frames per second sent by each participant")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--scale", type=float, default=0.5)
+    parser.add_argument("--layers", type=float, nargs="+", default=[1.0],
+                        help="simulcast layer scales relative to --scale, largest first")
+    parser.add_argument("--tile", type=int, nargs=2, metavar=("W", "H"),
+                        help="tile size participants subscribe with")
+    parser.add_argument("--slow-viewers", type=int, default=0, help="extra participants that barely read")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    args = parser.parse_args()
+
+    frame = make_test_frame()
+    layers = []
+    for layer_scale in args.layers:
+        codec = make_codec("jpeg", quality=args.quality, scale=args.scale * layer_scale)
+        payload, width, height = codec.encode(frame)
+        layers.append((bytes(payload), width, height))
+    print("Frame: " + ", ".join(f"{width}x{height} {len(payload):,} bytes" for payload, width, height in layers)
+          + f" jpeg, {args.fps} fps per participant" + (f", tile {args.tile[0]}x{args.tile[1]}" if args.tile else ""))
+
+    server = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--host", args.host,
+                               "--port", str(args.port)], stdout=subprocess.DEVNULL)
+    time.sleep(1.0)
+    try:
+        print(f"{'participants':>12}{'frames/s':>14}{'expected':>12}{'fps/viewer':>16}{'MB/s':>10}{'server CPU%':>12}")
+        for count in args.participants:
+            run_round(args, server, count, layers, codec.codec_id)
+    finally:
+        server.terminate()
+        server.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import subprocess
+import multiprocessing
+
+import video_protocol
+from video_codec import make_codec, make_test_frame
+
+# Sharding benchmark for new_camera_server.py --workers: participants split
+# into rooms each send pre-encoded frames at a fixed rate and count what they
+# receive. For each worker count it reports delivered frames per second
+# against what full delivery would be (rooms x per-room^2 x fps) and the CPU
+# used by the supervisor and its workers together. Participants run as
+# asyncio tasks across --client-procs processes so the load generator is not
+# the bottleneck. Gains stop at the number of cores the host has.
+#
+#   python bench_video_shards.py --workers 1 2 4 --rooms 8 --per-room 4 --fps 15
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "new_camera_server.py")
+
+
+def process_tree_cpu_seconds(pid):
+    # utime + stime of pid and its direct children, from /proc
+    total = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        total += int(fields[11]) + int(fields[12])
+    return total / os.sysconf("SC_CLK_TCK")
+
+
+async def participant(host, port, room, payload, width, height, codec_id, fps, counts, index, stop):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(video_protocol.pack_join(room))
+    header = video_protocol.pack_header(0, 0, 0.0, width, height, codec_id, len(payload))
+
+    async def send():
+        interval = 1.0 / fps
+        next_send = time.perf_counter()
+        while not stop.is_set():
+            writer.write(header)
+            writer.write(payload)
+            await writer.drain()
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+
+    sender = asyncio.ensure_future(send())
+    try:
+        while not stop.is_set():
+            data = await reader.readexactly(video_protocol.HEADER_SIZE)
+            frame = video_protocol.unpack_header(data)
+            await reader.readexactly(frame.length)
+            if not video_protocol.is_control(frame.codec):
+                counts[index] += 1
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        sender.cancel()
+        writer.close()
+
+
+def client_process(host, port, assignments, payload, width, height, codec_id, fps, duration, results):
+    # assignments: room names, one per participant this process runs
+    async def main():
+        stop = asyncio.Event()
+        counts = [0] * len(assignments)
+        tasks = [asyncio.ensure_future(participant(host, port, room, payload, width, height, codec_id,
+                                                   fps, counts, i, stop))
+                 for i, room in enumerate(assignments)]
+        await asyncio.sleep(duration)
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return sum(counts)
+
+    results.put(asyncio.run(main()))
+
+
+def run_round(args, workers, payload, width, height, codec_id):
+    server = subprocess.Popen([sys.executable, SERVER_SCRIPT, "--host", args.host,
+                               "--port", str(args.port), "--workers", str(workers)],
+                              stdout=subprocess.DEVNULL)
+    time.sleep(1.0 + 0.2 * workers)
+    try:
+        rooms = [f"room-{r}" for r in range(args.rooms) for _ in range(args.per_room)]
+        procs = max(1, min(args.client_procs, len(rooms)))
+        results = multiprocessing.Queue()
+        window = args.warmup + args.duration
+        clients = [multiprocessing.Process(target=client_process,
+                                           args=(args.host, args.port, rooms[i::procs], payload, width, height,
+                                                 codec_id, args.fps, window, results))
+                   for i in range(procs)]
+        for client in clients:
+            client.start()
+        time.sleep(args.warmup)
+        cpu = process_tree_cpu_seconds(server.pid)
+        start = time.perf_counter()
+        time.sleep(args.duration)
+        elapsed = time.perf_counter() - start
+        cpu = process_tree_cpu_seconds(server.pid) - cpu
+        received = sum(results.get() for _ in clients)
+        for client in clients:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait()
+    time.sleep(0.5)
+
+    # counts cover warmup too, so rates are over the whole window
+    expected = args.rooms * args.per_room * args.per_room * args.fps
+    print(f"{workers:>8}{received / window:>14.0f}{expected:>12}"
+          f"{received / window / expected * 100:>11.1f}%{cpu / elapsed * 100:>13.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded video relay benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5098)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--rooms", type=int, default=8)
+    parser.add_argument("--per-room", type=int, default=4, help="participants in each room")
+    parser.add_argument("--fps", type=int, default=15, help="frames per second sent by each participant")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--scale", type=float, default=0.5)
+    parser.add_argument("--client-procs", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    args = parser.parse_args()
+
+    codec = make_codec("jpeg", quality=args.quality, scale=args.scale)
+    payload, width, height = codec.encode(make_test_frame())
+    payload = bytes(payload)
+    print(f"Frame: {width}x{height} {len(payload):,} bytes jpeg, {args.fps} fps, "
+          f"{args.rooms} rooms of {args.per_room}, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8}{'frames/s':>14}{'expected':>12}{'delivered':>12}{'server CPU%':>13}")
+    for workers in args.workers:
+        run_round(args, workers, payload, width, height, codec.codec_id)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,94 +1,463 @@
+import sys
 import socket
 import threading
+import queue
 import cv2
-import pickle
-import struct
 import time
+import argparse
+
+import video_protocol
+from video_codec import make_codec, decode_frame, make_test_frame
+from video_compositor import TiledCompositor, COMPOSITE_ID
+from rate_control import AdaptiveController
+from reconnect import Backoff
 
 # Server configuration
 server_ip = '10.200.236.221'  # Replace with server's IP address
 server_port = 5000
+room = 'lobby'  # only participants in the same room see each other
+
+# Codec configuration: 'jpeg' or 'raw'; quality only applies to jpeg
+codec_name = 'jpeg'
+jpeg_quality = 80
+frame_scale = 1.0  # e.g. 0.5 sends 320x240 from a 640x480 camera
+
+# Simulcast: every frame is also sent at these fractions of the sending
+# resolution, and the relay forwards each viewer only the layer that fits the
+# tile it shows that participant in. (1.0,) sends a single layer.
+simulcast_layers = (1.0, 0.5, 0.25)
+min_layer_width = 80  # smaller layers are not worth sending
+
+# Adaptive sending: adjust resolution, quality and frame rate to keep the
+# round trip to the relay under target_latency. Overrides the settings above.
+adaptive = True
+target_latency = 0.2
+
+# Capture source: a device index, or a video file or stream URL
+camera_source = 0
+
+# Display configuration
+show_video = True  # False sends only, with no window
+display_size = (1280, 720)
+display_fps = 30
+participant_timeout = 3.0  # seconds without frames before a tile is cleared
+
+# Pipeline configuration. Capture, encode, send, receive, decode and display
+# each run on their own thread(s), joined by small bounded queues, so one
+# slow stage drops frames instead of stalling the others.
+encode_workers = 2
+decode_workers = 2
+queue_size = 2
+stats_interval = 0  # seconds between per-stage timing reports, 0 to disable
 
-def receive_frames(client_socket, stop_event):
-    data = b""
-    payload_size = struct.calcsize("Q")
-    window_name = "Camera Feed"
-    window_initialized = False
-    frames = {}
+def create_codec():
+    if codec_name == 'jpeg':
+        return make_codec('jpeg', quality=jpeg_quality, scale=frame_scale)
+    return make_codec(codec_name, scale=frame_scale)
 
-    while not stop_event.is_set():
+def put_latest(q, item, on_drop=None):
+    # Non-blocking put that evicts the oldest item when the queue is full
+    while True:
         try:
-            while len(data) < payload_size:
-                packet = client_socket.recv(4*1024)  # 4KB
-                if not packet:
-                    return
-                data += packet
-
-            packed_msg_size = data[:payload_size]
-            data = data[payload_size:]
-            msg_size = struct.unpack("Q", packed_msg_size)[0]
-
-            while len(data) < msg_size:
-                data += client_socket.recv(4*1024)
-            frame_data = data[:msg_size]
-            data = data[msg_size:]
-
-            client_id, frame = pickle.loads(frame_data)
-
-            if not window_initialized:
-                cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-                cv2.imshow(window_name, frame)
-                window_initialized = True
-            else:
-                frames[client_id] = frame
-                combined_frame = frames[0]
-                for i in range(1, len(frames)):
-                    combined_frame = cv2.hconcat([combined_frame, frames[i]])
-                cv2.imshow(window_name, combined_frame)
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                old = q.get_nowait()
+            except queue.Empty:
+                continue
+            if on_drop is not None:
+                on_drop(old)
 
-            if cv2.waitKey(1) & 0xFF == 27:  # Esc key
-                stop_event.set()
+class StageTimer:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.dropped = 0
+
+    def record(self, seconds):
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def drop(self):
+        with self.lock:
+            self.dropped += 1
+
+    def snapshot(self):
+        # Returns and resets the counters for this reporting interval
+        with self.lock:
+            stats = {
+                "count": self.count,
+                "avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "max_ms": self.max * 1000,
+                "dropped": self.dropped,
+            }
+            self.count, self.total, self.max, self.dropped = 0, 0.0, 0.0, 0
+            return stats
+
+class FramePool:
+    # Capture buffers recycled between the capture thread and the network
+    # writer, so steady-state capture allocates nothing
+    def __init__(self, size):
+        self.free = queue.Queue()
+        for _ in range(size):
+            self.free.put(None)  # allocated by the first cap.read() that uses it
+
+    def acquire(self, timeout):
+        return self.free.get(timeout=timeout)
+
+    def release(self, buffer):
+        self.free.put(buffer)
+
+class CameraPipeline:
+    STAGES = ("capture", "encode", "send", "receive", "decode", "display")
+
+    def __init__(self, client_socket, controller=None, cap=None, display=True):
+        self.socket = client_socket
+        self.controller = controller
+        self.cap = cap
+        self.display = display
+        self.stop_event = threading.Event()
+        self.finished = False  # Esc or a dead camera, as opposed to a lost connection
+        self.timers = {name: StageTimer(name) for name in self.STAGES}
+
+        self.pool = FramePool(queue_size + encode_workers + 2)
+        self.encode_queue = queue.Queue(maxsize=queue_size)
+        self.send_queue = queue.Queue(maxsize=queue_size + encode_workers)
+        self.decode_queue = queue.Queue(maxsize=queue_size * decode_workers)
+        self.display_queue = queue.Queue(maxsize=queue_size * decode_workers)
+        self.compositor = TiledCompositor(*display_size) if display else None
+
+        level = controller.level if controller is not None else None
+        self.quality = level.quality if level else jpeg_quality
+        self.scale = level.scale if level else frame_scale
+        self.level_version = 0  # bumped when the controller picks a new level
+
+    # --- sending side -----------------------------------------------------
+
+    def capture_loop(self):
+        cap = self.cap if self.cap is not None else cv2.VideoCapture(camera_source)
+        timer = self.timers["capture"]
+        sequence = 0
+        next_frame = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                buffer = self.pool.acquire(timeout=0.5)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            ret, frame = cap.read(buffer)
+            if not ret:
+                print("Camera read failed")
+                self.finished = True  # reconnecting would not help
+                self.stop_event.set()
                 break
+            timer.record(time.perf_counter() - start)
+
+            if self.encode_queue.full():
+                # Encoders are behind; skip this frame rather than queue it
+                timer.drop()
+                self.pool.release(frame)
+            else:
+                self.encode_queue.put((sequence, time.time(), frame))
+                sequence += 1
+
+            if self.controller is not None:
+                next_frame = max(next_frame + self.controller.frame_interval, time.monotonic() - 1.0)
+                delay = next_frame - time.monotonic()
+                if delay > 0:
+                    self.stop_event.wait(delay)
+
+    def encode_loop(self):
+        codecs = [create_codec() for _ in simulcast_layers]  # one per layer, largest first
+        version = -1
+        timer = self.timers["encode"]
+        while not self.stop_event.is_set():
+            try:
+                sequence, timestamp, frame = self.encode_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if version != self.level_version:
+                version = self.level_version
+                for codec, layer_scale in zip(codecs, simulcast_layers):
+                    codec.configure(self.quality, self.scale * layer_scale)
+            start = time.perf_counter()
+            packets = []
+            try:
+                for layer, codec in enumerate(codecs):
+                    if layer and frame.shape[1] * codec.scale < min_layer_width:
+                        break
+                    payload, width, height = codec.encode(frame)
+                    # client_id is filled in by the server
+                    header = video_protocol.pack_header(0, sequence, timestamp, width, height,
+                                                        codec.codec_id, len(payload), layer)
+                    packets.append((header, payload))
+            except Exception as e:
+                print(f"Encode error: {e}")
+                packets = []
+            timer.record(time.perf_counter() - start)
+            # The frame buffer goes along so the writer can recycle it after
+            # sending; the raw codec's payload is a view of it
+            self.send_queue.put((sequence, packets, frame))
+
+    def send_loop(self):
+        timer = self.timers["send"]
+        pending = {}  # encoders can finish out of order; send by sequence
+        next_sequence = 0
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    item = self.send_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                pending[item[0]] = item
+                while next_sequence in pending:
+                    _, packets, frame = pending.pop(next_sequence)
+                    next_sequence += 1
+                    if packets:
+                        start = time.perf_counter()
+                        for header, payload in packets:
+                            video_protocol.send_packet(self.socket, header, payload)
+                        elapsed = time.perf_counter() - start
+                        timer.record(elapsed)
+                        self.after_send(elapsed, sum(len(payload) for _, payload in packets))
+                    self.pool.release(frame)
         except Exception as e:
-            print(f"Error: {e}")
-            break
+            if not self.stop_event.is_set():
+                print(f"Send error: {e}")
+            self.stop_event.set()
+
+    def after_send(self, send_seconds, size):
+        if self.controller is None:
+            return
+        # Time blocked in sendall is the local sign of a full link
+        self.controller.on_frame_sent(send_seconds, size)
+        if self.controller.update():
+            level = self.controller.level
+            self.quality, self.scale = level.quality, level.scale
+            self.level_version += 1
+            print(f"Video quality: {level.scale:.2f}x scale, quality {level.quality}, {level.fps} fps")
 
-def send_frames(client_socket, stop_event):
-    cap = cv2.VideoCapture(0)
-    while not stop_event.is_set():
+    # --- receiving side ---------------------------------------------------
+
+    def receive_loop(self):
+        reader = video_protocol.PacketReader(self.socket)
+        timer = self.timers["receive"]
         try:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            data = pickle.dumps(frame)
-            message = struct.pack("Q", len(data)) + data
-            client_socket.sendall(message)
+            while not self.stop_event.is_set():
+                header, payload = reader.read()
+                start = time.perf_counter()
+                if header.codec == video_protocol.CODEC_FEEDBACK:
+                    if self.controller is not None:
+                        self.controller.on_feedback(video_protocol.unpack_feedback(payload))
+                    continue
+                if not self.display:
+                    continue
+                # The reader reuses its buffer, so the payload is copied out once here
+                put_latest(self.decode_queue, (header, bytes(payload)), lambda _: timer.drop())
+                timer.record(time.perf_counter() - start)
         except Exception as e:
-            print(f"Error: {e}")
-            break
+            if not self.stop_event.is_set():
+                print(f"Receive error: {e}")
+            self.stop_event.set()
 
-def connect_to_server():
-    while True:
+    def decode_loop(self):
+        timer = self.timers["decode"]
+        while not self.stop_event.is_set():
+            try:
+                header, payload = self.decode_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            start = time.perf_counter()
+            try:
+                frame = decode_frame(header, payload)
+            except Exception as e:
+                print(f"Decode error: {e}")
+                continue
+            timer.record(time.perf_counter() - start)
+            put_latest(self.display_queue, (header, frame), lambda _: timer.drop())
+
+    def display_loop(self):
+        # Runs on the calling thread: HighGUI wants imshow/waitKey on one thread
+        window_name = "Camera Feed"
+        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+        compositor = self.compositor
+        timer = self.timers["display"]
+        display_interval = 1.0 / display_fps
+        last_display = 0.0
+        last_cleanup = time.monotonic()
+        last_sequence = {}  # decode workers may finish out of order
+
+        while not self.stop_event.is_set():
+            try:
+                header, frame = self.display_queue.get(timeout=display_interval)
+            except queue.Empty:
+                header = None
+
+            start = time.perf_counter()
+            now = time.monotonic()
+            if header is not None and header.sequence >= last_sequence.get(header.client_id, -1):
+                last_sequence[header.client_id] = header.sequence
+                if header.client_id == COMPOSITE_ID:
+                    # The server already tiled everyone into one frame
+                    cv2.imshow(window_name, frame)
+                    last_display = now
+                else:
+                    compositor.update(header.client_id, frame)
+            if now - last_cleanup > participant_timeout:
+                for client_id in compositor.remove_stale(participant_timeout):
+                    last_sequence.pop(client_id, None)
+                last_cleanup = now
+            if now - last_display >= display_interval and compositor.tiles:
+                cv2.imshow(window_name, compositor.canvas)
+                last_display = now
+                timer.record(time.perf_counter() - start)
+
+            if cv2.waitKey(1) & 0xFF == 27:  # Esc key
+                self.finished = True
+                self.stop_event.set()
+        cv2.destroyAllWindows()
+
+    # --- control ----------------------------------------------------------
+
+    def stats(self):
+        stats = {name: timer.snapshot() for name, timer in self.timers.items()}
+        stats["queues"] = {
+            "encode": self.encode_queue.qsize(),
+            "send": self.send_queue.qsize(),
+            "decode": self.decode_queue.qsize(),
+            "display": self.display_queue.qsize(),
+        }
+        return stats
+
+    def report_loop(self):
+        while not self.stop_event.wait(stats_interval):
+            stats = self.stats()
+            queues = stats.pop("queues")
+            print(" | ".join(f"{name} {s['avg_ms']:.1f}/{s['max_ms']:.1f} ms x{s['count']}"
+                             + (f" ({s['dropped']} dropped)" if s['dropped'] else "")
+                             for name, s in stats.items()) + f" | queues {queues}")
+
+    def watch_cancel(self, cancel):
+        # cancel is set from outside the call (camera_launcher in-process mode)
+        while not self.stop_event.wait(0.2):
+            if cancel.is_set():
+                self.finished = True
+                self.stop()
+
+    def run(self, cancel=None):
+        self.socket.sendall(video_protocol.pack_join(room))  # must be the first packet
+        if self.display:
+            # Ask the relay for layers no bigger than the tiles they are drawn in
+            self.socket.sendall(video_protocol.pack_subscribe(self.compositor.tile_width,
+                                                              self.compositor.tile_height))
+        threads = [threading.Thread(target=self.capture_loop), threading.Thread(target=self.send_loop),
+                   threading.Thread(target=self.receive_loop)]
+        threads += [threading.Thread(target=self.encode_loop) for _ in range(encode_workers)]
+        if self.display:
+            threads += [threading.Thread(target=self.decode_loop) for _ in range(decode_workers)]
+        if stats_interval > 0:
+            threads.append(threading.Thread(target=self.report_loop))
+        if cancel is not None:
+            threads.append(threading.Thread(target=self.watch_cancel, args=(cancel,)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        if self.display:
+            self.display_loop()
+        else:
+            self.stop_event.wait()
+        self.stop()
+        for thread in threads:
+            thread.join(timeout=1.0)
+
+    def stop(self):
+        self.stop_event.set()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)  # unblocks the receive thread
+        except OSError:
+            pass
+
+def connect_to_server(cancel=None):
+    backoff = Backoff()
+    while cancel is None or not cancel.is_set():
         try:
             client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             client_socket.connect((server_ip, server_port))
+            video_protocol.set_low_latency(client_socket)
             print("Connected to server")
 
-            stop_event = threading.Event()
-
-            receive_thread = threading.Thread(target=receive_frames, args=(client_socket, stop_event))
-            receive_thread.start()
-
-            send_thread = threading.Thread(target=send_frames, args=(client_socket, stop_event))
-            send_thread.start()
-
-            receive_thread.join()
-            send_thread.join()
+            connected_at = time.monotonic()
+            controller = AdaptiveController(target_latency) if adaptive else None
+            pipeline = CameraPipeline(client_socket, controller, display=show_video)
+            pipeline.run(cancel)
             client_socket.close()
-            break
+            if pipeline.finished:
+                break
+            print("Lost connection to server")
+            if time.monotonic() - connected_at > backoff.maximum:
+                backoff.reset()  # only a connection that held up resets the backoff
         except Exception as e:
             print(f"Connection error: {e}")
-            time.sleep(5)  # Wait for 5 seconds before trying to reconnect
+        delay = backoff.next_delay()
+        print(f"Reconnecting in {delay:.1f}s")
+        if cancel is not None:
+            cancel.wait(delay)
+        else:
+            time.sleep(delay)
+
+def wait_for_start():
+    # camera.py --standby: camera_launcher starts this ahead of time, so by the
+    # time someone joins a call cv2, numpy and the codecs are loaded and warm.
+    # One line on stdin starts the call; end of file means it is not wanted.
+    create_codec().encode(make_test_frame())  # the first encode sets up the encoder's tables
+    return sys.stdin.readline().strip() == "start"
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Video call client")
+    parser.add_argument("--server", default=server_ip)
+    parser.add_argument("--port", type=int, default=server_port)
+    parser.add_argument("--room", default=room)
+    parser.add_argument("--source", default=str(camera_source),
+                        help="camera index, or a video file or URL to send instead")
+    parser.add_argument("--no-display", action="store_true", help="send only, without the call window")
+    parser.add_argument("--codec", choices=["jpeg", "raw"], default=codec_name)
+    parser.add_argument("--quality", type=int, default=jpeg_quality, help="JPEG quality 1-100")
+    parser.add_argument("--scale", type=float, default=frame_scale, help="resolution scale before encoding")
+    parser.add_argument("--layers", type=float, nargs="+", default=simulcast_layers,
+                        help="simulcast resolutions as fractions of the sending resolution, largest first")
+    parser.add_argument("--fixed", action="store_true", help="disable adaptive quality and send at --quality/--scale")
+    parser.add_argument("--target-latency", type=float, default=target_latency, help="seconds")
+    parser.add_argument("--encode-workers", type=int, default=encode_workers)
+    parser.add_argument("--decode-workers", type=int, default=decode_workers)
+    parser.add_argument("--stats-interval", type=float, default=stats_interval,
+                        help="print per-stage timing every N seconds")
+    parser.add_argument("--standby", action="store_true",
+                        help="load everything, then wait for 'start' on stdin (used by camera_launcher)")
+    return parser
+
+def configure(args):
+    global server_ip, server_port, room, camera_source, show_video, codec_name, jpeg_quality, frame_scale
+    global simulcast_layers, adaptive, target_latency, encode_workers, decode_workers, stats_interval
+    server_ip, server_port, room = args.server, args.port, args.room
+    camera_source = int(args.source) if args.source.isdigit() else args.source
+    show_video = not args.no_display
+    codec_name, jpeg_quality, frame_scale = args.codec, args.quality, args.scale
+    simulcast_layers = tuple(args.layers)
+    adaptive, target_latency = not args.fixed, args.target_latency
+    encode_workers, decode_workers = args.encode_workers, args.decode_workers
+    stats_interval = args.stats_interval
 
 if __name__ == "__main__":
+    args = build_parser().parse_args()
+    configure(args)
+    if args.standby and not wait_for_start():
+        sys.exit(0)
     connect_to_server()
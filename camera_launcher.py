@@ -0,0 +1,110 @@
+import os
+import sys
+import logging
+import threading
+import subprocess
+
+# How Final_Client and Final_Server start camera.py for "Join Video Call".
+# Starting a fresh interpreter per click means importing cv2 and numpy and
+# setting up the codecs every time, which takes seconds on slow machines.
+#
+#   prewarm     a "camera.py --standby" helper is started with the GUI. It
+#               loads everything, then waits; a click only tells it to
+#               connect. The next helper is warmed once that call ends.
+#   inprocess   camera.py runs on a thread of the GUI process, no process
+#               start at all. HighGUI then shares the process with Qt, so use
+#               it with --no-display or a cv2 build without its own Qt.
+#   subprocess  a cold "python camera.py" per click, as before.
+
+CAMERA_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "camera.py")
+MODES = ("prewarm", "inprocess", "subprocess")
+
+
+class CameraLauncher:
+    def __init__(self, mode="prewarm", args=(), output=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown camera mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.args = list(args)  # camera.py command line options
+        self.output = output  # stdout for the camera process, inherited when None
+        self.standby = None  # warmed helper waiting for "start"
+        self.call = None  # Popen or Thread of the running call
+        self.cancel = None  # ends an in-process call
+        self.closed = False
+        self.lock = threading.Lock()
+        if mode == "prewarm":
+            self.warm()
+
+    def warm(self):
+        with self.lock:
+            if self.closed or (self.standby is not None and self.standby.poll() is None):
+                return
+            self.standby = self._spawn("--standby", stdin=subprocess.PIPE)
+
+    def _spawn(self, *extra, stdin=None):
+        return subprocess.Popen([sys.executable, CAMERA_SCRIPT, *self.args, *extra],
+                                stdin=stdin, stdout=self.output)
+
+    @property
+    def in_call(self):
+        if isinstance(self.call, subprocess.Popen):
+            return self.call.poll() is None
+        return self.call is not None and self.call.is_alive()
+
+    def launch(self):
+        # Returns False when a call is already running
+        with self.lock:
+            if self.in_call:
+                return False
+            if self.mode == "subprocess":
+                self.call = self._spawn()
+            elif self.mode == "inprocess":
+                self.call = self._start_in_process()
+            else:
+                helper, self.standby = self.standby, None
+                if helper is None or helper.poll() is not None:
+                    helper = self._spawn("--standby", stdin=subprocess.PIPE)  # died or never warmed
+                helper.stdin.write(b"start\n")
+                helper.stdin.close()
+                self.call = helper
+                threading.Thread(target=self._warm_after, args=(helper,), daemon=True).start()
+            return True
+
+    def _start_in_process(self):
+        import camera  # cv2 and numpy load on the first call only
+        camera.configure(camera.build_parser().parse_args(self.args))
+        self.cancel = threading.Event()
+        thread = threading.Thread(target=camera.connect_to_server, args=(self.cancel,),
+                                  name="camera", daemon=True)
+        thread.start()
+        return thread
+
+    def _warm_after(self, helper):
+        # A second helper warming up during the call would compete with it for CPU
+        helper.wait()
+        self.warm()
+
+    def hang_up(self):
+        with self.lock:
+            call = self.call
+        if isinstance(call, subprocess.Popen):
+            if call.poll() is None:
+                call.terminate()
+                call.wait()
+        elif call is not None:
+            self.cancel.set()
+            call.join(timeout=5.0)
+
+    def close(self):
+        # A call in a camera.py process outlives the GUI, as it always has;
+        # only the idle helper goes
+        with self.lock:
+            self.closed = True
+            standby, self.standby = self.standby, None
+        if self.cancel is not None:
+            self.cancel.set()
+        if standby is not None and standby.poll() is None:
+            try:
+                standby.stdin.close()  # end of file: the helper exits
+            except OSError as e:
+                logging.debug(f"Camera helper already gone: {e}")
@@ -0,0 +1,187 @@
+import os
+import sys
+import hmac
+import json
+import time
+import secrets
+import asyncio
+import hashlib
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Authentication stage for chat_server.py. Passwords are checked against
+# salted PBKDF2 hashes computed once up front; the KDF itself runs on a small
+# thread pool (hashlib releases the GIL while hashing) so the event loop keeps
+# serving chat while logins are verified. Handshakes have a deadline, the
+# number in flight is capped overall and per address, and addresses that keep
+# failing are locked out for a while before any hashing is done for them.
+# A session that drops can come back with its resume token instead of a
+# password until the token expires.
+
+KDF_ITERATIONS = 100_000
+DEFAULT_PASSWORD = "MCCTC"
+
+
+class CredentialStore:
+    def __init__(self, records=()):
+        # Each record: {"salt": hex, "hash": hex, "iterations": int}
+        self.records = list(records)
+
+    @staticmethod
+    def hash_password(password, salt=None, iterations=KDF_ITERATIONS):
+        salt = salt if salt is not None else os.urandom(16)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode('utf-8'), salt, iterations)
+        return {"salt": salt.hex(), "hash": digest.hex(), "iterations": iterations}
+
+    @classmethod
+    def from_password(cls, password, iterations=KDF_ITERATIONS):
+        return cls([cls.hash_password(password, iterations=iterations)])
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.records, f, indent=2)
+
+    def verify(self, password):
+        # Slow on purpose; call through Authenticator.verify, not on the loop
+        if isinstance(password, str):
+            password = password.encode('utf-8')
+        ok = False
+        for record in self.records:
+            digest = hashlib.pbkdf2_hmac("sha256", password, bytes.fromhex(record["salt"]),
+                                         record["iterations"])
+            ok |= hmac.compare_digest(digest, bytes.fromhex(record["hash"]))
+        return ok
+
+
+class FailureLimiter:
+    def __init__(self, max_failures=5, window=60.0, lockout=30.0, max_addresses=10000):
+        self.max_failures = max_failures
+        self.window = window
+        self.lockout = lockout
+        self.max_addresses = max_addresses
+        self.failures = OrderedDict()  # host -> [failure count, window start, locked until]
+
+    def retry_after(self, host):
+        # Seconds until host may try again, 0 if it is not locked out
+        entry = self.failures.get(host)
+        if entry is None:
+            return 0.0
+        return max(0.0, entry[2] - time.monotonic())
+
+    def record_failure(self, host):
+        now = time.monotonic()
+        entry = self.failures.pop(host, None)
+        if entry is None or now - entry[1] > self.window:
+            entry = [0, now, 0.0]
+        entry[0] += 1
+        if entry[0] >= self.max_failures:
+            entry[2] = now + self.lockout
+            entry[0] = 0
+            entry[1] = now
+        self.failures[host] = entry
+        if len(self.failures) > self.max_addresses:
+            self.failures.popitem(last=False)  # forget the least recently failing host
+
+    def record_success(self, host):
+        self.failures.pop(host, None)
+
+
+class ResumeTokens:
+    def __init__(self, ttl=300.0, max_tokens=10000):
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+        self.parked = OrderedDict()  # token -> (expires, username, rooms), oldest first
+
+    @staticmethod
+    def issue():
+        return secrets.token_hex(16)
+
+    def park(self, token, username, rooms):
+        # Remember a dropped session's state until the token expires
+        now = time.monotonic()
+        self.parked[token] = (now + self.ttl, username, set(rooms))
+        while self.parked:
+            oldest = next(iter(self.parked.values()))
+            if oldest[0] > now and len(self.parked) <= self.max_tokens:
+                break
+            self.parked.popitem(last=False)
+
+    def claim(self, token):
+        # Tokens are single use; returns (username, rooms) or None
+        entry = self.parked.pop(token, None)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1], entry[2]
+
+
+class Authenticator:
+    def __init__(self, store=None, workers=2, timeout=10.0, max_pending=512, max_pending_per_host=16,
+                 limiter=None, resume_ttl=300.0):
+        self.store = store or CredentialStore.from_password(DEFAULT_PASSWORD)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-auth")
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.max_pending_per_host = max_pending_per_host
+        self.limiter = limiter or FailureLimiter()
+        self.resume = ResumeTokens(resume_ttl)
+        self.pending = 0
+        self.pending_by_host = {}
+        self.stats = {"auth_ok": 0, "auth_failed": 0, "auth_timeouts": 0,
+                      "auth_rejected": 0, "auth_locked_out": 0, "auth_resumed": 0}
+
+    def admit(self, host):
+        # Called on the loop before a handshake starts; False means refuse it
+        if self.limiter.retry_after(host) > 0:
+            self.stats["auth_locked_out"] += 1
+            return False
+        if self.pending >= self.max_pending or \
+                self.pending_by_host.get(host, 0) >= self.max_pending_per_host:
+            self.stats["auth_rejected"] += 1
+            return False
+        self.pending += 1
+        self.pending_by_host[host] = self.pending_by_host.get(host, 0) + 1
+        return True
+
+    def release(self, host):
+        self.pending -= 1
+        count = self.pending_by_host[host] - 1
+        if count:
+            self.pending_by_host[host] = count
+        else:
+            del self.pending_by_host[host]
+
+    async def verify(self, host, password):
+        ok = await asyncio.get_running_loop().run_in_executor(self.pool, self.store.verify, password)
+        if ok:
+            self.stats["auth_ok"] += 1
+            self.limiter.record_success(host)
+        else:
+            self.stats["auth_failed"] += 1
+            self.limiter.record_failure(host)
+        return ok
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a chat server credentials file")
+    parser.add_argument("output", help="JSON file for chat_server.py --credentials")
+    parser.add_argument("passwords", nargs="+")
+    parser.add_argument("--iterations", type=int, default=KDF_ITERATIONS)
+    args = parser.parse_args()
+
+    store = CredentialStore([CredentialStore.hash_password(p, iterations=args.iterations)
+                             for p in args.passwords])
+    store.save(args.output)
+    print(f"Wrote {len(store.records)} credential(s) to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
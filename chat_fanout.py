@@ -0,0 +1,152 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+# Broadcast fan-out for chat_server.py. A message is encoded once and the same
+# bytes object is queued for every recipient; each recipient drains its own
+# bounded outbox, so a slow reader only ever delays itself.
+
+DROP = "drop"              # discard new messages for a full outbox
+DISCONNECT = "disconnect"  # hang up on a client whose outbox is full
+CLOSE_TIMEOUT = 5.0        # seconds a closing outbox may spend flushing to a peer
+
+
+class FanoutStats:
+    def __init__(self):
+        self.messages = 0
+        self.deliveries = 0
+        self.drops = 0
+        self.disconnects = 0
+        self.bytes_out = 0  # written to client sockets, control frames included
+        self.fanout_time_total = 0.0
+        self.fanout_time_max = 0.0
+        self.last_fanout_time = 0.0
+
+    def snapshot(self):
+        return {
+            "messages": self.messages,
+            "deliveries": self.deliveries,
+            "drops": self.drops,
+            "disconnects": self.disconnects,
+            "bytes_out": self.bytes_out,
+            "fanout_ms_avg": self.fanout_time_total / self.messages * 1000 if self.messages else 0.0,
+            "fanout_ms_max": self.fanout_time_max * 1000,
+            "fanout_ms_last": self.last_fanout_time * 1000,
+        }
+
+
+class Outbox:
+    def __init__(self, writer, max_messages=256, stats=None):
+        self.writer = writer
+        self.max_messages = max_messages
+        self.stats = stats or FanoutStats()
+        self.queue = deque()
+        self.in_flight = 0  # messages handed to the transport, waiting on drain()
+        self.closing = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._drain())
+
+    def __len__(self):
+        return len(self.queue) + self.in_flight
+
+    def put(self, data, force=False):
+        # Never blocks. Returns False when the outbox is full or closing.
+        if self.closing or (len(self) >= self.max_messages and not force):
+            return False
+        self.queue.append(data)
+        self._wakeup.set()
+        return True
+
+    def close(self):
+        # Flush what is already queued, then close the connection. A peer that
+        # stopped reading would keep drain() and the transport's own flush
+        # waiting forever, so after CLOSE_TIMEOUT the connection is aborted.
+        if self.closing:
+            return
+        self.closing = True
+        self._wakeup.set()
+        asyncio.get_event_loop().call_later(CLOSE_TIMEOUT, self._close_timed_out)
+
+    def _close_timed_out(self):
+        transport = self.writer.transport
+        if transport.get_write_buffer_size():
+            logging.warning(f"Dropping {transport.get_write_buffer_size()} unsent bytes to "
+                            f"{self.writer.get_extra_info('peername')}, peer stopped reading")
+            transport.abort()
+
+    def abort(self):
+        self.queue.clear()
+        self._task.cancel()
+        if not self.writer.is_closing():
+            self.writer.close()
+
+    async def _drain(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self.queue:
+                    batch = list(self.queue)
+                    self.queue.clear()
+                    self.in_flight = len(batch)
+                    self.writer.writelines(batch)
+                    self.stats.bytes_out += sum(map(len, batch))
+                    await self.writer.drain()
+                    self.in_flight = 0
+                if self.closing:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            logging.error(f"Outbox writer error: {e}")
+        finally:
+            if not self.writer.is_closing():
+                self.writer.close()
+
+
+class Fanout:
+    def __init__(self, max_queue=256, policy=DROP):
+        if policy not in (DROP, DISCONNECT):
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.max_queue = max_queue
+        self.policy = policy
+        self.stats = FanoutStats()
+
+    def create_outbox(self, writer):
+        return Outbox(writer, self.max_queue, self.stats)
+
+    def publish(self, data, recipients, exclude=None):
+        # `data` must already be the encoded frame; it is shared, not copied.
+        # Returns the clients that were disconnected under the DISCONNECT policy.
+        start = time.perf_counter()
+        dropped = []
+        delivered = 0
+        for client in recipients:
+            if client is exclude:
+                continue
+            if client.outbox.put(data):
+                delivered += 1
+            elif self.policy == DISCONNECT:
+                dropped.append(client)
+            else:
+                self.stats.drops += 1
+
+        elapsed = time.perf_counter() - start
+        stats = self.stats
+        stats.messages += 1
+        stats.deliveries += delivered
+        stats.disconnects += len(dropped)
+        stats.fanout_time_total += elapsed
+        stats.last_fanout_time = elapsed
+        if elapsed > stats.fanout_time_max:
+            stats.fanout_time_max = elapsed
+        return dropped
+
+
+def queue_depths(clients):
+    depths = [len(client.outbox) for client in clients]
+    return {
+        "queue_depth_total": sum(depths),
+        "queue_depth_max": max(depths, default=0),
+    }
@@ -0,0 +1,152 @@
+import struct
+
+# Length-prefixed chat framing shared by Final_Client.py and chat_server.py.
+#
+#   +----------------+------+-----------------+
+#   | length (4, BE) | type | payload (UTF-8) |
+#   +----------------+------+-----------------+
+#
+# One recv() may hold part of a frame or many frames, so both sides run every
+# read through a FrameDecoder instead of treating a read as a message.
+#
+# CHAT payloads carry the server's sequence number and name the room they
+# belong to (see encode_chat); JOIN and LEAVE carry just a room name. HISTORY
+# asks for (client -> server) or returns (server -> client) logged messages.
+# AUTH_SUCCESS carries a resume token; sending it back in a RESUME frame
+# instead of PASSWORD restores a dropped session without logging in again.
+
+HEADER = struct.Struct("!IB")
+HEADER_SIZE = HEADER.size
+MAX_PAYLOAD = 1024 * 1024
+
+PASSWORD = 1
+AUTH_SUCCESS = 2
+AUTH_FAIL = 3
+USERNAME = 4
+CHAT = 5
+KICK = 6
+JOIN = 7
+LEAVE = 8
+HISTORY = 9
+RESUME = 10
+
+DEFAULT_ROOM = "lobby"
+ALL_ROOMS = ""  # room name used for server announcements sent to everyone
+MAX_ROOM_NAME = 64
+MAX_ROOMS = 32  # rooms one connection may be in at once
+
+TYPE_NAMES = {
+    PASSWORD: "PASSWORD",
+    AUTH_SUCCESS: "AUTH_SUCCESS",
+    AUTH_FAIL: "AUTH_FAIL",
+    USERNAME: "USERNAME",
+    CHAT: "CHAT",
+    KICK: "KICK",
+    JOIN: "JOIN",
+    LEAVE: "LEAVE",
+    HISTORY: "HISTORY",
+    RESUME: "RESUME",
+}
+
+CHAT_HEADER = struct.Struct("!QB")  # sequence number, room name length
+HISTORY_REQUEST = struct.Struct("!QI")  # messages after this seq, at most this many (0: all)
+HISTORY_RECORD = struct.Struct("!I")  # length of the CHAT payload that follows
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(msg_type, payload=b""):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError(f"Payload of {len(payload)} bytes exceeds {MAX_PAYLOAD}")
+    return HEADER.pack(len(payload), msg_type) + payload
+
+
+def encode_chat(room, text, seq=0):
+    # CHAT payload: sequence number (0 from clients, assigned by the server),
+    # one length byte, the UTF-8 room name, then the message
+    room = room.encode('utf-8')
+    if len(room) > MAX_ROOM_NAME:
+        raise ProtocolError(f"Room name longer than {MAX_ROOM_NAME} bytes")
+    return CHAT_HEADER.pack(seq, len(room)) + room + text.encode('utf-8')
+
+
+def decode_chat(payload):
+    if len(payload) < CHAT_HEADER.size:
+        raise ProtocolError("Truncated CHAT payload")
+    seq, room_length = CHAT_HEADER.unpack_from(payload)
+    end = CHAT_HEADER.size + room_length
+    if end > len(payload):
+        raise ProtocolError("Truncated room name in CHAT payload")
+    return seq, str(payload[CHAT_HEADER.size:end], 'utf-8'), str(payload[end:], 'utf-8')
+
+
+def chat_seq(payload):
+    return CHAT_HEADER.unpack_from(payload)[0]
+
+
+def chat_room(payload):
+    seq, room_length = CHAT_HEADER.unpack_from(payload)
+    return str(payload[CHAT_HEADER.size:CHAT_HEADER.size + room_length], 'utf-8')
+
+
+def encode_history(payloads):
+    # HISTORY reply: CHAT payloads, each behind a 4-byte length. The server's
+    # message log stores records in this same layout.
+    parts = []
+    for payload in payloads:
+        parts.append(HISTORY_RECORD.pack(len(payload)))
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def iter_history(data):
+    view = memoryview(data)
+    offset = 0
+    while offset + HISTORY_RECORD.size <= len(view):
+        (length,) = HISTORY_RECORD.unpack_from(view, offset)
+        end = offset + HISTORY_RECORD.size + length
+        if end > len(view):
+            raise ProtocolError("Truncated HISTORY record")
+        yield view[offset + HISTORY_RECORD.size:end]
+        offset = end
+
+
+class FrameDecoder:
+    def __init__(self, max_payload=MAX_PAYLOAD, recv_size=64 * 1024):
+        self.max_payload = max_payload
+        # Unconsumed bytes carried between reads. Consumed frames are removed
+        # from the front in one slice per read, which bytearray does in place.
+        self.buffer = bytearray()
+        self._scratch = bytearray(recv_size)
+        self._scratch_view = memoryview(self._scratch)
+
+    def feed(self, data):
+        buf = self.buffer
+        buf += data
+        frames = []
+        offset = 0
+        end_of_data = len(buf)
+        while end_of_data - offset >= HEADER_SIZE:
+            length, msg_type = HEADER.unpack_from(buf, offset)
+            if length > self.max_payload:
+                raise ProtocolError(f"Frame of {length} bytes exceeds {self.max_payload}")
+            end = offset + HEADER_SIZE + length
+            if end > end_of_data:
+                break
+            frames.append((msg_type, bytes(buf[offset + HEADER_SIZE:end])))
+            offset = end
+        if offset:
+            del buf[:offset]
+        return frames
+
+    def read_from(self, sock):
+        # Blocking-socket helper: recv into a reusable scratch buffer, then
+        # decode. Returns None once the peer has closed the connection.
+        n = sock.recv_into(self._scratch)
+        if not n:
+            return None
+        return self.feed(self._scratch_view[:n])
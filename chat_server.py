@@ -0,0 +1,421 @@
+import sys
+import socket
+import asyncio
+import logging
+import random
+import threading
+import argparse
+from collections import deque
+
+import chat_protocol as proto
+from chat_fanout import Fanout, DROP, DISCONNECT, queue_depths
+from session_registry import SessionRegistry, ACTIVE
+from rooms import RoomRegistry
+from chat_auth import Authenticator, CredentialStore
+from message_log import MessageLog
+from metrics import Registry, MetricsServer, SamplingProfiler, register_process_metrics
+
+# Headless chat engine: accept, authenticate, receive and broadcast all run on
+# one asyncio event loop instead of two threads per TCP connection.
+
+
+class ChatObserver:
+    # Default no-op hooks; ServerGUI overrides the ones it cares about.
+    # All hooks are called from the engine's event loop thread.
+    def on_server_started(self, address):
+        pass
+
+    def on_client_authenticated(self, client):
+        pass
+
+    def on_message(self, client, room, message):
+        pass
+
+    def on_client_disconnected(self, client):
+        pass
+
+    def on_client_kicked(self, client):
+        pass
+
+
+class ChatClient:
+    def __init__(self, reader, writer, address, bytes_in=None):
+        self.reader = reader
+        self.writer = writer
+        self.address = address
+        self.color = "#{:06x}".format(random.randint(0, 0xFFFFFF))
+        self.session = None
+        self.rooms = set()
+        self.decoder = proto.FrameDecoder()
+        self.pending = deque()  # frames decoded but not yet handled
+        self.outbox = None
+        self.bytes_in = bytes_in  # metrics Counter shared by all clients
+
+    @property
+    def username(self):
+        return self.session.username if self.session else None
+
+    async def read_frame(self):
+        while not self.pending:
+            data = await self.reader.read(64 * 1024)
+            if not data:
+                return None
+            if self.bytes_in is not None:
+                self.bytes_in.inc(len(data))
+            self.pending.extend(self.decoder.feed(data))
+        return self.pending.popleft()
+
+    def send(self, data):
+        # Control frames bypass the outbox limit; chat goes through Fanout
+        self.outbox.put(data, force=True)
+
+    def close(self):
+        self.outbox.close()
+
+
+class ChatServer:
+    def __init__(self, host='0.0.0.0', port=5555, observer=None, backlog=1024,
+                 max_queue=256, slow_policy=DROP, authenticator=None, history=None, metrics=None):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.observer = observer or ChatObserver()
+        self.fanout = Fanout(max_queue, slow_policy)
+
+        self.sessions = SessionRegistry()
+        self.rooms = RoomRegistry()
+        self.auth = authenticator or Authenticator()
+        self.history = history  # MessageLog, or None to keep no history
+        self.metrics = metrics or Registry()
+        self.register_metrics()
+        self.loop = None
+        self.server = None
+        self._thread = None
+        self._started = threading.Event()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port, backlog=self.backlog)
+        address = self.server.sockets[0].getsockname()
+        self.port = address[1]
+        logging.info(f"Chat server listening on {address}")
+        self.observer.on_server_started(address)
+        self._started.set()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass  # stop() closed the server
+
+    async def stop(self):
+        for session in self.sessions.snapshot():
+            session.connection.close()
+            self.sessions.remove(session)
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.auth.shutdown()
+        if self.history is not None:
+            self.history.close()
+
+    def start_in_thread(self):
+        # Used by ServerGUI: the Qt event loop owns the main thread, so the
+        # chat engine gets its own loop on a daemon thread.
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._started.wait()
+        if self.server is None:
+            raise RuntimeError(f"Chat server failed to start on {self.host}:{self.port}")
+
+    def _run(self):
+        try:
+            asyncio.run(self.serve_forever())
+        except Exception as e:
+            logging.error(f"Chat server stopped: {e}")
+        finally:
+            self._started.set()
+
+    def call_threadsafe(self, callback, *args):
+        # Entry point for other threads (the GUI) to act on the engine
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    async def handle_connection(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        host = address[0]
+        if not self.auth.admit(host):
+            # Locked out or too many handshakes in flight: refuse before
+            # spending a session, a KDF run or a deadline on it
+            logging.warning(f"Refusing connection from {address}")
+            writer.write(proto.encode_frame(proto.AUTH_FAIL, "Too many authentication attempts, try again later"))
+            writer.close()
+            self.connections_refused.inc()
+            return
+        self.connections_accepted.inc()
+        logging.info(f"Accepted connection from {address}")
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        client = ChatClient(reader, writer, address, self.bytes_in)
+        client.outbox = self.fanout.create_outbox(writer)
+        client.session = self.sessions.add(client, address)
+        try:
+            try:
+                authenticated = await self.authenticate(client)
+            finally:
+                self.auth.release(host)
+            if authenticated:
+                await self.receive(client)
+        finally:
+            self.disconnect_client(client)
+
+    async def authenticate(self, client):
+        try:
+            client.send(proto.encode_frame(proto.PASSWORD))
+            frame = await asyncio.wait_for(client.read_frame(), self.auth.timeout)
+            if frame is None:
+                return False
+            msg_type, payload = frame
+            if msg_type == proto.RESUME:
+                return self.resume_session(client, payload.decode('utf-8'))
+            if msg_type != proto.PASSWORD:
+                raise proto.ProtocolError(f"Expected PASSWORD, got {proto.TYPE_NAMES.get(msg_type, msg_type)}")
+            with self.auth_seconds.time():
+                ok = await self.auth.verify(client.address[0], payload)
+            if ok:
+                self.sessions.activate(client.session)
+                self.rooms.join(proto.DEFAULT_ROOM, client)
+                self.accept_session(client)
+                return True
+            client.send(proto.encode_frame(proto.AUTH_FAIL))
+            return False
+        except asyncio.TimeoutError:
+            self.auth.stats["auth_timeouts"] += 1
+            logging.info(f"Authentication timed out for {client.address}")
+            return False
+        except Exception as e:
+            logging.error(f"Authentication error with {client.address}: {e}")
+            return False
+
+    def resume_session(self, client, token):
+        # No KDF here: the token was issued on a successful login and is
+        # only good once, until it expires
+        state = self.auth.resume.claim(token)
+        if state is None:
+            self.auth.limiter.record_failure(client.address[0])
+            client.send(proto.encode_frame(proto.AUTH_FAIL, "Session expired, please log in again"))
+            return False
+        username, rooms = state
+        self.sessions.activate(client.session)
+        if username:
+            self.sessions.set_username(client.session, username)
+        for room in rooms:
+            self.rooms.join(room, client)
+        self.auth.stats["auth_resumed"] += 1
+        logging.info(f"{client.address} resumed the session of {username}")
+        self.accept_session(client)
+        return True
+
+    def accept_session(self, client):
+        client.session.resume_token = self.auth.resume.issue()
+        client.send(proto.encode_frame(proto.AUTH_SUCCESS, client.session.resume_token))
+        self.observer.on_client_authenticated(client)
+
+    async def receive(self, client):
+        try:
+            while True:
+                frame = await client.read_frame()
+                if frame is None:
+                    break
+                msg_type, payload = frame
+                logging.debug(f"Received {proto.TYPE_NAMES.get(msg_type, msg_type)} from {client.address}")
+
+                if msg_type == proto.CHAT:
+                    _, room, message = proto.decode_chat(payload)
+                    if room not in client.rooms:
+                        logging.warning(f"{client.address} sent to room {room!r} without joining it")
+                        continue
+                    self.messages_received.inc()
+                    self.broadcast_message(message, client, room)
+                    self.observer.on_message(client, room, message)
+                elif msg_type == proto.USERNAME:
+                    self.sessions.set_username(client.session, payload.decode('utf-8'))
+                    logging.info(f"{client.address} is now known as {client.username}")
+                elif msg_type == proto.JOIN:
+                    try:
+                        self.rooms.join(payload.decode('utf-8'), client)
+                    except (proto.ProtocolError, UnicodeDecodeError) as e:
+                        logging.warning(f"Refused JOIN from {client.address}: {e}")
+                        client.send(proto.encode_frame(proto.CHAT, proto.encode_chat(
+                            proto.ALL_ROOMS, f"Server: could not join room: {e}")))
+                elif msg_type == proto.LEAVE:
+                    self.rooms.leave(payload.decode('utf-8'), client)
+                elif msg_type == proto.HISTORY:
+                    await self.send_history(client, *proto.HISTORY_REQUEST.unpack(payload))
+                else:
+                    logging.warning(f"Ignoring unexpected {proto.TYPE_NAMES.get(msg_type, msg_type)} from {client.address}")
+        except Exception as e:
+            logging.error(f"Error receiving data from {client.address}: {e}")
+
+    def broadcast_message(self, message, sender=None, room=proto.ALL_ROOMS):
+        # Only the room's members receive the message; ALL_ROOMS reaches every
+        # active session (server announcements)
+        if self.history is not None:
+            payload = self.history.append(room, message)  # queued for the writer thread
+        else:
+            payload = proto.encode_chat(room, message)
+        data = proto.encode_frame(proto.CHAT, payload)
+        recipients = self.sessions.active if room == proto.ALL_ROOMS else self.rooms.members(room)
+        # Iterated on the engine loop, the only thread that mutates the registries
+        dropped = self.fanout.publish(data, recipients, exclude=sender)
+        self.fanout_seconds.observe(self.fanout.stats.last_fanout_time)
+        for client in dropped:
+            logging.warning(f"Disconnecting slow client {client.address}")
+            client.outbox.abort()
+            self.disconnect_client(client)
+
+    async def send_history(self, client, since, limit):
+        # Replay logged messages after seq `since` (only the newest `limit`
+        # if non-zero) from the client's rooms, then an empty HISTORY frame
+        # to say it is caught up. Messages logged after the request arrive
+        # live instead.
+        if self.history is not None:
+            until = self.history.last_seq
+            if limit:
+                since = max(since, until - limit)
+            while since < until:
+                payloads = await self.loop.run_in_executor(None, self.history.read_since, since)
+                if not payloads:
+                    break
+                since = proto.chat_seq(payloads[-1])
+                rooms = client.rooms | {proto.ALL_ROOMS}
+                visible = [p for p in payloads if proto.chat_seq(p) <= until and proto.chat_room(p) in rooms]
+                if visible:
+                    client.send(proto.encode_frame(proto.HISTORY, proto.encode_history(visible)))
+        client.send(proto.encode_frame(proto.HISTORY))
+
+    def register_metrics(self):
+        # Counters the engine already keeps are read at scrape time; scrapes
+        # come from the metrics thread, so anything iterated takes its lock
+        m = self.metrics
+        self.connections_accepted = m.counter("chat_connections_total", "TCP connections", result="accepted")
+        self.connections_refused = m.counter("chat_connections_total", "TCP connections", result="refused")
+        self.bytes_in = m.counter("chat_bytes_received_total", "Bytes read from chat clients")
+        self.messages_received = m.counter("chat_messages_received_total", "CHAT frames received from clients")
+        self.auth_seconds = m.histogram("chat_auth_seconds",
+                                        "Password verification time, including waiting for a KDF worker")
+        self.fanout_seconds = m.histogram("chat_fanout_seconds", "Time to queue one message for all its recipients")
+
+        fanout = self.fanout.stats
+        m.counter("chat_bytes_sent_total", "Bytes written to chat clients", fn=lambda: fanout.bytes_out)
+        m.counter("chat_messages_broadcast_total", "Messages fanned out", fn=lambda: fanout.messages)
+        m.counter("chat_deliveries_total", "Messages queued for a recipient", fn=lambda: fanout.deliveries)
+        m.counter("chat_dropped_total", "Messages dropped for full outboxes", fn=lambda: fanout.drops)
+        m.counter("chat_slow_disconnects_total", "Clients disconnected for full outboxes",
+                  fn=lambda: fanout.disconnects)
+        for key in self.auth.stats:
+            m.counter("chat_auth_total", "Authentication outcomes",
+                      fn=lambda key=key: self.auth.stats[key], result=key[len("auth_"):])
+        m.gauge("chat_auth_pending", "Handshakes in flight", fn=lambda: self.auth.pending)
+        m.gauge("chat_clients", "Authenticated sessions", fn=lambda: len(self.sessions.active))
+        m.gauge("chat_rooms", "Rooms with members", fn=lambda: len(self.rooms))
+        for stat in ("total", "max"):
+            m.gauge("chat_queue_depth", "Messages waiting in client outboxes",
+                    fn=lambda stat=stat: self.queue_depths()[f"queue_depth_{stat}"], stat=stat)
+        if self.history is not None:
+            for key in self.history.stats:
+                m.counter(f"chat_{key}_total", f"Message log {key[len('history_'):].replace('_', ' ')}",
+                          fn=lambda key=key: self.history.stats[key])
+
+    def queue_depths(self):
+        with self.sessions.lock:
+            return queue_depths(self.sessions.active)
+
+    def stats(self):
+        stats = self.fanout.stats.snapshot()
+        stats.update(self.queue_depths())
+        stats["clients"] = len(self.sessions.active)
+        stats["rooms"] = len(self.rooms)
+        stats.update(self.auth.stats)
+        stats["auth_pending"] = self.auth.pending
+        if self.history is not None:
+            stats.update(self.history.stats)
+        return stats
+
+    async def log_stats(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            logging.info(f"Chat stats: {self.stats()}")
+
+    def kick_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None or session.state != ACTIVE:
+            return False
+        client = session.connection
+        client.send(proto.encode_frame(proto.KICK))
+        self.sessions.remove(session)
+        self.rooms.leave_all(client)
+        client.close()
+        self.observer.on_client_kicked(client)
+        return True
+
+    def disconnect_client(self, client):
+        client.close()
+        was_active = client.session.state == ACTIVE
+        if was_active:
+            # Kicked sessions are already closed and never parked
+            self.auth.resume.park(client.session.resume_token, client.username, client.rooms)
+        self.rooms.leave_all(client)
+        if self.sessions.remove(client.session) and was_active:
+            self.observer.on_client_disconnected(client)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless chat server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5555)
+    parser.add_argument("--max-queue", type=int, default=256, help="outbound messages buffered per client")
+    parser.add_argument("--slow-policy", choices=[DROP, DISCONNECT], default=DROP)
+    parser.add_argument("--stats-interval", type=float, default=0, help="log fan-out counters every N seconds")
+    parser.add_argument("--history-dir", default="chat_history", help="message log directory, '' to disable")
+    parser.add_argument("--credentials", help="credentials file written by chat_auth.py")
+    parser.add_argument("--auth-timeout", type=float, default=10.0, help="seconds a client has to log in")
+    parser.add_argument("--auth-workers", type=int, default=2, help="threads running the password KDF")
+    parser.add_argument("--max-pending-auth", type=int, default=512, help="handshakes in flight at once")
+    parser.add_argument("--max-pending-auth-per-host", type=int, default=16,
+                        help="handshakes in flight at once from one address")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument("--profiler", action="store_true",
+                        help="allow starting a sampling profiler through the metrics port")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    store = CredentialStore.load(args.credentials) if args.credentials else None
+    auth = Authenticator(store, workers=args.auth_workers, timeout=args.auth_timeout,
+                         max_pending=args.max_pending_auth, max_pending_per_host=args.max_pending_auth_per_host)
+    history = MessageLog(args.history_dir) if args.history_dir else None
+    server = ChatServer(args.host, args.port, max_queue=args.max_queue, slow_policy=args.slow_policy,
+                        authenticator=auth, history=history)
+    if args.metrics_port is not None:
+        register_process_metrics(server.metrics)
+        MetricsServer(server.metrics, port=args.metrics_port,
+                      profiler=SamplingProfiler() if args.profiler else None).start_in_thread()
+
+    async def run():
+        if args.stats_interval > 0:
+            asyncio.ensure_future(server.log_stats(args.stats_interval))
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
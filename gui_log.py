@@ -0,0 +1,64 @@
+import threading
+from collections import deque
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QTextCursor, QTextCharFormat
+
+# Thread-safe hand-off of log lines from networking threads to the Qt GUI
+# thread. Worker threads only ever call MessageSink.post(); LogView drains the
+# sink on a timer and appends each batch to the QTextBrowser in one edit.
+
+
+class MessageSink:
+    def __init__(self, max_pending=10000):
+        # Oldest lines are discarded if the GUI falls this far behind
+        self.pending = deque(maxlen=max_pending)
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def post(self, html):
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(html)
+
+    def drain(self, limit):
+        with self.lock:
+            count = min(limit, len(self.pending))
+            return [self.pending.popleft() for _ in range(count)]
+
+
+class LogView:
+    def __init__(self, browser, sink, max_lines=5000, interval_ms=100, max_batch=500):
+        self.browser = browser
+        self.sink = sink
+        self.max_batch = max_batch
+        # Oldest blocks (lines) are dropped by Qt once the cap is reached
+        browser.document().setMaximumBlockCount(max_lines)
+
+        self.timer = QTimer(browser)
+        self.timer.setInterval(interval_ms)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start()
+
+    def flush(self):
+        lines = self.sink.drain(self.max_batch)
+        if not lines:
+            return
+        scrollbar = self.browser.verticalScrollBar()
+        # Only follow new output if the user has not scrolled up to read
+        at_bottom = scrollbar.value() >= scrollbar.maximum() - 4
+
+        document = self.browser.document()
+        cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.End)
+        cursor.beginEditBlock()
+        for html in lines:
+            if not document.isEmpty():
+                cursor.insertBlock()
+            cursor.setCharFormat(QTextCharFormat())  # don't inherit the previous line's colour
+            cursor.insertHtml(html)
+        cursor.endEditBlock()
+
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
@@ -0,0 +1,289 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from array import array
+from collections import deque, defaultdict
+
+import chat_protocol as proto
+
+# Append-only, segmented chat history for chat_server.py.
+#
+# Records are stored exactly as they travel in a HISTORY frame (a 4-byte
+# length, then the CHAT payload with its sequence number), so a catch-up is
+# one read per segment that can be sent on without re-encoding. Each segment
+# keeps an in-memory index of seq -> file offset; segments are named after
+# their first seq so the right one is found by bisecting.
+#
+# append() runs on the chat engine's loop and only hands the record to a
+# background writer thread, which writes whole batches and fsyncs once per
+# batch. Once enough segments have been rotated out, the older ones are
+# compacted: merged into one file that keeps only the newest messages of each
+# room.
+
+SEGMENT_SUFFIX = ".log"
+
+
+def segment_name(first_seq, generation=0):
+    return f"{first_seq:020d}-{generation:04d}{SEGMENT_SUFFIX}"
+
+
+class Segment:
+    def __init__(self, path, first_seq, generation=0):
+        self.path = path
+        self.first_seq = first_seq
+        self.generation = generation
+        self.seqs = array('Q')
+        self.offsets = array('Q')
+        self.size = 0
+
+    @property
+    def last_seq(self):
+        return self.seqs[-1] if self.seqs else self.first_seq - 1
+
+    def add(self, seq, length):
+        self.seqs.append(seq)
+        self.offsets.append(self.size)
+        self.size += length
+
+    @classmethod
+    def scan(cls, path):
+        # Rebuild the index of an existing segment; a record torn by a crash
+        # mid-write is cut off the end of the file
+        first_seq, generation = os.path.basename(path)[:-len(SEGMENT_SUFFIX)].split("-")
+        segment = cls(path, int(first_seq), int(generation))
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + proto.HISTORY_RECORD.size <= len(data):
+            (length,) = proto.HISTORY_RECORD.unpack_from(data, offset)
+            end = offset + proto.HISTORY_RECORD.size + length
+            if end > len(data) or length < proto.CHAT_HEADER.size:
+                break
+            segment.add(proto.chat_seq(data[offset + proto.HISTORY_RECORD.size:end]), end - offset)
+            offset = end
+        if offset < len(data):
+            logging.warning(f"Truncating {len(data) - offset} torn bytes from {path}")
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        return segment
+
+    def read_after(self, seq, max_bytes):
+        # One read covering the records after seq, at most about max_bytes
+        # (always at least one record)
+        count = len(self.seqs)
+        start = bisect.bisect_right(self.seqs, seq, 0, count)
+        if start == count:
+            return b""
+        begin = self.offsets[start]
+        stop = bisect.bisect_right(self.offsets, begin + max_bytes, start + 1, count)
+        end = self.offsets[stop] if stop < count else self.size
+        with open(self.path, "rb") as f:
+            f.seek(begin)
+            return f.read(end - begin)
+
+
+class MessageLog:
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024, compact_after=8, keep_per_room=1000,
+                 flush_interval=0.05, memory_records=4096):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.compact_after = compact_after  # closed segments allowed before compacting
+        self.keep_per_room = keep_per_room
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.segments = self._load_segments()
+        self.next_seq = self.segments[-1].last_seq + 1 if self.segments else 1
+        self.pending = []  # CHAT payloads not yet handed to the writer
+        # Newest records (written or not); most catch-ups are served from here
+        self.recent = deque(maxlen=memory_records)
+        self.closed = False
+        self.file = None
+        self.stats = {"history_appended": 0, "history_written": 0, "history_batches": 0,
+                      "history_fsyncs": 0, "history_compactions": 0}
+
+        self._writer = threading.Thread(target=self._write_loop, name="chat-history", daemon=True)
+        self._writer.start()
+
+    @property
+    def last_seq(self):
+        return self.next_seq - 1
+
+    def _load_segments(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX))
+        segments = []
+        for name in names:
+            segment = Segment.scan(os.path.join(self.directory, name))
+            if segments and segment.first_seq == segments[-1].first_seq:
+                # A compaction finished writing but did not get to remove the
+                # files it replaced; the newer generation wins
+                os.remove(segments.pop().path)
+            if segments and segment.seqs and segment.last_seq <= segments[-1].last_seq:
+                os.remove(segment.path)
+                continue
+            segments.append(segment)
+        return segments
+
+    def append(self, room, text):
+        # Called on the engine loop: assigns the seq and queues the record.
+        # Returns the CHAT payload to broadcast.
+        seq = self.next_seq
+        self.next_seq += 1
+        payload = proto.encode_chat(room, text, seq)
+        with self.lock:
+            self.pending.append(payload)
+            self.recent.append((seq, payload))
+            self.stats["history_appended"] += 1
+            self.wakeup.notify()
+        return payload
+
+    def read_since(self, seq, max_bytes=256 * 1024):
+        # CHAT payloads with a sequence number above seq, oldest first, about
+        # max_bytes at most. Blocking file I/O; run it off the event loop.
+        with self.lock:
+            if self.recent and self.recent[0][0] <= seq + 1:
+                return self._take_recent(seq, max_bytes)
+            segments = list(self.segments)
+
+        payloads = []
+        size = 0
+        index = max(0, bisect.bisect_right([s.first_seq for s in segments], seq + 1) - 1)
+        for segment in segments[index:]:
+            try:
+                data = segment.read_after(seq, max_bytes - size)
+            except FileNotFoundError:
+                # Compacted away under us; start over with the new segment list
+                return self.read_since(seq, max_bytes)
+            for payload in proto.iter_history(data):
+                payloads.append(bytes(payload))
+            size += len(data)
+            if payloads:
+                seq = proto.chat_seq(payloads[-1])
+            if size >= max_bytes:
+                return payloads
+        # Whatever the writer has not reached yet is still in memory
+        with self.lock:
+            return payloads + self._take_recent(seq, max_bytes - size)
+
+    def _take_recent(self, seq, max_bytes):
+        payloads = []
+        size = 0
+        for record_seq, payload in self.recent:
+            if record_seq <= seq:
+                continue
+            if size >= max_bytes:
+                break
+            payloads.append(payload)
+            size += proto.HISTORY_RECORD.size + len(payload)
+        return payloads
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wakeup.notify()
+        self._writer.join()
+
+    def _write_loop(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.closed:
+                    self.wakeup.wait()
+                if not self.pending and self.closed:
+                    break
+            if not self.closed:
+                time.sleep(self.flush_interval)  # let a batch build up
+            with self.lock:
+                batch, self.pending = self.pending, []
+            try:
+                self._write_batch(batch)
+            except OSError as e:
+                logging.error(f"Chat history write failed: {e}")
+        if self.file is not None:
+            self.file.close()
+
+    def _write_batch(self, batch):
+        records = []
+        index = []  # (seq, record length) for the segment index
+        batch_bytes = 0
+        for payload in batch:
+            seq = proto.chat_seq(payload)
+            if self.file is None:
+                # Continue the newest segment left by a previous run if it has room
+                if self.segments and self.segments[-1].size < self.segment_bytes:
+                    self.file = open(self.segments[-1].path, "ab")
+                else:
+                    self._rotate(seq)
+            elif self.segments[-1].size + batch_bytes >= self.segment_bytes:
+                self._flush(records, index)
+                records, index, batch_bytes = [], [], 0
+                self._rotate(seq)
+            record = proto.encode_history((payload,))
+            records.append(record)
+            index.append((seq, len(record)))
+            batch_bytes += len(record)
+        self._flush(records, index)
+        self.stats["history_batches"] += 1
+
+    def _flush(self, records, index):
+        if not records:
+            return
+        self.file.write(b"".join(records))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.stats["history_fsyncs"] += 1
+        with self.lock:
+            segment = self.segments[-1]
+            for seq, length in index:
+                segment.add(seq, length)
+            self.stats["history_written"] += len(index)
+
+    def _rotate(self, first_seq):
+        if self.file is not None:
+            self.file.close()
+        segment = Segment(os.path.join(self.directory, segment_name(first_seq)), first_seq)
+        self.file = open(segment.path, "ab")
+        with self.lock:
+            self.segments.append(segment)
+        if len(self.segments) - 1 > self.compact_after:
+            self._compact()
+
+    def _compact(self):
+        # Merge the older half of the closed segments into one that keeps only
+        # the newest keep_per_room messages of each room
+        old = self.segments[:len(self.segments) - 1 - self.compact_after // 2]
+        if len(old) < 2:
+            return
+        kept = defaultdict(deque)
+        for segment in old:
+            with open(segment.path, "rb") as f:
+                data = f.read()
+            for payload in proto.iter_history(data):
+                room_records = kept[proto.chat_room(payload)]
+                room_records.append(bytes(payload))
+                if len(room_records) > self.keep_per_room:
+                    room_records.popleft()
+        payloads = sorted((p for records in kept.values() for p in records), key=proto.chat_seq)
+
+        first = old[0]
+        merged = Segment(os.path.join(self.directory, segment_name(first.first_seq, first.generation + 1)),
+                         first.first_seq, first.generation + 1)
+        temp_path = merged.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            for payload in payloads:
+                record = proto.encode_history((payload,))
+                f.write(record)
+                merged.add(proto.chat_seq(payload), len(record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, merged.path)
+        with self.lock:
+            self.segments[:len(old)] = [merged]
+        for segment in old:
+            os.remove(segment.path)
+        self.stats["history_compactions"] += 1
+        logging.info(f"Compacted {len(old)} chat history segments into {merged.path} "
+                     f"({len(payloads)} messages kept)")
@@ -0,0 +1,279 @@
+import os
+import sys
+import time
+import bisect
+import logging
+import threading
+from collections import Counter as StackCounter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Metrics for the chat, signaling and video servers, served in the Prometheus
+# text format. Recording is a lock and an add; gauges, and counters the
+# engines already keep in their stats dicts, are callbacks read only when
+# /metrics is scraped. MetricsServer runs on its own daemon thread, so a
+# scrape never waits on an engine's event loop.
+#
+# A SamplingProfiler can be attached to the endpoint and switched on and off
+# at runtime; it costs nothing until started:
+#
+#   curl localhost:9100/metrics
+#   curl -X POST localhost:9100/profiler/start
+#   curl localhost:9100/profiler > stacks.folded   # flamegraph.pl input
+#   curl -X POST localhost:9100/profiler/stop
+
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self, fn=None):
+        self.fn = fn  # read the value from elsewhere instead of counting here
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def get(self):
+        return self.fn() if self.fn is not None else self.value
+
+
+class Gauge:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def get(self):
+        return self.fn()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return HistogramTimer(self)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum
+
+
+class HistogramTimer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    def __init__(self):
+        self.families = {}  # name -> [type, help, {label items: metric}]
+        self.lock = threading.Lock()
+
+    def _add(self, kind, name, help, labels, factory):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.setdefault(name, [kind, help, {}])
+            if family[0] != kind:
+                raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = factory()
+            return metric
+
+    def counter(self, name, help, fn=None, **labels):
+        return self._add("counter", name, help, labels, lambda: Counter(fn))
+
+    def gauge(self, name, help, fn, **labels):
+        return self._add("gauge", name, help, labels, lambda: Gauge(fn))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS, **labels):
+        return self._add("histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def render(self):
+        lines = []
+        with self.lock:
+            families = [(name, kind, help, list(children.items()))
+                        for name, (kind, help, children) in sorted(self.families.items())]
+        for name, kind, help, children in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in children:
+                if kind == "histogram":
+                    counts, total = metric.snapshot()
+                    cumulative = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{format_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(key)} {total}")
+                    lines.append(f"{name}_count{format_labels(key)} {cumulative}")
+                else:
+                    try:
+                        value = metric.get()
+                    except Exception as e:
+                        logging.debug(f"Metric {name} unavailable: {e}")
+                        continue
+                    lines.append(f"{name}{format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(items):
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+
+def register_process_metrics(registry):
+    registry.counter("process_cpu_seconds_total", "User and system CPU time of this process", fn=time.process_time)
+    registry.gauge("process_resident_memory_bytes", "Resident set size", fn=resident_memory_bytes)
+    registry.gauge("process_threads", "Live Python threads", fn=threading.active_count)
+
+
+def resident_memory_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class SamplingProfiler:
+    # Samples every thread's Python stack at a fixed interval and counts
+    # identical stacks, in the folded format flame graph tools read
+    def __init__(self, interval=0.005, max_stacks=20000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.stacks = StackCounter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        if self.running:
+            return False
+        if interval:
+            self.interval = interval
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join()
+        return True
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            with self.lock:
+                self.samples += 1
+                for ident, frame in frames.items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    key = ";".join(reversed(stack))
+                    if key in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[key] += 1
+
+    def report(self, limit=None):
+        with self.lock:
+            stacks = self.stacks.most_common(limit)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            self.reply(200, self.server.registry.render(), "text/plain; version=0.0.4")
+        elif url.path == "/profiler" and self.server.profiler is not None:
+            limit = parse_qs(url.query).get("limit", [None])[0]
+            self.reply(200, self.server.profiler.report(int(limit) if limit else None))
+        else:
+            self.reply(404, "Not found\n")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        profiler = self.server.profiler
+        if profiler is None or url.path not in ("/profiler/start", "/profiler/stop"):
+            self.reply(404, "Not found\n")
+        elif url.path == "/profiler/start":
+            interval = parse_qs(url.query).get("interval", [None])[0]
+            started = profiler.start(float(interval) if interval else None)
+            self.reply(200, f"Profiler {'started' if started else 'already running'}, "
+                            f"sampling every {profiler.interval * 1000:g} ms\n")
+        else:
+            stopped = profiler.stop()
+            self.reply(200, f"Profiler {'stopped' if stopped else 'not running'} after {profiler.samples} samples\n")
+
+    def reply(self, status, body, content_type="text/plain; charset=utf-8"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Metrics request: {format % args}")
+
+
+class MetricsServer:
+    def __init__(self, registry, host="127.0.0.1", port=9100, profiler=None):
+        # Binds to localhost by default: the profiler exposes stack traces
+        self.registry = registry
+        self.profiler = profiler
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self.httpd.profiler = profiler
+        self.host = host
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def start_in_thread(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        logging.info(f"Metrics on http://{self.host}:{self.port}/metrics"
+                     + (" (profiler available)" if self.profiler is not None else ""))
+        return self
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,76 +1,597 @@
+import os
+import sys
+import time
 import socket
-import threading
-import cv2
-import pickle
 import struct
+import argparse
+import threading
+import multiprocessing
+from collections import namedtuple
+
+import video_protocol
+from metrics import Registry, MetricsServer, SamplingProfiler, register_process_metrics
 
 # Server configuration
 server_ip = '10.200.236.221'
 server_port = 5000
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server_socket.bind((server_ip, server_port))
-server_socket.listen(5)
 
-clients = []
+# Relay (SFU) mode: the server never decodes video. Each incoming packet is
+# read once into its own buffer, the sender's id is stamped into the header
+# in place, and the same buffer is handed to every viewer.
+stats_interval = 0  # seconds between per-viewer lag/drop reports, 0 to disable
+feedback_interval = 0.2  # seconds between congestion feedback packets to each sender
+
+# Rooms: a participant's first packet may be a JOIN naming its room; frames
+# only go to the room they were sent in. Connections that send anything else
+# first, or nothing within join_timeout, are in DEFAULT_ROOM.
+DEFAULT_ROOM = "lobby"
+join_timeout = 0.5
+
+# Sharding: with workers > 1 a supervisor process only accepts connections.
+# It reads each one's JOIN, pins the room to a worker process (the one with
+# the fewest participants, for as long as the room has any) and passes the
+# socket itself to that worker, which relays as a single process would. A
+# room's frames never leave its worker, so nothing is copied between
+# processes and each worker has its own GIL and lock.
+workers = 1
+
+# Recording: with --record DIR every room's frames (largest layer only) are
+# also written to DIR by video_recording.VideoRecorder, off the fan-out path.
+# Replay with video_recording.py serve.
+record_directory = None
+
+# Composite mode: instead of relaying N streams, decode the latest frame of
+# each participant into a tiled mosaic and send one stream at a fixed rate.
+# The mosaic includes everyone on the server, whatever their room.
+composite_fps = 0  # 0 disables compositing
+composite_size = (1280, 720)
+composite_quality = 80
+
+FEEDBACK_SLOT = "feedback"  # LatestFrameBuffer key for feedback packets, never counted as a drop
+
+# Simulcast: senders may send each frame at several resolutions (layers).
+# Each viewer reports the tile size it draws participants at, and is sent only
+# the smallest layer of each participant that still fills that tile. Viewers
+# that never report a size get the largest layer.
+
+clients = []  # Viewer objects, all rooms
+rooms = {}  # room name -> Viewers in it
+room_left = None  # in a worker: tells the supervisor a participant has gone
+# sender client id -> [sequence, {layer: (width, height)} being sent, layers seen in this frame]
+layer_sizes = {}
 lock = threading.Lock()
+composite = None  # ServerCompositor when composite mode is on
+recorder = None  # VideoRecorder when recording is on
 
-def broadcast_frame(client_id, frame):
-    with lock:
-        for client_socket in clients:
-            try:
-                data = pickle.dumps((client_id, frame))
-                message = struct.pack("Q", len(data)) + data
-                client_socket.sendall(message)
-            except:
-                clients.remove(client_socket)
-
-def handle_client(client_socket, client_id):
-    data = b""
-    payload_size = struct.calcsize("Q")
-    while True:
+# Served with --metrics-port
+metrics = Registry()
+connections = metrics.counter("video_connections_total", "Participants that connected")
+frames_received = metrics.counter("video_frames_received_total", "Frames received from senders, all layers")
+bytes_received = metrics.counter("video_bytes_received_total", "Bytes received from senders")
+frames_sent = metrics.counter("video_frames_sent_total", "Packets written to viewers, feedback included")
+bytes_sent = metrics.counter("video_bytes_sent_total", "Bytes written to viewers")
+frames_dropped = metrics.counter("video_frames_dropped_total",
+                                 "Frames replaced by a newer one before a slow viewer got them")
+viewer_lag = metrics.histogram("video_viewer_lag_seconds",
+                               "Time from the relay receiving a frame until it is on a viewer's socket")
+stage_seconds = {stage: metrics.histogram("video_stage_seconds", "Time spent per packet or frame in each relay stage",
+                                          stage=stage)
+                 for stage in ("fanout", "send", "composite_decode", "composite_encode")}
+metrics.gauge("video_viewers", "Connected participants", fn=lambda: len(clients))
+metrics.gauge("video_queue_depth", "Frames waiting in viewer buffers",
+              fn=lambda: sum(len(viewer.buffer.pending) for viewer in list(clients)))
+
+class LatestFrameBuffer:
+    # Holds at most one pending packet per source. A newer frame from the
+    # same source replaces the one not yet sent, so a slow viewer skips
+    # frames instead of falling further and further behind.
+    def __init__(self):
+        self.pending = {}  # source client id -> (memoryview, time queued)
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.dropped_by_source = {}
+
+    def put(self, source_id, view):
+        with self.condition:
+            if source_id in self.pending and source_id != FEEDBACK_SLOT:
+                self.dropped += 1
+                frames_dropped.inc()
+                self.dropped_by_source[source_id] = self.dropped_by_source.get(source_id, 0) + 1
+            self.pending[source_id] = (view, time.perf_counter())
+            self.condition.notify()
+
+    def take_all(self):
+        # Blocks until something is pending; returns [] once closed
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return []
+            packets = list(self.pending.values())
+            self.pending.clear()
+            return packets
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.pending.clear()
+            self.condition.notify()
+
+class Viewer:
+    def __init__(self, client_socket, client_id, room=DEFAULT_ROOM):
+        self.socket = client_socket
+        self.client_id = client_id
+        self.room = room
+        self.tile_size = None  # (width, height) from the viewer's subscribe packet
+        self.buffer = LatestFrameBuffer()
+        self.sent = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.closed = False
+        self.writer = threading.Thread(target=self.write_loop)
+        self.writer.daemon = True
+
+    def send(self, source_id, view):
+        self.buffer.put(source_id, view)
+
+    def write_loop(self):
         try:
-            while len(data) < payload_size:
-                packet = client_socket.recv(4*1024)
-                if not packet:
+            while True:
+                packets = self.buffer.take_all()
+                if not packets:
                     break
-                data += packet
+                for view, queued_at in packets:
+                    start = time.perf_counter()
+                    self.socket.sendall(view)
+                    # Lag: time from the relay receiving the frame until it is on this viewer's socket
+                    now = time.perf_counter()
+                    lag = now - queued_at
+                    stage_seconds["send"].observe(now - start)
+                    viewer_lag.observe(lag)
+                    frames_sent.inc()
+                    bytes_sent.inc(len(view))
+                    self.sent += 1
+                    self.lag_total += lag
+                    if lag > self.lag_max:
+                        self.lag_max = lag
+        except Exception as e:
+            if not self.closed:
+                print(f"Viewer {self.client_id} send error: {e}")
+        finally:
+            remove_client(self)
+            if not self.closed:
+                self.socket.close()  # also ends handle_client for this viewer
+
+    def stats(self):
+        stats = {
+            "sent": self.sent,
+            "dropped": self.buffer.dropped,
+            "lag_ms_avg": self.lag_total / self.sent * 1000 if self.sent else 0.0,
+            "lag_ms_max": self.lag_max * 1000,
+        }
+        self.lag_max = 0.0  # max is per reporting interval
+        return stats
+
+    def close(self):
+        self.closed = True
+        self.buffer.close()
+        self.socket.close()
+
+def add_client(viewer):
+    with lock:
+        clients.append(viewer)
+        rooms.setdefault(viewer.room, []).append(viewer)
+
+def remove_client(viewer):
+    with lock:
+        if viewer in clients:
+            clients.remove(viewer)
+            members = rooms[viewer.room]
+            members.remove(viewer)
+            if not members:
+                del rooms[viewer.room]
+
+def room_members(room):
+    with lock:
+        return list(rooms.get(room, ()))
+
+def choose_layer(layers, tile_size):
+    # Smallest layer that still fills the tile, else the largest there is
+    if tile_size is None:
+        return max(layers, key=lambda layer: layers[layer][0] * layers[layer][1])
+    tile_width, tile_height = tile_size
+    fitting = [layer for layer, (width, height) in layers.items() if width >= tile_width or height >= tile_height]
+    if not fitting:
+        return choose_layer(layers, None)
+    return min(fitting, key=lambda layer: layers[layer][0] * layers[layer][1])
+
+def broadcast_frame(client_id, room, header, packet):
+    frames_received.inc()
+    bytes_received.inc(len(packet))
+    video_protocol.set_client_id(packet, client_id)
+    with stage_seconds["fanout"].time():
+        relay_frame(client_id, room, header, packet)
+    if recorder is not None:
+        recorder.record(room, header, packet)
+
+def relay_frame(client_id, room, header, packet):
+    # Only the sender's own handle_client thread touches its layer_sizes entry
+    entry = layer_sizes.get(client_id)
+    if entry is None or entry[0] != header.sequence:
+        # A new frame: layers the previous frame did not have are no longer
+        # sent (the adaptive scale dropped them below min_layer_width), so
+        # viewers must stop waiting for them
+        entry = layer_sizes[client_id] = [header.sequence, dict(entry[2]) if entry else {}, {}]
+    _, layers, seen = entry
+    layers[header.layer] = seen[header.layer] = (header.width, header.height)
+    if composite is not None:
+        if header.layer == choose_layer(layers, composite.tile_size):
+            composite.submit(client_id, packet)
+        return
+    view = memoryview(packet)  # shared by every viewer, never copied
+    viewers = room_members(room)
+    choices = {}  # tile size -> layer, most viewers share a few sizes
+    for viewer in viewers:
+        layer = choices.get(viewer.tile_size)
+        if layer is None:
+            layer = choices[viewer.tile_size] = choose_layer(layers, viewer.tile_size)
+        if layer == header.layer:
+            viewer.send(client_id, view)
+
+class ServerCompositor:
+    def __init__(self, fps, size, quality):
+        # cv2/numpy are only needed in this mode
+        from video_codec import make_codec, decode_frame
+        from video_compositor import TiledCompositor, CompositeRenderer, COMPOSITE_ID
+        self.decode_frame = decode_frame
+        self.composite_id = COMPOSITE_ID
+        self.codec = make_codec('jpeg', quality=quality)
+        self.compositor = TiledCompositor(*size)
+        self.tile_size = (self.compositor.tile_width, self.compositor.tile_height)
+        self.latest = {}  # client id -> newest undecoded packet
+        self.latest_lock = threading.Lock()
+        self.sequence = 0
+        self.renderer = CompositeRenderer(self.compositor, fps, self.send_composite,
+                                          before_render=self.decode_latest)
+
+    def submit(self, client_id, packet):
+        # Only the newest packet per participant is kept; decoding happens at
+        # the output rate, not the input rate
+        with self.latest_lock:
+            self.latest[client_id] = packet
+
+    def remove(self, client_id):
+        with self.latest_lock:
+            self.latest.pop(client_id, None)
+        self.compositor.remove(client_id)
+
+    def decode_latest(self):
+        with self.latest_lock:
+            latest, self.latest = self.latest, {}
+        for client_id, packet in latest.items():
+            try:
+                with stage_seconds["composite_decode"].time():
+                    header = video_protocol.unpack_header(packet)
+                    frame = self.decode_frame(header, memoryview(packet)[video_protocol.HEADER_SIZE:])
+                    self.compositor.update(client_id, frame)
+            except Exception as e:
+                print(f"Composite decode error for client {client_id}: {e}")
 
-            if len(data) >= payload_size:
-                packed_msg_size = data[:payload_size]
-                data = data[payload_size:]
-                msg_size = struct.unpack("Q", packed_msg_size)[0]
+    def send_composite(self, canvas):
+        with stage_seconds["composite_encode"].time():
+            payload, width, height = self.codec.encode(canvas)
+        header = video_protocol.pack_header(self.composite_id, self.sequence, time.time(),
+                                            width, height, self.codec.codec_id, len(payload))
+        self.sequence += 1
+        view = memoryview(header + bytes(payload))
+        with lock:
+            viewers = list(clients)
+        for viewer in viewers:
+            viewer.send(self.composite_id, view)
 
-                while len(data) < msg_size:
-                    data += client_socket.recv(4*1024)
+def send_feedback(sender, header):
+    # Tell a sender how its stream is doing: echo its timestamp so it can
+    # measure round trip, plus how many viewers still hold one of its frames
+    # and how many of its frames were skipped for slow viewers so far.
+    viewers = room_members(sender.room)
+    queue_depth = sum(1 for viewer in viewers if sender.client_id in viewer.buffer.pending)
+    dropped = sum(viewer.buffer.dropped_by_source.get(sender.client_id, 0) for viewer in viewers)
+    packet = video_protocol.pack_feedback(sender.client_id, header.timestamp, header.sequence,
+                                          queue_depth, dropped)
+    sender.send(FEEDBACK_SLOT, memoryview(packet))
 
-                frame_data = data[:msg_size]
-                data = data[msg_size:]
+def report_stats(interval):
+    while True:
+        time.sleep(interval)
+        with lock:
+            viewers = list(clients)
+        for viewer in viewers:
+            stats = viewer.stats()
+            print(f"Viewer {viewer.client_id}: sent {stats['sent']}, dropped {stats['dropped']}, "
+                  f"lag avg {stats['lag_ms_avg']:.1f} ms, max {stats['lag_ms_max']:.1f} ms")
 
-                frame = pickle.loads(frame_data)
-                broadcast_frame(client_id, frame)
+def handle_client(viewer):
+    last_feedback = 0.0
+    while True:
+        try:
+            header, packet = video_protocol.read_packet(viewer.socket)
+            if header.codec == video_protocol.CODEC_SUBSCRIBE:
+                viewer.tile_size = tuple(video_protocol.unpack_subscribe(
+                    memoryview(packet)[video_protocol.HEADER_SIZE:]))
+                continue
+            if header.codec == video_protocol.CODEC_JOIN:
+                print(f"Client {viewer.client_id} sent JOIN after its first packet; reconnect to change rooms")
+                continue
+            if video_protocol.is_control(header.codec):
+                continue  # a control packet this relay does not know; never fan it out
+            broadcast_frame(viewer.client_id, viewer.room, header, packet)
+            now = time.monotonic()
+            if now - last_feedback >= feedback_interval:
+                send_feedback(viewer, header)
+                last_feedback = now
+        except ConnectionError:
+            break
         except Exception as e:
             print(f"Error: {e}")
             break
 
-    with lock:
-        if client_socket in clients:
-            clients.remove(client_socket)
-    client_socket.close()
+    remove_client(viewer)
+    viewer.close()
+    layer_sizes.pop(viewer.client_id, None)
+    if composite is not None:
+        composite.remove(viewer.client_id)
+    if room_left is not None:
+        room_left(viewer.room)
+
+def start_recorder():
+    global recorder
+    if record_directory is None:
+        return
+    from video_recording import VideoRecorder
+    recorder = VideoRecorder(record_directory)
+    for key, help in (("recorded", "Frames written to the recording"),
+                      ("dropped", "Frames left out of the recording because the writer fell behind"),
+                      ("bytes", "Bytes written to the recording")):
+        metrics.counter(f"video_recording_{key}_total", help, fn=lambda key=key: recorder.stats[key])
+    print(f"Recording to {record_directory}")
+
+def read_room(client_socket):
+    # Consumes the JOIN if it is the first packet; anything else is left
+    # unread for handle_client
+    client_socket.settimeout(join_timeout)
+    try:
+        data = client_socket.recv(video_protocol.HEADER_SIZE, socket.MSG_PEEK | socket.MSG_WAITALL)
+        if len(data) < video_protocol.HEADER_SIZE:
+            return DEFAULT_ROOM
+        if video_protocol.unpack_header(data).codec != video_protocol.CODEC_JOIN:
+            return DEFAULT_ROOM
+        header, packet = video_protocol.read_packet(client_socket)
+        return str(packet[video_protocol.HEADER_SIZE:], 'utf-8') or DEFAULT_ROOM
+    except (socket.timeout, UnicodeDecodeError, ValueError):
+        return DEFAULT_ROOM
+    finally:
+        client_socket.settimeout(None)
+
+def serve_client(client_socket, client_id, room=None):
+    # Runs on the connection's own thread, so waiting for a JOIN never holds up accept()
+    try:
+        if room is None:
+            room = read_room(client_socket)
+    except OSError:
+        client_socket.close()
+        return
+    viewer = Viewer(client_socket, client_id, room)
+    connections.inc()
+    viewer.writer.start()
+    add_client(viewer)
+    handle_client(viewer)
+
+def listen(host, port):
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(1024)
+    return server_socket
+
+def start_server(host=server_ip, port=server_port):
+    global composite
+    if workers > 1:
+        return start_supervisor(host, port, workers)
+    if composite_fps > 0:
+        composite = ServerCompositor(composite_fps, composite_size, composite_quality)
+        composite.renderer.start()
+    start_recorder()
 
-def start_server():
+    server_socket = listen(host, port)
     print("Server started...")
+    if stats_interval > 0:
+        threading.Thread(target=report_stats, args=(stats_interval,), daemon=True).start()
     client_id_counter = 0
     while True:
         try:
             client_socket, addr = server_socket.accept()
             print(f"Connection from {addr}")
-            with lock:
-                clients.append(client_socket)
-                client_id = client_id_counter
-                client_id_counter += 1
-            threading.Thread(target=handle_client, args=(client_socket, client_id)).start()
+            video_protocol.set_low_latency(client_socket)
+            threading.Thread(target=serve_client, args=(client_socket, client_id_counter), daemon=True).start()
+            client_id_counter += 1
+        except Exception as e:
+            print(f"Server accept error: {e}")
+
+# --- sharding -----------------------------------------------------------------
+
+HANDOFF = struct.Struct("!I")  # client id, followed by the room name; the socket travels as SCM_RIGHTS
+
+# Everything a worker needs from the supervisor's command line. Passed to the
+# worker explicitly: under the spawn and forkserver start methods it imports
+# this module afresh and sees only the defaults above.
+WorkerConfig = namedtuple("WorkerConfig",
+                          "stats_interval feedback_interval join_timeout record_directory metrics_port profiler")
+
+def worker_config(metrics_port=None, profiler=False):
+    return WorkerConfig(stats_interval, feedback_interval, join_timeout, record_directory, metrics_port, profiler)
+
+def run_worker(channel, index, config, inherited=()):
+    # Worker process main: relays the connections the supervisor passes it
+    global room_left, stats_interval, feedback_interval, join_timeout, record_directory
+    stats_interval, feedback_interval = config.stats_interval, config.feedback_interval
+    join_timeout, record_directory = config.join_timeout, config.record_directory
+    for other in inherited:
+        other.close()  # the supervisor's ends, so this worker sees EOF when the supervisor goes
+    channel_lock = threading.Lock()
+
+    def notify_left(room):
+        with channel_lock:
+            channel.send(room.encode('utf-8'))
+
+    room_left = notify_left
+    start_recorder()  # in the worker: the writer thread belongs to it
+    if config.metrics_port is not None:
+        register_process_metrics(metrics)
+        MetricsServer(metrics, port=config.metrics_port,
+                      profiler=SamplingProfiler() if config.profiler else None).start_in_thread()
+    if stats_interval > 0:
+        threading.Thread(target=report_stats, args=(stats_interval,), daemon=True).start()
+    while True:
+        try:
+            message, fds, _, _ = socket.recv_fds(channel, 4096, 1)
+        except (OSError, KeyboardInterrupt):
+            break
+        if not message:
+            break  # the supervisor has exited
+        client_id, = HANDOFF.unpack_from(message)
+        room = message[HANDOFF.size:].decode('utf-8')
+        client_socket = socket.socket(fileno=fds[0])
+        threading.Thread(target=serve_client, args=(client_socket, client_id, room), daemon=True).start()
+
+class Shard:
+    def __init__(self, index, config, inherited=()):
+        self.index = index
+        self.channel, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        # Only a forked worker holds copies of the supervisor's ends
+        inherited = [*inherited, self.channel] if multiprocessing.get_start_method() == "fork" else []
+        self.process = multiprocessing.Process(target=run_worker, args=(child, index, config, inherited),
+                                               name=f"relay-worker-{index}", daemon=True)
+        self.process.start()
+        child.close()
+        self.rooms = {}  # room -> participants handed over and not yet gone
+        self.alive = True
+        self.send_lock = threading.Lock()
+
+    @property
+    def load(self):
+        return sum(self.rooms.values())
+
+    def hand_off(self, client_socket, client_id, room):
+        message = HANDOFF.pack(client_id) + room.encode('utf-8')
+        with self.send_lock:
+            socket.send_fds(self.channel, [message], [client_socket.fileno()])
+        client_socket.close()  # the worker has its own descriptor now
+
+class Supervisor:
+    def __init__(self, count, config):
+        # Workers get metrics ports config.metrics_port, config.metrics_port + 1, ...
+        self.shards = []
+        for i in range(count):
+            port = None if config.metrics_port is None else config.metrics_port + i
+            self.shards.append(Shard(i, config._replace(metrics_port=port),
+                                     [shard.channel for shard in self.shards]))
+        self.owners = {}  # room -> Shard it is pinned to
+        self.lock = threading.Lock()
+        for shard in self.shards:
+            threading.Thread(target=self.watch, args=(shard,), daemon=True).start()
+
+    def place(self, room):
+        with self.lock:
+            shard = self.owners.get(room)
+            if shard is None or not shard.alive:
+                live = [s for s in self.shards if s.alive] or self.shards
+                shard = self.owners[room] = min(live, key=lambda s: s.load)
+            shard.rooms[room] = shard.rooms.get(room, 0) + 1
+            return shard
+
+    def watch(self, shard):
+        # Unpins a room once the last participant its worker had has left
+        while True:
+            try:
+                message = shard.channel.recv(4096)
+            except OSError:
+                message = b""
+            if not message:
+                print(f"Relay worker {shard.index} exited")
+                with self.lock:
+                    shard.alive = False  # its rooms move to another worker as participants reconnect
+                    shard.rooms.clear()
+                return
+            self.release(shard, message.decode('utf-8'))
+
+    def release(self, shard, room):
+        with self.lock:
+            count = shard.rooms.get(room, 0) - 1
+            if count > 0:
+                shard.rooms[room] = count
+            else:
+                shard.rooms.pop(room, None)
+                if self.owners.get(room) is shard:
+                    del self.owners[room]
+
+    def admit(self, client_socket, client_id):
+        shard = None
+        try:
+            room = read_room(client_socket)
+            shard = self.place(room)
+            shard.hand_off(client_socket, client_id, room)
+        except OSError as e:
+            print(f"Hand-off of client {client_id} failed: {e}")
+            if shard is not None:
+                self.release(shard, room)  # the worker never got it, so will not report it leaving
+            client_socket.close()
+
+def start_supervisor(host, port, count, metrics_port=None, profiler=False):
+    supervisor = Supervisor(count, worker_config(metrics_port, profiler))
+    server_socket = listen(host, port)
+    print(f"Server started with {count} relay workers...")
+    client_id_counter = 0
+    while True:
+        try:
+            client_socket, addr = server_socket.accept()
+            video_protocol.set_low_latency(client_socket)
+            threading.Thread(target=supervisor.admit, args=(client_socket, client_id_counter), daemon=True).start()
+            client_id_counter += 1
         except Exception as e:
             print(f"Server accept error: {e}")
 
 if __name__ == "__main__":
-    start_server()
+    parser = argparse.ArgumentParser(description="Video call relay server")
+    parser.add_argument("--host", default=server_ip)
+    parser.add_argument("--port", type=int, default=server_port)
+    parser.add_argument("--stats-interval", type=float, default=stats_interval,
+                        help="print per-viewer lag and dropped frames every N seconds")
+    parser.add_argument("--composite", type=float, default=composite_fps, metavar="FPS",
+                        help="send one tiled mosaic at FPS instead of relaying every stream")
+    parser.add_argument("--composite-size", type=int, nargs=2, default=composite_size, metavar=("W", "H"))
+    parser.add_argument("--workers", type=int, default=workers,
+                        help="relay processes, rooms are spread across them; 0 for one per CPU")
+    parser.add_argument("--record", metavar="DIR", help="record every room's video to DIR")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument("--profiler", action="store_true",
+                        help="allow starting a sampling profiler through the metrics port")
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count()
+    if workers > 1 and args.composite:
+        parser.error("--composite mixes every participant into one mosaic and needs --workers 1")
+    stats_interval, record_directory = args.stats_interval, args.record
+    composite_fps, composite_size = args.composite, tuple(args.composite_size)
+    try:
+        if workers > 1:
+            if args.metrics_port is not None:
+                print(f"Metrics on ports {args.metrics_port}-{args.metrics_port + workers - 1}, one per worker")
+            start_supervisor(args.host, args.port, workers, args.metrics_port, args.profiler)
+        if args.metrics_port is not None:
+            register_process_metrics(metrics)
+            metrics_server = MetricsServer(metrics, port=args.metrics_port,
+                                           profiler=SamplingProfiler() if args.profiler else None).start_in_thread()
+            print(f"Metrics on http://127.0.0.1:{metrics_server.port}/metrics")
+        start_server(args.host, args.port)
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,126 @@
+import time
+import threading
+from collections import namedtuple
+
+# Congestion-aware quality control for camera.send_frames. The sender reports
+# how long each send blocked, the relay echoes frame timestamps back (see
+# video_protocol.pack_feedback), and once per window the controller steps
+# down a ladder of resolution/quality/frame-rate levels when latency or
+# backpressure exceed the target, and back up after a run of healthy windows.
+
+Level = namedtuple("Level", "scale quality fps")
+
+DEFAULT_LADDER = [
+    Level(1.0, 85, 30),
+    Level(1.0, 70, 25),
+    Level(0.75, 70, 20),
+    Level(0.5, 70, 15),
+    Level(0.5, 50, 12),
+    Level(0.25, 50, 8),
+    Level(0.25, 35, 5),
+]
+
+
+class AdaptiveController:
+    def __init__(self, target_latency=0.2, ladder=DEFAULT_LADDER, start_level=3,
+                 window=1.0, upgrade_after=5):
+        self.target_latency = target_latency
+        self.ladder = ladder
+        self.level_index = min(start_level, len(ladder) - 1)
+        self.window = window
+        self.upgrade_after = upgrade_after
+        self.lock = threading.Lock()
+
+        self.rtt = None  # smoothed round trip to the relay, seconds
+        self.last_feedback = None
+        self.last_dropped = 0
+        self.healthy_windows = 0
+        self.last_window = None  # summary of the most recent window, for logging
+        self._reset_window(time.monotonic())
+
+    def _reset_window(self, now):
+        self.window_start = now
+        self.window_frames = 0
+        self.window_bytes = 0
+        self.window_send_time = 0.0
+        self.window_max_rtt = 0.0
+        self.window_drops = 0
+
+    @property
+    def level(self):
+        return self.ladder[self.level_index]
+
+    @property
+    def frame_interval(self):
+        return 1.0 / self.level.fps
+
+    @property
+    def feedback_timeout(self):
+        return max(2 * self.target_latency, self.window)
+
+    def on_frame_sent(self, send_seconds, size):
+        with self.lock:
+            self.window_frames += 1
+            self.window_bytes += size
+            self.window_send_time += send_seconds
+
+    def on_feedback(self, feedback, now=None):
+        if feedback.echo_timestamp <= 0:
+            return  # an echo of a packet with no send time would read as decades of RTT
+        # feedback.queue_depth is not used: the relay counts it just after
+        # queueing the frame being echoed, so nearly every viewer shows up in it
+        rtt = (now or time.time()) - feedback.echo_timestamp
+        received = time.monotonic()
+        with self.lock:
+            # After a gap the old average describes a link that may have changed
+            gap = self.last_feedback is not None and received - self.last_feedback > self.feedback_timeout
+            self.rtt = rtt if self.rtt is None or gap else 0.8 * self.rtt + 0.2 * rtt
+            self.window_max_rtt = max(self.window_max_rtt, rtt)
+            if feedback.dropped > self.last_dropped:
+                self.window_drops += feedback.dropped - self.last_dropped
+            self.last_dropped = feedback.dropped
+            self.last_feedback = received
+
+    def update(self, now=None):
+        # Called by the sender once per frame; returns True when the level changed
+        now = now or time.monotonic()
+        with self.lock:
+            if now - self.window_start < self.window:
+                return False
+
+            interval = self.frame_interval
+            blocked = self.window_send_time / self.window_frames if self.window_frames else 0.0
+            rtt = self.rtt or 0.0
+            feedback_stale = (self.window_frames and self.last_feedback is not None
+                              and now - self.last_feedback > self.feedback_timeout)
+
+            steps = 0
+            if rtt > 2 * self.target_latency or feedback_stale:
+                steps = 2
+            elif rtt > self.target_latency or blocked > 0.5 * interval or self.window_drops:
+                steps = 1
+
+            changed = False
+            if steps:
+                self.healthy_windows = 0
+                new_index = min(self.level_index + steps, len(self.ladder) - 1)
+                changed = new_index != self.level_index
+                self.level_index = new_index
+            elif rtt < self.target_latency / 2 and blocked < 0.2 * interval:
+                self.healthy_windows += 1
+                if self.healthy_windows >= self.upgrade_after and self.level_index > 0:
+                    self.level_index -= 1
+                    self.healthy_windows = 0
+                    changed = True
+
+            self.last_window = {
+                "level": self.level_index,
+                "fps": self.window_frames / (now - self.window_start),
+                "kbps": self.window_bytes * 8 / 1000 / (now - self.window_start),
+                "rtt_ms": rtt * 1000,
+                "max_rtt_ms": self.window_max_rtt * 1000,
+                "blocked_ms": blocked * 1000,
+                "drops": self.window_drops,
+            }
+            self._reset_window(now)
+            return changed
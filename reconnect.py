@@ -0,0 +1,23 @@
+import random
+
+# Reconnect pacing shared by Final_Client.py and camera.py. Delays grow
+# exponentially up to a cap, and each one is jittered so clients dropped by
+# the same server restart do not all come back in the same instant.
+
+
+class Backoff:
+    def __init__(self, initial=0.5, maximum=30.0, factor=2.0, jitter=0.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter  # fraction of each delay that is randomised
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.maximum, self.initial * self.factor ** self.attempts)
+        if delay < self.maximum:
+            self.attempts += 1  # stops growing at the cap; factor ** attempts would overflow eventually
+        return random.uniform(delay * (1 - self.jitter), delay)
+
+    def reset(self):
+        self.attempts = 0
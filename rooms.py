@@ -0,0 +1,41 @@
+import chat_protocol as proto
+
+# Named chat rooms for chat_server.py. Each room is a membership set, so a
+# message costs O(members of its room) instead of O(everyone connected).
+# Like SessionRegistry, rooms are only mutated on the chat engine's loop.
+
+
+class RoomRegistry:
+    def __init__(self):
+        self.rooms = {}  # room name -> {connection: None}, insertion ordered
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def join(self, room, connection):
+        if not room or len(room.encode('utf-8')) > proto.MAX_ROOM_NAME:
+            raise proto.ProtocolError(f"Room names are 1 to {proto.MAX_ROOM_NAME} bytes")
+        if room not in connection.rooms and len(connection.rooms) >= proto.MAX_ROOMS:
+            raise proto.ProtocolError(f"Already in {proto.MAX_ROOMS} rooms")
+        self.rooms.setdefault(room, {})[connection] = None
+        connection.rooms.add(room)
+
+    def leave(self, room, connection):
+        members = self.rooms.get(room)
+        if members is None or connection not in members:
+            return False
+        del members[connection]
+        connection.rooms.discard(room)
+        if not members:
+            del self.rooms[room]
+        return True
+
+    def leave_all(self, connection):
+        for room in list(connection.rooms):
+            self.leave(room, connection)
+
+    def members(self, room):
+        return self.rooms.get(room, {})
+
+    def sizes(self):
+        return {room: len(members) for room, members in self.rooms.items()}
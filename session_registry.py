@@ -0,0 +1,102 @@
+import time
+import itertools
+import threading
+
+# One registry of chat sessions, indexed by session id, connection and
+# username so lookups (kick, routing, resume) are O(1). Mutations happen on
+# the chat engine's loop; other threads (the GUI) read under the lock and
+# learn about changes through listener events instead of rescanning.
+
+AUTHENTICATING = "authenticating"
+ACTIVE = "active"
+CLOSED = "closed"
+
+ADDED = "added"
+UPDATED = "updated"
+REMOVED = "removed"
+
+
+class Session:
+    def __init__(self, session_id, connection, address):
+        self.session_id = session_id
+        self.connection = connection
+        self.address = address
+        self.username = None
+        self.state = AUTHENTICATING
+        self.resume_token = None
+        self.created = time.time()
+
+    @property
+    def label(self):
+        if self.username:
+            return f"{self.username} {self.address}"
+        return f"{self.address}"
+
+
+class SessionRegistry:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self.by_id = {}
+        self.by_connection = {}
+        self.by_username = {}
+        self.active = {}  # connection -> Session, only ACTIVE sessions; iterated by fan-out
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def subscribe(self, listener):
+        # listener(event, session) is called on the mutating thread
+        self.listeners.append(listener)
+
+    def _emit(self, event, session):
+        for listener in self.listeners:
+            listener(event, session)
+
+    def add(self, connection, address):
+        with self.lock:
+            session = Session(next(self._ids), connection, address)
+            self.by_id[session.session_id] = session
+            self.by_connection[connection] = session
+        self._emit(ADDED, session)
+        return session
+
+    def activate(self, session):
+        with self.lock:
+            session.state = ACTIVE
+            self.active[session.connection] = session
+        self._emit(UPDATED, session)
+
+    def set_username(self, session, username):
+        with self.lock:
+            if session.username and self.by_username.get(session.username) is session:
+                del self.by_username[session.username]
+            session.username = username
+            self.by_username[username] = session
+        self._emit(UPDATED, session)
+
+    def remove(self, session):
+        with self.lock:
+            if self.by_id.pop(session.session_id, None) is None:
+                return False
+            self.by_connection.pop(session.connection, None)
+            self.active.pop(session.connection, None)
+            if session.username and self.by_username.get(session.username) is session:
+                del self.by_username[session.username]
+            session.state = CLOSED
+        self._emit(REMOVED, session)
+        return True
+
+    def get(self, session_id):
+        return self.by_id.get(session_id)
+
+    def for_connection(self, connection):
+        return self.by_connection.get(connection)
+
+    def for_username(self, username):
+        return self.by_username.get(username)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.by_id.values())
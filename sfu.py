@@ -0,0 +1,364 @@
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+
+import av
+from aiortc import RTCPeerConnection, MediaStreamTrack, sdp
+from aiortc.contrib.media import MediaRelay, MediaBlackhole
+from aiortc.mediastreams import MediaStreamError
+
+# Selective forwarding for signaling_server.py. Peers join a room; every track
+# they publish is read once through a MediaRelay and forwarded to the other
+# peers in the room that asked to receive media, and datachannel messages are
+# fanned out to the room.
+#
+# aiortc decodes incoming RTP and, by default, every RTCRtpSender encodes its
+# own copy. For video, a SharedVideoEncoder instead encodes each published
+# frame once with VP8 and hands the same packet to every VP8 subscriber, whose
+# sender only packetizes it. Subscribers that negotiated another codec, and
+# audio (cheap to encode), get relayed frames and encode per subscriber.
+#
+# Offers carry a role: "publish" (send only), "subscribe" (receive only) or
+# "both" (the default). A new offer replaces the peer's previous connection
+# with the same role. When the set of publishers in a room changes, every
+# peer with a datachannel is sent
+#   {"type": "publishers", "room": ..., "publishers": [client ids]}
+# and subscribers re-offer to pick up new tracks. Keeping publish and
+# subscribe connections separate means re-subscribing never interrupts what
+# a client is publishing.
+
+DEFAULT_ROOM = "lobby"
+ROLES = ("publish", "subscribe", "both")
+
+# Same realtime settings aiortc's own Vp8Encoder uses
+VP8_OPTIONS = {
+    "cpu-used": "-6",
+    "deadline": "realtime",
+    "lag-in-frames": "0",
+    "noise-sensitivity": "4",
+    "overshoot-pct": "15",
+    "partitions": "0",
+    "static-thresh": "1",
+    "undershoot-pct": "100",
+}
+
+
+class EncodedVideoTrack(MediaStreamTrack):
+    # One subscriber's view of a SharedVideoEncoder: recv() returns av.Packet,
+    # which RTCRtpSender packetizes without encoding
+    kind = "video"
+
+    def __init__(self, encoder, max_queue=30):
+        super().__init__()
+        self.encoder = encoder
+        self.queue = asyncio.Queue(max_queue)
+        self.waiting_for_keyframe = True  # a decoder can only start on one
+        self.dropped = 0
+
+    def push(self, packet):
+        if packet is None:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return
+        if self.waiting_for_keyframe:
+            if not packet.is_keyframe:
+                return
+            self.waiting_for_keyframe = False
+        if self.queue.full():
+            # The subscriber fell behind: discard the backlog and resume at
+            # the next keyframe rather than feed its decoder a broken stream
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.dropped += 1
+            self.waiting_for_keyframe = True
+            self.encoder.request_keyframe()
+            return
+        self.queue.put_nowait(packet)
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        packet = await self.queue.get()
+        if packet is None:
+            self.stop()
+            raise MediaStreamError
+        return packet
+
+    def stop(self):
+        super().stop()
+        self.encoder.unsubscribe(self)
+
+
+class SharedVideoEncoder:
+    def __init__(self, source, bitrate=1_000_000, keyframe_interval=2.0):
+        self.source = source  # unbuffered MediaRelay proxy: a slow encode skips frames
+        self.bitrate = bitrate
+        # Subscribers' keyframe requests (PLI) stop at their own sender, so
+        # keyframes are also sent on a timer
+        self.keyframe_interval = keyframe_interval
+        self.subscribers = set()
+        self.codec = None
+        self.keyframe_requested = True
+        self.last_keyframe = 0.0
+        self.frames_encoded = 0
+        self.task = asyncio.ensure_future(self.run())
+
+    def subscribe(self):
+        track = EncodedVideoTrack(self)
+        self.subscribers.add(track)
+        self.request_keyframe()
+        return track
+
+    def unsubscribe(self, track):
+        self.subscribers.discard(track)
+
+    def request_keyframe(self):
+        self.keyframe_requested = True
+
+    def encode(self, frame, keyframe):
+        # Runs on the default executor; libvpx releases the GIL
+        if frame.format.name != "yuv420p":
+            frame = frame.reformat(format="yuv420p")
+        if self.codec is None or (frame.width, frame.height) != (self.codec.width, self.codec.height):
+            self.codec = av.CodecContext.create("libvpx", "w")
+            self.codec.width = frame.width
+            self.codec.height = frame.height
+            self.codec.pix_fmt = "yuv420p"
+            self.codec.bit_rate = self.bitrate
+            self.codec.gop_size = 3000
+            self.codec.qmin = 2
+            self.codec.qmax = 56
+            self.codec.options = dict(VP8_OPTIONS, bufsize=str(self.bitrate),
+                                      minrate=str(self.bitrate), maxrate=str(self.bitrate))
+            keyframe = True
+        if keyframe:
+            frame.pict_type = av.video.frame.PictureType.I
+        packets = self.codec.encode(frame)
+        if not packets:
+            return None
+        packet = av.Packet(b"".join(bytes(p) for p in packets))
+        packet.pts = frame.pts
+        packet.time_base = frame.time_base
+        packet.is_keyframe = any(p.is_keyframe for p in packets)
+        return packet
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                frame = await self.source.recv()
+                if not self.subscribers:
+                    continue  # keep draining the publisher, but don't encode for nobody
+                now = time.monotonic()
+                keyframe = self.keyframe_requested or now - self.last_keyframe >= self.keyframe_interval
+                if keyframe:
+                    self.keyframe_requested = False
+                    self.last_keyframe = now
+                packet = await loop.run_in_executor(None, self.encode, frame, keyframe)
+                if packet is None:
+                    continue
+                self.frames_encoded += 1
+                for track in list(self.subscribers):
+                    track.push(packet)
+        except MediaStreamError:
+            pass
+        except Exception as e:
+            logging.error(f"Shared video encoder stopped: {e}")
+        finally:
+            for track in list(self.subscribers):
+                track.push(None)
+
+
+class Publication:
+    def __init__(self, peer, track, relay, shared_encoding):
+        self.peer = peer
+        self.track = track
+        self.kind = track.kind
+        self.relay = relay
+        self.encoder = None
+        self.sink = None
+        if self.kind == "video" and shared_encoding:
+            self.encoder = SharedVideoEncoder(relay.subscribe(track, buffered=False))
+        else:
+            # Something has to read the track even with no subscribers, or
+            # aiortc queues its frames forever
+            self.sink = MediaBlackhole()
+            self.sink.addTrack(relay.subscribe(track, buffered=False))
+            asyncio.ensure_future(self.sink.start())
+
+    def frames_track(self):
+        # Decoded frames; the subscriber's sender encodes them itself
+        return self.relay.subscribe(self.track, buffered=(self.kind == "audio"))
+
+    async def close(self):
+        if self.sink is not None:
+            await self.sink.stop()
+
+
+class Peer:
+    def __init__(self, pc, client_id, room, role):
+        self.pc = pc
+        self.client_id = client_id
+        self.room = room
+        self.role = role
+        self.channel = None
+        self.publications = []
+        self.subscriptions = []  # (transceiver, Publication)
+        self.closed = False
+
+
+class Room:
+    def __init__(self, name):
+        self.name = name
+        self.peers = {}  # RTCPeerConnection -> Peer
+
+    def publications(self, exclude_client=None):
+        return [publication for peer in self.peers.values() if peer.client_id != exclude_client
+                for publication in peer.publications]
+
+    def publishers(self):
+        return sorted({peer.client_id for peer in self.peers.values() if peer.publications})
+
+    def broadcast(self, message, exclude=None):
+        # Datachannel fan-out; send() only queues on the SCTP transport
+        sent = 0
+        for peer in self.peers.values():
+            if peer is not exclude and peer.channel is not None and peer.channel.readyState == "open":
+                peer.channel.send(message)
+                sent += 1
+        return sent
+
+
+class SFU:
+    def __init__(self, rtc_config=None, shared_encoding=True, on_peer_closed=None):
+        self.rtc_config = rtc_config
+        self.shared_encoding = shared_encoding
+        self.on_peer_closed = on_peer_closed  # callback(peer), e.g. to tell the GUI
+        self.relay = MediaRelay()
+        self.rooms = {}
+        self.peers = {}  # (room, client id, role) -> Peer
+        self.stats = {"publications": 0, "subscriptions": 0, "shared_subscriptions": 0,
+                      "datachannel_messages": 0, "datachannel_deliveries": 0}
+
+    async def connect(self, offer, client_id, room_name=DEFAULT_ROOM, role="both"):
+        # Negotiates one peer connection; returns it with the answer set
+        if role not in ROLES:
+            raise ValueError(f"Unknown role {role!r}")
+        previous = self.peers.get((room_name, client_id, role))
+        if previous is not None:
+            await self.close_peer(previous)
+
+        room = self.rooms.setdefault(room_name, Room(room_name))
+        pc = RTCPeerConnection(self.rtc_config)
+        peer = Peer(pc, client_id, room, role)
+        room.peers[pc] = peer
+        self.peers[(room_name, client_id, role)] = peer
+
+        @pc.on("datachannel")
+        def on_datachannel(channel):
+            peer.channel = channel
+
+            @channel.on("message")
+            def on_message(message):
+                self.stats["datachannel_messages"] += 1
+                self.stats["datachannel_deliveries"] += room.broadcast(message, exclude=peer)
+
+        @pc.on("track")
+        def on_track(track):
+            if role == "subscribe":
+                return
+            logging.info(f"{client_id} publishes {track.kind} in {room_name}")
+            peer.publications.append(Publication(peer, track, self.relay, self.shared_encoding))
+            self.stats["publications"] += 1
+
+        @pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            if pc.connectionState in ("failed", "closed"):
+                await self.close_peer(peer)
+
+        try:
+            await pc.setRemoteDescription(offer)  # fires "track" for what the peer sends
+            if role != "publish":
+                self.subscribe(peer, sdp.SessionDescription.parse(offer.sdp))
+            await pc.setLocalDescription(await pc.createAnswer())
+            self.share_encoders(peer)
+        except Exception:
+            await self.close_peer(peer)
+            raise
+        if peer.publications:
+            self.announce_publishers(room)
+        return pc
+
+    def subscribe(self, peer, offer):
+        # Fill each m-line the peer wants to receive on with another
+        # publisher's track of the same kind, oldest publications first
+        wanted = {media.rtp.muxId for media in offer.media
+                  if media.kind in ("audio", "video") and media.direction in ("recvonly", "sendrecv")}
+        available = {"audio": deque(), "video": deque()}
+        for publication in peer.room.publications(exclude_client=peer.client_id):
+            available[publication.kind].append(publication)
+        for transceiver in peer.pc.getTransceivers():
+            queue = available.get(transceiver.kind)
+            if transceiver.mid in wanted and transceiver.sender.track is None and queue:
+                publication = queue.popleft()
+                transceiver.sender.replaceTrack(publication.frames_track())
+                transceiver.direction = "sendrecv"  # narrowed by the offer in the answer
+                peer.subscriptions.append((transceiver, publication))
+                self.stats["subscriptions"] += 1
+
+    def share_encoders(self, peer):
+        # The codec is only known once the answer is set. VP8 subscribers of
+        # a shared encoder swap their relayed frames for its packets before
+        # any media flows.
+        if not peer.subscriptions:
+            return
+        answer = sdp.SessionDescription.parse(peer.pc.localDescription.sdp)
+        codecs = {media.rtp.muxId: media.rtp.codecs[0].mimeType.lower()
+                  for media in answer.media if media.rtp.codecs}
+        for transceiver, publication in peer.subscriptions:
+            if publication.encoder is not None and codecs.get(transceiver.mid) == "video/vp8":
+                relayed = transceiver.sender.track
+                transceiver.sender.replaceTrack(publication.encoder.subscribe())
+                relayed.stop()
+                self.stats["shared_subscriptions"] += 1
+
+    def announce_publishers(self, room):
+        room.broadcast(json.dumps({"type": "publishers", "room": room.name, "publishers": room.publishers()}))
+
+    async def close_peer(self, peer):
+        if peer.closed:
+            return
+        peer.closed = True
+        room = peer.room
+        # Bookkeeping first: other peers may be closing concurrently
+        room.peers.pop(peer.pc, None)
+        key = (room.name, peer.client_id, peer.role)
+        if self.peers.get(key) is peer:
+            del self.peers[key]
+        if not room.peers and self.rooms.get(room.name) is room:
+            del self.rooms[room.name]
+        elif peer.publications:
+            self.announce_publishers(room)
+        for transceiver, _ in peer.subscriptions:
+            if transceiver.sender.track is not None:
+                transceiver.sender.track.stop()
+        await peer.pc.close()  # ends the published tracks, and with them their relays and encoders
+        for publication in peer.publications:
+            await publication.close()
+        if self.on_peer_closed is not None:
+            self.on_peer_closed(peer)
+
+    async def close_all(self):
+        await asyncio.gather(*(self.close_peer(peer) for peer in list(self.peers.values())),
+                             return_exceptions=True)
+
+    def snapshot(self):
+        stats = dict(self.stats)
+        stats["rooms"] = len(self.rooms)
+        stats["peers"] = len(self.peers)
+        stats["frames_encoded"] = sum(p.encoder.frames_encoded for room in self.rooms.values()
+                                      for p in room.publications() if p.encoder is not None)
+        return stats
@@ -0,0 +1,200 @@
+import sys
+import asyncio
+import logging
+import argparse
+import threading
+
+from metrics import Registry, MetricsServer, SamplingProfiler, register_process_metrics
+
+# WebRTC signaling and peer connections, on their own asyncio loop. Qt's
+# event loop owns the GUI thread and never runs asyncio, so, like ChatServer,
+# this runs on a daemon thread; ServerGUI observes it through
+# SignalingObserver hooks and acts on it through call_threadsafe().
+#
+# Peers are on the LAN, so by default no STUN server is used: aiortc's default
+# (a public STUN server) makes every answer wait out gathering when that
+# server is unreachable.
+#
+# aiohttp, aiortc and sfu.py take about half a second to import, so they are
+# imported by start(), on the signaling thread: a GUI that creates the server
+# does not wait for them before showing its window.
+#
+# POST /offer takes {"sdp", "type", "client_id"} and optionally "room"
+# (default "lobby") and "role" ("publish", "subscribe" or "both"); media and
+# datachannel messages are forwarded between the peers of a room by sfu.SFU.
+
+
+class SignalingObserver:
+    # Default no-op hooks, called on the signaling loop's thread
+    def on_signaling_started(self, address):
+        pass
+
+    def on_offer_answered(self, client_id, peer_count):
+        pass
+
+    def on_peer_closed(self, client_id, peer_count):
+        pass
+
+
+class SignalingServer:
+    def __init__(self, host='0.0.0.0', port=8080, observer=None, stun_servers=(), shared_encoding=True,
+                 metrics=None):
+        self.host = host
+        self.port = port
+        self.stun_servers = stun_servers
+        self.shared_encoding = shared_encoding
+        self.rtc_config = None
+        self.observer = observer or SignalingObserver()
+        self.sfu = None  # created by start()
+        self.stats = {"offers": 0, "answers": 0, "offer_errors": 0}
+        self.metrics = metrics or Registry()
+        self.register_metrics()
+
+        self.runner = None
+        self.loop = None
+        self._thread = None
+        self._started = threading.Event()
+        self._stopped = None
+        self._stop_requested = False
+
+    def register_metrics(self):
+        m = self.metrics
+        self.negotiation_seconds = m.histogram("webrtc_negotiation_seconds", "Time from offer to answer")
+        self.register_counters(self.stats)
+        # Skipped by scrapes until start() has created the SFU
+        m.gauge("webrtc_peers", "Open peer connections", fn=lambda: len(self.sfu.peers))
+        m.gauge("webrtc_rooms", "Rooms with peers", fn=lambda: len(self.sfu.rooms))
+
+    def register_counters(self, stats):
+        for key in stats:
+            self.metrics.counter(f"webrtc_{key}_total", f"WebRTC {key.replace('_', ' ')}",
+                                 fn=lambda key=key: stats[key])
+
+    async def start(self):
+        from aiohttp import web
+        from aiortc import RTCConfiguration, RTCIceServer
+        from sfu import SFU
+
+        self.loop = asyncio.get_running_loop()
+        self.rtc_config = RTCConfiguration(iceServers=[RTCIceServer(urls=url) for url in self.stun_servers])
+        self.sfu = SFU(self.rtc_config, self.shared_encoding, on_peer_closed=self.peer_closed)
+        self.register_counters(self.sfu.stats)
+        app = web.Application()
+        app.router.add_post('/offer', self.offer)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port, backlog=1024)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        logging.info(f"WebRTC signaling server listening on {self.host}:{self.port}")
+        self.observer.on_signaling_started((self.host, self.port))
+
+    async def serve_forever(self):
+        self._stopped = asyncio.Event()
+        await self.start()
+        self._started.set()
+        if self._stop_requested:
+            self._stopped.set()  # stop() came before the loop was ready for it
+        await self._stopped.wait()
+        await self.close_all()
+        await self.runner.cleanup()
+
+    def start_in_thread(self, wait=True):
+        # wait=False returns at once; failures are logged and
+        # on_signaling_started reports success
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        if not wait:
+            return
+        self._started.wait()
+        if self.runner is None or self.loop is None:
+            raise RuntimeError(f"Signaling server failed to start on {self.host}:{self.port}")
+
+    def _run(self):
+        try:
+            asyncio.run(self.serve_forever())
+        except Exception as e:
+            logging.error(f"Signaling server stopped: {e}")
+        finally:
+            self._started.set()
+
+    def call_threadsafe(self, callback, *args):
+        # Entry point for other threads (the GUI) to act on the signaling loop
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self):
+        # Safe to call from any thread
+        self._stop_requested = True
+        if self.loop is not None and self._stopped is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+
+    async def close_all(self):
+        await self.sfu.close_all()
+
+    def peer_closed(self, peer):
+        self.observer.on_peer_closed(peer.client_id, len(self.sfu.peers))
+
+    async def offer(self, request):
+        from aiohttp import web
+        from aiortc import RTCSessionDescription
+        from sfu import DEFAULT_ROOM
+
+        self.stats["offers"] += 1
+        try:
+            params = await request.json()
+            offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
+            client_id = params["client_id"]
+            room = params.get("room", DEFAULT_ROOM)
+            role = params.get("role", "both")
+        except (ValueError, KeyError) as e:
+            self.stats["offer_errors"] += 1
+            return web.json_response({"error": f"Bad offer: {e}"}, status=400)
+
+        # No trickle ICE: aiortc gathers every candidate inside
+        # setLocalDescription and puts them in the answer SDP, so there is
+        # nothing to send the client separately.
+        try:
+            with self.negotiation_seconds.time():
+                pc = await self.sfu.connect(offer, client_id, room, role)
+        except Exception as e:
+            self.stats["offer_errors"] += 1
+            logging.error(f"Negotiation with {client_id} failed: {e}")
+            return web.json_response({"error": str(e)}, status=400)
+
+        self.stats["answers"] += 1
+        self.observer.on_offer_answered(client_id, len(self.sfu.peers))
+        return web.json_response({
+            "sdp": pc.localDescription.sdp,
+            "type": pc.localDescription.type
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless WebRTC signaling server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--stun", action="append", default=[], help="STUN server URL, e.g. stun:host:3478")
+    parser.add_argument("--per-subscriber-encoding", action="store_true",
+                        help="encode video separately for every subscriber (for comparison)")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this local port")
+    parser.add_argument("--profiler", action="store_true",
+                        help="allow starting a sampling profiler through the metrics port")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    server = SignalingServer(args.host, args.port, stun_servers=args.stun,
+                             shared_encoding=not args.per_subscriber_encoding)
+    if args.metrics_port is not None:
+        register_process_metrics(server.metrics)
+        MetricsServer(server.metrics, port=args.metrics_port,
+                      profiler=SamplingProfiler() if args.profiler else None).start_in_thread()
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
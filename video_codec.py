@@ -0,0 +1,135 @@
+import cv2
+import numpy as np
+
+# Pluggable frame codecs for the video call. A codec turns a BGR frame into
+# payload bytes plus the width/height that go into the video_protocol header,
+# and back. New codecs register themselves in CODECS under a one-byte id.
+
+CODEC_RAW = 0
+CODEC_JPEG = 1
+
+
+class FrameCodec:
+    codec_id = None
+    name = None
+
+    def __init__(self, scale=1.0):
+        # scale < 1.0 shrinks frames before encoding (the resolution knob)
+        self.scale = scale
+
+    def configure(self, quality, scale):
+        # Quality is ignored by codecs without a quality setting
+        self.scale = scale
+
+    def resize(self, frame):
+        if self.scale == 1.0:
+            return frame
+        return cv2.resize(frame, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def encode(self, frame):
+        raise NotImplementedError
+
+    def decode(self, payload, width, height):
+        raise NotImplementedError
+
+
+class RawCodec(FrameCodec):
+    # Passthrough: the payload is the frame's own pixel buffer, no copy
+    codec_id = CODEC_RAW
+    name = "raw"
+
+    def encode(self, frame):
+        frame = np.ascontiguousarray(self.resize(frame))
+        height, width = frame.shape[:2]
+        return memoryview(frame).cast("B"), width, height
+
+    def decode(self, payload, width, height):
+        # Copy out: payload usually lives in a receive buffer that gets reused
+        return np.frombuffer(payload, dtype=np.uint8).reshape(height, width, 3).copy()
+
+
+class JpegCodec(FrameCodec):
+    codec_id = CODEC_JPEG
+    name = "jpeg"
+
+    def __init__(self, quality=80, scale=1.0):
+        super().__init__(scale)
+        self.configure(quality, scale)
+
+    def configure(self, quality, scale):
+        # Used by the adaptive sender to move between quality levels
+        self.quality = quality
+        self.scale = scale
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+    def encode(self, frame):
+        frame = self.resize(frame)
+        height, width = frame.shape[:2]
+        ok, buffer = cv2.imencode(".jpg", frame, self.params)
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        return memoryview(buffer).cast("B"), width, height
+
+    def decode(self, payload, width, height):
+        frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("JPEG decoding failed")
+        return frame
+
+
+CODECS = {codec.codec_id: codec for codec in (RawCodec, JpegCodec)}
+CODEC_NAMES = {codec.name: codec for codec in CODECS.values()}
+
+_decoders = {}
+
+
+def make_codec(name, **options):
+    try:
+        return CODEC_NAMES[name](**options)
+    except KeyError:
+        raise ValueError(f"Unknown codec: {name}") from None
+
+
+def decode_frame(header, payload):
+    # Decoders are stateless, so one instance per codec id is shared
+    decoder = _decoders.get(header.codec)
+    if decoder is None:
+        if header.codec not in CODECS:
+            raise ValueError(f"Unknown codec id: {header.codec}")
+        decoder = _decoders[header.codec] = CODECS[header.codec]()
+    return decoder.decode(payload, header.width, header.height)
+
+
+def make_test_frame(width=640, height=480, index=0):
+    # Synthetic camera-like frame (moving gradient plus noise) for benchmarks
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = (x + index * 4) % 256
+    frame[..., 1] = (y + index * 2) % 256
+    frame[..., 2] = ((x + y) / 2) % 256
+    noise = np.random.default_rng(index).integers(0, 16, size=frame.shape, dtype=np.uint8)
+    frame += noise
+    cv2.putText(frame, f"frame {index}", (20, height // 2), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+    return frame
+
+
+class SyntheticCapture:
+    # Stand-in for cv2.VideoCapture that cycles through generated frames
+    def __init__(self, width=640, height=480, count=30):
+        self.frames = [make_test_frame(width, height, i) for i in range(count)]
+        self.index = 0
+
+    def read(self, image=None):
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        if image is None or image.shape != frame.shape:
+            return True, frame.copy()
+        np.copyto(image, frame)
+        return True, image
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
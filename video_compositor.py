@@ -0,0 +1,125 @@
+import math
+import time
+import threading
+
+import cv2
+import numpy as np
+
+# Tiled mosaic for multi-party video. The canvas is allocated once; every
+# participant owns a fixed tile and each new frame is resized straight into
+# that tile, so only the changed region is touched and frames of any size
+# fit. Used by camera.py for display and by new_camera_server.py --composite.
+
+COMPOSITE_ID = 0xFFFFFFFF  # header client_id of a server-composited frame
+
+
+class TiledCompositor:
+    def __init__(self, width=1280, height=720, max_tiles=9):
+        self.width = width
+        self.height = height
+        self.columns = math.ceil(math.sqrt(max_tiles))
+        self.rows = math.ceil(max_tiles / self.columns)
+        self.tile_width = width // self.columns
+        self.tile_height = height // self.rows
+        self.canvas = np.zeros((height, width, 3), dtype=np.uint8)
+        self.tiles = {}  # client id -> tile index
+        self.placement = {}  # client id -> (source shape, tile view to resize into)
+        self.last_seen = {}  # client id -> time of last update
+        self.free = list(range(self.columns * self.rows))
+        self.lock = threading.Lock()
+        self.version = 0  # bumped on every change, lets renderers skip idle ticks
+
+    def _tile_view(self, index):
+        row, column = divmod(index, self.columns)
+        x, y = column * self.tile_width, row * self.tile_height
+        return self.canvas[y:y + self.tile_height, x:x + self.tile_width]
+
+    def _fit(self, tile, shape):
+        # Largest region of the tile with the source's aspect ratio, centred
+        height, width = shape[:2]
+        scale = min(self.tile_width / width, self.tile_height / height)
+        fit_width, fit_height = max(1, int(width * scale)), max(1, int(height * scale))
+        x = (self.tile_width - fit_width) // 2
+        y = (self.tile_height - fit_height) // 2
+        return tile[y:y + fit_height, x:x + fit_width]
+
+    def update(self, client_id, frame):
+        with self.lock:
+            index = self.tiles.get(client_id)
+            if index is None:
+                if not self.free:
+                    return False  # more participants than tiles
+                index = self.tiles[client_id] = self.free.pop(0)
+
+            placement = self.placement.get(client_id)
+            if placement is None or placement[0] != frame.shape:
+                tile = self._tile_view(index)
+                tile[:] = 0
+                placement = self.placement[client_id] = (frame.shape, self._fit(tile, frame.shape))
+            target = placement[1]
+            cv2.resize(frame, (target.shape[1], target.shape[0]), dst=target, interpolation=cv2.INTER_AREA)
+            self.last_seen[client_id] = time.monotonic()
+            self.version += 1
+            return True
+
+    def remove(self, client_id):
+        with self.lock:
+            index = self.tiles.pop(client_id, None)
+            self.placement.pop(client_id, None)
+            self.last_seen.pop(client_id, None)
+            if index is not None:
+                self._tile_view(index)[:] = 0
+                self.free.append(index)
+                self.free.sort()
+                self.version += 1
+
+    def remove_stale(self, max_age):
+        # Frees tiles of participants that stopped sending (e.g. left the call)
+        now = time.monotonic()
+        stale = [cid for cid, seen in list(self.last_seen.items()) if now - seen > max_age]
+        for client_id in stale:
+            self.remove(client_id)
+        return stale
+
+    def snapshot(self, out=None):
+        # Copy of the canvas that is safe to hand to another thread
+        with self.lock:
+            if out is None:
+                return self.canvas.copy()
+            np.copyto(out, self.canvas)
+            return out
+
+
+class CompositeRenderer:
+    # Calls on_frame(canvas) at a fixed rate, only when the mosaic changed
+    def __init__(self, compositor, fps, on_frame, before_render=None):
+        self.compositor = compositor
+        self.interval = 1.0 / fps
+        self.on_frame = on_frame
+        self.before_render = before_render
+        self.stop_event = threading.Event()
+        self.output = np.empty_like(compositor.canvas)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        rendered_version = -1
+        next_tick = time.perf_counter()
+        while not self.stop_event.is_set():
+            if self.before_render is not None:
+                self.before_render()
+            if self.compositor.version != rendered_version:
+                rendered_version = self.compositor.version
+                self.on_frame(self.compositor.snapshot(self.output))
+            next_tick += self.interval
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                self.stop_event.wait(delay)
+            else:
+                next_tick = time.perf_counter()
@@ -0,0 +1,124 @@
+import struct
+import socket
+from collections import namedtuple
+
+# Wire format shared by camera.py and new_camera_server.py. Every packet is a
+# fixed typed header followed by `length` bytes of codec payload:
+#
+#   client_id  sequence  timestamp  width  height  codec  layer  length
+#   uint32     uint32    float64    uint16 uint16  uint8  uint8  uint32
+#
+# With simulcast a sender encodes each frame at several resolutions, layer 0
+# being the largest; all layers of a frame share its sequence number.
+#
+# The payload is produced by a codec from video_codec.py; this module never
+# touches pixels, so the server can use it without cv2 or numpy. Codec ids
+# from 200 up are reserved for control packets that carry no video.
+
+HEADER = struct.Struct("!IIdHHBBI")
+HEADER_SIZE = HEADER.size
+CLIENT_ID = struct.Struct("!I")  # first header field, rewritten in place by the relay
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+FIRST_CONTROL_CODEC = 200
+CODEC_FEEDBACK = 255  # relay -> sender: echoed timestamp plus congestion counters
+FEEDBACK = struct.Struct("!dIII")
+CODEC_SUBSCRIBE = 254  # viewer -> relay: the tile size it displays each participant at
+SUBSCRIBE = struct.Struct("!HH")
+CODEC_JOIN = 253  # participant -> relay, first packet only: the room's name in UTF-8
+
+FrameHeader = namedtuple("FrameHeader", "client_id sequence timestamp width height codec layer length")
+Feedback = namedtuple("Feedback", "echo_timestamp echo_sequence queue_depth dropped")
+
+
+def pack_header(client_id, sequence, timestamp, width, height, codec, length, layer=0):
+    return HEADER.pack(client_id, sequence, timestamp, width, height, codec, layer, length)
+
+
+def unpack_header(data):
+    header = FrameHeader._make(HEADER.unpack_from(data))
+    if header.length > MAX_PAYLOAD:
+        raise ValueError(f"Frame payload of {header.length} bytes exceeds {MAX_PAYLOAD}")
+    return header
+
+
+def is_control(codec):
+    return codec >= FIRST_CONTROL_CODEC
+
+
+def pack_feedback(client_id, echo_timestamp, echo_sequence, queue_depth, dropped):
+    payload = FEEDBACK.pack(echo_timestamp, echo_sequence, queue_depth, dropped)
+    return pack_header(client_id, echo_sequence, echo_timestamp, 0, 0, CODEC_FEEDBACK, len(payload)) + payload
+
+
+def unpack_feedback(payload):
+    return Feedback._make(FEEDBACK.unpack_from(payload))
+
+
+def pack_subscribe(tile_width, tile_height):
+    payload = SUBSCRIBE.pack(tile_width, tile_height)
+    return pack_header(0, 0, 0.0, 0, 0, CODEC_SUBSCRIBE, len(payload)) + payload
+
+
+def unpack_subscribe(payload):
+    return SUBSCRIBE.unpack_from(payload)
+
+
+def pack_join(room):
+    payload = room.encode('utf-8')
+    return pack_header(0, 0, 0.0, 0, 0, CODEC_JOIN, len(payload)) + payload
+
+
+def send_packet(sock, header, payload):
+    # header is a FrameHeader or packed bytes; payload is any bytes-like object
+    if isinstance(header, FrameHeader):
+        header = HEADER.pack(*header)
+    sock.sendall(header)
+    sock.sendall(payload)
+
+
+def recv_exact_into(sock, view):
+    while view:
+        n = sock.recv_into(view)
+        if not n:
+            raise ConnectionError("Connection closed by peer")
+        view = view[n:]
+
+
+class PacketReader:
+    # Reads packets into buffers that are reused across calls. The payload
+    # returned by read() is only valid until the next read().
+    def __init__(self, sock, initial_size=256 * 1024):
+        self.sock = sock
+        self.header_buffer = bytearray(HEADER_SIZE)
+        self.payload_buffer = bytearray(initial_size)
+
+    def read(self):
+        recv_exact_into(self.sock, memoryview(self.header_buffer))
+        header = unpack_header(self.header_buffer)
+        if header.length > len(self.payload_buffer):
+            self.payload_buffer = bytearray(header.length)
+        payload = memoryview(self.payload_buffer)[:header.length]
+        recv_exact_into(self.sock, payload)
+        return header, payload
+
+
+def read_packet(sock):
+    # Reads one packet into a fresh buffer holding header and payload back to
+    # back, ready to be forwarded as-is. Unlike PacketReader the buffer is
+    # owned by the caller, so it can be shared between send queues.
+    header_buffer = bytearray(HEADER_SIZE)
+    recv_exact_into(sock, memoryview(header_buffer))
+    header = unpack_header(header_buffer)
+    packet = bytearray(HEADER_SIZE + header.length)
+    packet[:HEADER_SIZE] = header_buffer
+    recv_exact_into(sock, memoryview(packet)[HEADER_SIZE:])
+    return header, packet
+
+
+def set_client_id(packet, client_id):
+    CLIENT_ID.pack_into(packet, 0, client_id)
+
+
+def set_low_latency(sock):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
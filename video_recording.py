@@ -0,0 +1,319 @@
+import os
+import sys
+import mmap
+import time
+import queue
+import bisect
+import socket
+import struct
+import logging
+import argparse
+import threading
+from array import array
+from urllib.parse import quote, unquote
+
+import video_protocol
+
+# Recording and replay of relay rooms for new_camera_server.py --record.
+#
+# The relay hands each packet it fans out (header with the sender's id
+# stamped in, then the encoded payload, exactly as viewers get it) to a
+# VideoRecorder, which only puts it on a bounded queue; a writer thread does
+# the disk I/O. When the queue is full the frame is dropped and counted, so a
+# slow disk never holds up live fan-out. Codecs in video_codec.py are
+# intra-only, so a dropped frame costs nothing but itself.
+#
+# Each room has a directory of segments named after the time of their first
+# frame. A segment is a .vrec file of records (receive time, then the packet)
+# and a .vidx file of (time, offset) pairs, one per record. Playback maps a
+# segment with mmap and bisects its index to seek, so only the pages actually
+# played are read.
+#
+#   python video_recording.py info recordings
+#   python video_recording.py serve recordings --room lobby --port 5001 --seek 30
+
+RECORD = struct.Struct("!d")  # relay receive time, seconds since the epoch
+INDEX_ENTRY = struct.Struct("!dQ")  # record time, offset in the .vrec file
+DATA_SUFFIX = ".vrec"
+INDEX_SUFFIX = ".vidx"
+
+
+def room_directory(directory, room):
+    return os.path.join(directory, quote(room, safe=""))
+
+
+def segment_name(first_time):
+    return f"{int(first_time * 1_000_000):020d}"
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path  # without suffix
+        self.first_time = int(os.path.basename(path)) / 1_000_000
+        self.times = array('d')
+        self.offsets = array('Q')
+        self.size = 0
+
+    @property
+    def last_time(self):
+        return self.times[-1] if self.times else self.first_time
+
+    @classmethod
+    def load(cls, path):
+        # Reads the index; records past the end of the data file (a crash
+        # between the two writes) are left out. Without an index the data
+        # file is scanned.
+        segment = cls(path)
+        segment.size = os.path.getsize(path + DATA_SUFFIX)
+        try:
+            with open(path + INDEX_SUFFIX, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            segment.scan()
+            return segment
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        for timestamp, offset in INDEX_ENTRY.iter_unpack(memoryview(data)[:usable]):
+            if offset >= segment.size:
+                break
+            segment.times.append(timestamp)
+            segment.offsets.append(offset)
+        if segment.times and not segment.complete(len(segment.times) - 1):
+            segment.times.pop()  # the last record was only partly written
+            segment.offsets.pop()
+        return segment
+
+    def complete(self, index):
+        offset = self.offsets[index] + RECORD.size
+        with open(self.path + DATA_SUFFIX, "rb") as f:
+            f.seek(offset)
+            data = f.read(video_protocol.HEADER_SIZE)
+        if len(data) < video_protocol.HEADER_SIZE:
+            return False
+        return offset + video_protocol.HEADER_SIZE + video_protocol.unpack_header(data).length <= self.size
+
+    def scan(self):
+        with open(self.path + DATA_SUFFIX, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = 0
+                while offset + RECORD.size + video_protocol.HEADER_SIZE <= len(data):
+                    (timestamp,) = RECORD.unpack_from(data, offset)
+                    header = video_protocol.unpack_header(data[offset + RECORD.size:
+                                                               offset + RECORD.size + video_protocol.HEADER_SIZE])
+                    if offset + RECORD.size + video_protocol.HEADER_SIZE + header.length > len(data):
+                        break
+                    self.times.append(timestamp)
+                    self.offsets.append(offset)
+                    offset += RECORD.size + video_protocol.HEADER_SIZE + header.length
+
+    def record_end(self, index):
+        return self.offsets[index + 1] if index + 1 < len(self.offsets) else self.size
+
+
+class VideoRecorder:
+    def __init__(self, directory, layers=(0,), segment_bytes=256 * 1024 * 1024, queue_size=256,
+                 flush_interval=1.0):
+        self.directory = directory
+        self.layers = frozenset(layers)  # simulcast layers kept, 0 being the largest
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.files = {}  # room -> [data file, index file, bytes written]
+        self.stats = {"recorded": 0, "dropped": 0, "bytes": 0, "segments": 0}
+        self.drop_lock = threading.Lock()  # record() runs on every sender's thread
+        self._writer = threading.Thread(target=self._write_loop, name="video-recorder", daemon=True)
+        self._writer.start()
+
+    def record(self, room, header, packet):
+        # Called on the fan-out path: never blocks. packet must not change
+        # after this call; the relay's buffers never do once they are sent.
+        if header.layer not in self.layers:
+            return
+        try:
+            self.queue.put_nowait((room, time.time(), packet))
+        except queue.Full:
+            with self.drop_lock:
+                self.stats["dropped"] += 1
+
+    def close(self):
+        self.queue.put(None)
+        self._writer.join()
+
+    def _write_loop(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                try:
+                    self._write(*item)
+                except OSError as e:
+                    with self.drop_lock:
+                        self.stats["dropped"] += 1
+                    logging.error(f"Recording write failed: {e}")
+            if not item or time.monotonic() - last_flush >= self.flush_interval:
+                self._flush()
+                last_flush = time.monotonic()
+        self._flush()
+        for data_file, index_file, _ in self.files.values():
+            data_file.close()
+            index_file.close()
+
+    def _write(self, room, timestamp, packet):
+        files = self.files.get(room)
+        if files is None or files[2] >= self.segment_bytes:
+            files = self._rotate(room, timestamp)
+        data_file, index_file, offset = files
+        data_file.write(RECORD.pack(timestamp))
+        data_file.write(packet)
+        index_file.write(INDEX_ENTRY.pack(timestamp, offset))
+        files[2] = offset + RECORD.size + len(packet)
+        self.stats["recorded"] += 1
+        self.stats["bytes"] += RECORD.size + len(packet)
+
+    def _rotate(self, room, timestamp):
+        old = self.files.pop(room, None)
+        if old is not None:
+            old[0].close()
+            old[1].close()
+        directory = room_directory(self.directory, room)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, segment_name(timestamp))
+        files = self.files[room] = [open(path + DATA_SUFFIX, "ab"), open(path + INDEX_SUFFIX, "ab"), 0]
+        files[2] = files[0].tell()
+        self.stats["segments"] += 1
+        return files
+
+    def _flush(self):
+        # Data before index, so an index entry never points past the data
+        for data_file, index_file, _ in self.files.values():
+            data_file.flush()
+            index_file.flush()
+
+
+class Recording:
+    # One room's segments, read-only. Times passed in and out are seconds
+    # from the start of the recording.
+    def __init__(self, directory, room):
+        self.directory = room_directory(directory, room)
+        names = sorted(n[:-len(DATA_SUFFIX)] for n in os.listdir(self.directory) if n.endswith(DATA_SUFFIX))
+        self.segments = [Segment.load(os.path.join(self.directory, name)) for name in names]
+        self.segments = [segment for segment in self.segments if segment.times]
+        if not self.segments:
+            raise ValueError(f"No frames recorded in {self.directory}")
+        self.start_time = self.segments[0].times[0]
+
+    @property
+    def duration(self):
+        return self.segments[-1].last_time - self.start_time
+
+    def frames(self, seek=0.0):
+        # Yields (seconds from start, packet) from the first frame at or after
+        # seek. The packet is a view into the mapped file, valid until the
+        # next frame is taken.
+        target = self.start_time + seek
+        first = max(0, bisect.bisect_right([s.first_time for s in self.segments], target) - 1)
+        for segment in self.segments[first:]:
+            with open(segment.path + DATA_SUFFIX, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = memoryview(mapped)
+            try:
+                for index in range(bisect.bisect_left(segment.times, target), len(segment.times)):
+                    packet = data[segment.offsets[index] + RECORD.size:segment.record_end(index)]
+                    try:
+                        yield segment.times[index] - self.start_time, packet
+                    finally:
+                        packet.release()
+            finally:
+                data.release()
+                mapped.close()
+
+    def play(self, seek=0.0, speed=1.0):
+        # frames() at the pace they were recorded
+        started = time.monotonic()
+        for offset, packet in self.frames(seek):
+            delay = (offset - seek) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+            yield offset, packet
+
+
+def list_rooms(directory):
+    return sorted(unquote(name) for name in os.listdir(directory)
+                  if os.path.isdir(os.path.join(directory, name)))
+
+
+def serve_replay(recording, host, port, seek=0.0, speed=1.0, loop=False):
+    # Stands in for the relay: camera.py (or any viewer) connects and gets the
+    # room as recorded, each connection with its own playback from seek.
+    # Whatever the viewer sends is read and ignored.
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(16)
+    print(f"Replaying {recording.duration:.1f}s from {recording.directory} on {host}:{port}")
+    while True:
+        client_socket, addr = server_socket.accept()
+        print(f"Replay viewer {addr}")
+        video_protocol.set_low_latency(client_socket)
+        threading.Thread(target=discard_input, args=(client_socket,), daemon=True).start()
+        threading.Thread(target=stream_replay, args=(recording, client_socket, seek, speed, loop),
+                         daemon=True).start()
+
+
+def discard_input(client_socket):
+    try:
+        while client_socket.recv(65536):
+            pass
+    except OSError:
+        pass
+
+
+def stream_replay(recording, client_socket, seek, speed, loop):
+    try:
+        while True:
+            for _, packet in recording.play(seek, speed):
+                client_socket.sendall(packet)
+            if not loop:
+                break
+    except OSError:
+        pass
+    finally:
+        try:
+            client_socket.shutdown(socket.SHUT_RDWR)  # also wakes discard_input
+        except OSError:
+            pass
+        client_socket.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and replay relay recordings")
+    parser.add_argument("directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("info", help="list recorded rooms")
+    serve = commands.add_parser("serve", help="replay a room to viewers that connect")
+    serve.add_argument("--room", default="lobby")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=5001)
+    serve.add_argument("--seek", type=float, default=0.0, help="seconds from the start of the recording")
+    serve.add_argument("--speed", type=float, default=1.0)
+    serve.add_argument("--loop", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        for room in list_rooms(args.directory):
+            recording = Recording(args.directory, room)
+            frames = sum(len(segment.times) for segment in recording.segments)
+            size = sum(segment.size for segment in recording.segments)
+            print(f"{room}: {recording.duration:.1f}s, {frames} frames, {len(recording.segments)} segments, "
+                  f"{size / 1e6:.1f} MB, from {time.ctime(recording.start_time)}")
+    else:
+        try:
+            serve_replay(Recording(args.directory, args.room), args.host, args.port,
+                         args.seek, args.speed, args.loop)
+        except KeyboardInterrupt:
+            sys.exit(0)